@@ -1,7 +1,8 @@
 import json
 import os
 import logging
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+from analyses.biomarkers import normalize_parsed_data
 from .textract_utils import parse_document_with_textract
 
 # Configure logging
@@ -11,6 +12,7 @@ logger = logging.getLogger(__name__)
 class OpenAIService:
     def __init__(self):
         self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        self.async_client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'))
     
     def parse_blood_test_with_textract(self, file_obj, filename):
         """
@@ -62,7 +64,38 @@ class OpenAIService:
         Returns:
             dict: Contains both parsed_data (structured biomarkers) and analysis (text)
         """
+        prompt = self._build_analysis_prompt(raw_textract_data)
         
+        # Call GPT-5.1 with responses API
+        response = self.client.responses.create(
+            model="gpt-5.1",
+            input=prompt,
+            reasoning={"effort": "medium"},
+            text={"verbosity": "medium"}
+        )
+        
+        return self._build_analysis_result(response.output_text)
+    
+    async def aanalyze_blood_test(self, raw_textract_data):
+        """
+        Async version of analyze_blood_test.
+        Awaits the GPT-5.1 call instead of blocking the worker for its duration.
+        """
+        prompt = self._build_analysis_prompt(raw_textract_data)
+        
+        response = await self.async_client.responses.create(
+            model="gpt-5.1",
+            input=prompt,
+            reasoning={"effort": "medium"},
+            text={"verbosity": "medium"}
+        )
+        
+        return self._build_analysis_result(response.output_text)
+    
+    def _build_analysis_prompt(self, raw_textract_data):
+        """
+        Build the combined extraction and analysis prompt from raw Textract output.
+        """
         # Format the raw Textract data for GPT-5.1
         textract_summary = self._format_textract_for_gpt(raw_textract_data)
         
@@ -113,6 +146,7 @@ IMPORTANT EXTRACTION RULES:
 - Look primarily at the TABLES for test results - they usually have columns like: Test Name | Result | Normal Range | Units
 - The key-value pairs may contain patient info but are often noisy for biomarkers
 - Compare each value to its reference range to determine status (high/low/normal)
+- Copy marker names, values, units and reference ranges exactly as printed; do not convert units
 
 THEN, after the JSON block, provide a SECOND JSON block with structured analysis in this EXACT format:
 ```json
@@ -143,20 +177,19 @@ IMPORTANT ANALYSIS RULES:
 - Be thorough - every biomarker in test_results should be mentioned in at least one section
 
 After the second JSON block, you may include additional detailed analysis text if needed."""
-
-        # Call GPT-5.1 with responses API
-        response = self.client.responses.create(
-            model="gpt-5.1",
-            input=prompt,
-            reasoning={"effort": "medium"},
-            text={"verbosity": "medium"}
-        )
-        
-        output_text = response.output_text
         
+        return prompt
+    
+    def _build_analysis_result(self, output_text):
+        """
+        Turn the GPT-5.1 output into parsed_data, analysis text and structured analysis.
+        """
         # Parse the response to extract JSON data, structured analysis, and remaining text
         parsed_data, structured_analysis, analysis_text = self._parse_gpt_response(output_text)
         
+        # Canonical markers and units are computed locally; statuses are checked against simple ranges
+        parsed_data = normalize_parsed_data(parsed_data)
+        
         logger.info("")
         logger.info("="*60)
         logger.info("✅ GPT-5.1 EXTRACTION & ANALYSIS COMPLETE")
@@ -1,3 +1,34 @@
-from django.test import TestCase
+import json
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TestCase
+from rest_framework.test import APIClient
+from .views import ANALYSIS_ERROR_MESSAGE, AsyncAnalyzeBloodTestView
 
-# Create your tests here.
+
+def upload():
+    return {'file': SimpleUploadedFile('report.png', b'not really a png', content_type='image/png')}
+
+
+class AnalyzeErrorTests(TestCase):
+    """Failures are logged with their traceback; the client only gets a generic message."""
+
+    def test_sync_view(self):
+        with mock.patch('ai_analysis.views.OpenAIService') as service, \
+                self.assertLogs('ai_analysis.views', 'ERROR') as logs:
+            service().parse_blood_test_with_textract.side_effect = RuntimeError('secret detail')
+            response = APIClient().post('/api/ai/analyze/', upload(), format='multipart')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json(), {'error': ANALYSIS_ERROR_MESSAGE})
+        self.assertIn('secret detail', '\n'.join(logs.output))
+
+    def test_async_view(self):
+        request = RequestFactory().post('/api/ai/analyze/', upload())
+        with mock.patch('ai_analysis.views.get_async_ai_service') as service, \
+                self.assertLogs('ai_analysis.views', 'ERROR') as logs:
+            service().parse_blood_test_with_textract.side_effect = RuntimeError('secret detail')
+            response = async_to_sync(AsyncAnalyzeBloodTestView.as_view())(request)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(json.loads(response.content), {'error': ANALYSIS_ERROR_MESSAGE})
+        self.assertIn('Traceback', '\n'.join(logs.output))
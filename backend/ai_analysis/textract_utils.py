@@ -7,6 +7,7 @@ import time
 import json
 import logging
 import boto3
+from tasks.queue import task
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -197,20 +198,31 @@ def upload_to_s3(file_obj, filename):
     return s3_key
 
 
+@task()
+def delete_s3_object(s3_key):
+    """
+    Delete a file from S3. Errors are raised so the task is retried.
+    
+    Args:
+        s3_key: S3 key of the file to delete
+    """
+    s3 = get_s3_client()
+    bucket = os.getenv("AWS_S3_BUCKET")
+    s3.delete_object(Bucket=bucket, Key=s3_key)
+    logger.info(f"🗑️  Cleaned up S3 file: {s3_key}")
+
+
 def delete_from_s3(s3_key):
     """
-    Delete a file from S3.
+    Queue deletion of a file from S3 for the task workers.
     
     Args:
         s3_key: S3 key of the file to delete
     """
     try:
-        s3 = get_s3_client()
-        bucket = os.getenv("AWS_S3_BUCKET")
-        s3.delete_object(Bucket=bucket, Key=s3_key)
-        logger.info(f"🗑️  Cleaned up S3 file: {s3_key}")
+        delete_s3_object.enqueue(s3_key=s3_key)
     except Exception as e:
-        logger.warning(f"Failed to cleanup S3 file: {e}")
+        logger.warning(f"Failed to queue S3 cleanup: {e}")
 
 
 def run_textract_analysis(s3_key, max_wait_seconds=120):
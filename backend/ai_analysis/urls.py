@@ -1,7 +1,11 @@
+from django.conf import settings
 from django.urls import path
-from .views import AnalyzeBloodTestView, HealthCheckView
+from .views import AnalyzeBloodTestView, AsyncAnalyzeBloodTestView, HealthCheckView
+
+# Under ASGI the analysis endpoint is served by the async view
+analyze_view = AsyncAnalyzeBloodTestView if settings.ASYNC_VIEWS else AnalyzeBloodTestView
 
 urlpatterns = [
-    path('analyze/', AnalyzeBloodTestView.as_view(), name='analyze-blood-test'),
+    path('analyze/', analyze_view.as_view(), name='analyze-blood-test'),
     path('health/', HealthCheckView.as_view(), name='health-check'),
 ]
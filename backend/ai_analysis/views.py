@@ -2,15 +2,31 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.parsers import MultiPartParser, FormParser
+from django.http import JsonResponse
 from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from .serializers import BloodTestUploadSerializer, BloodTestAnalysisSerializer
 from .services import OpenAIService
+from idempotency.decorators import idempotent
+import asyncio
 import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_UPLOAD_TYPES = ['image/jpeg', 'image/jpg', 'image/png', 'application/pdf']
+
+# Returned instead of exception details, which are only logged
+PARSE_ERROR_MESSAGE = 'Failed to parse blood test data'
+ANALYSIS_ERROR_MESSAGE = 'Failed to analyze blood test'
 
 
 class AnalyzeBloodTestView(APIView):
     parser_classes = (MultiPartParser, FormParser)
     
+    @idempotent('ai-analyze')
     def post(self, request, *args, **kwargs):
         """
         Endpoint to upload and analyze blood test image/PDF
@@ -32,10 +48,9 @@ class AnalyzeBloodTestView(APIView):
         uploaded_file = serializer.validated_data['file']
         
         # Validate file type
-        allowed_types = ['image/jpeg', 'image/jpg', 'image/png', 'application/pdf']
-        if uploaded_file.content_type not in allowed_types:
+        if uploaded_file.content_type not in ALLOWED_UPLOAD_TYPES:
             return Response(
-                {'error': f'Invalid file type. Allowed types: {", ".join(allowed_types)}'},
+                {'error': f'Invalid file type. Allowed types: {", ".join(ALLOWED_UPLOAD_TYPES)}'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
@@ -83,20 +98,93 @@ class AnalyzeBloodTestView(APIView):
                 status=status.HTTP_200_OK
             )
             
-        except json.JSONDecodeError as e:
+        except json.JSONDecodeError:
+            logger.exception("Could not parse the extracted blood test data")
             return Response(
-                {'error': 'Failed to parse blood test data', 'details': str(e)},
+                {'error': PARSE_ERROR_MESSAGE},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            logger.exception("Blood test analysis failed")
             return Response(
-                {'error': 'Failed to analyze blood test', 'details': str(e)},
+                {'error': ANALYSIS_ERROR_MESSAGE},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
 
+# Shared service for the async view so the AsyncOpenAI connection pool is reused
+_async_ai_service = None
+
+
+def get_async_ai_service():
+    global _async_ai_service
+    if _async_ai_service is None:
+        _async_ai_service = OpenAIService()
+    return _async_ai_service
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAnalyzeBloodTestView(View):
+    """
+    Async version of AnalyzeBloodTestView for ASGI deployments.
+    Textract polling runs in a thread and the GPT-5.1 call is awaited,
+    so a single worker can serve many analyses at once.
+    """
+    
+    @idempotent('ai-analyze')
+    async def post(self, request, *args, **kwargs):
+        serializer = BloodTestUploadSerializer(data=request.FILES)
+        
+        if not serializer.is_valid():
+            return JsonResponse(
+                {'error': 'Invalid file upload', 'details': serializer.errors},
+                status=400
+            )
+        
+        uploaded_file = serializer.validated_data['file']
+        
+        if uploaded_file.content_type not in ALLOWED_UPLOAD_TYPES:
+            return JsonResponse(
+                {'error': f'Invalid file type. Allowed types: {", ".join(ALLOWED_UPLOAD_TYPES)}'},
+                status=400
+            )
+        
+        try:
+            ai_service = get_async_ai_service()
+            
+            # Step 1: Textract is a blocking boto3 upload + poll loop
+            raw_textract_data = await asyncio.to_thread(
+                ai_service.parse_blood_test_with_textract,
+                uploaded_file,
+                uploaded_file.name
+            )
+            
+            # Step 2: GPT-5.1 extraction & analysis
+            result = await ai_service.aanalyze_blood_test(raw_textract_data)
+            
+            response_serializer = BloodTestAnalysisSerializer({
+                'parsed_data': result['parsed_data'],
+                'analysis': result['analysis'],
+                'structured_analysis': result.get('structured_analysis'),
+                'created_at': timezone.now()
+            })
+            
+            return JsonResponse(response_serializer.data)
+            
+        except json.JSONDecodeError:
+            logger.exception("Could not parse the extracted blood test data")
+            return JsonResponse(
+                {'error': PARSE_ERROR_MESSAGE},
+                status=500
+            )
+        except Exception:
+            logger.exception("Blood test analysis failed")
+            return JsonResponse(
+                {'error': ANALYSIS_ERROR_MESSAGE},
+                status=500
+            )
+
+
 class HealthCheckView(APIView):
     """Simple health check endpoint"""
     
@@ -1,11 +1,20 @@
 from django.contrib import admin
-from .models import Analysis
+from .models import Analysis, BiomarkerResult
 
 
 @admin.register(Analysis)
 class AnalysisAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user_id', 'title', 'created_at', 'updated_at']
+    list_display = ['id', 'user_id', 'title', 'markers_count', 'abnormal_count', 'created_at', 'updated_at']
     list_filter = ['created_at']
     search_fields = ['user_id', 'title']
-    readonly_fields = ['id', 'created_at', 'updated_at']
+    readonly_fields = ['id', 'markers_count', 'abnormal_count', 'test_date', 'created_at', 'updated_at']
     ordering = ['-created_at']
+
+
+@admin.register(BiomarkerResult)
+class BiomarkerResultAdmin(admin.ModelAdmin):
+    list_display = ['marker', 'value', 'unit', 'status', 'date', 'user_id', 'analysis']
+    list_filter = ['status', 'date']
+    search_fields = ['user_id', 'marker', 'name']
+    raw_id_fields = ['analysis']
+    ordering = ['-date']
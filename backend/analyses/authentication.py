@@ -1,7 +1,42 @@
-import jwt
+"""
+Supabase JWT authentication shared by every app.
+
+Verified claims are cached by token hash until the token expires, so a
+client that keeps sending the same access token pays for signature
+verification once. HS256 tokens are checked against the project's JWT
+secret, read once at import; tokens signed with Supabase's asymmetric keys
+are checked against the project's JWKS, which is cached for
+JWKS_CACHE_SECONDS. A token whose key id is not in the cached JWKS forces a
+refetch at most once per JWKS_REFRESH_SECONDS, so tokens with made-up key
+ids cannot make every request fetch the JWKS.
+"""
+import hashlib
+import logging
 import os
+import threading
+import time
+from collections import OrderedDict
+import jwt
 from rest_framework import authentication, exceptions
-from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+JWT_AUDIENCE = 'authenticated'
+
+# Resolved once at startup
+JWT_SECRET = os.getenv('SUPABASE_JWT_SECRET')
+SUPABASE_URL = os.getenv('SUPABASE_URL') or os.getenv('SUPABASE_PROJECT_URL')
+
+# Verified tokens kept per worker
+TOKEN_CACHE_SIZE = int(os.getenv('SUPABASE_TOKEN_CACHE_SIZE', 10000))
+
+# Seconds the JWKS is reused before it is fetched again
+JWKS_CACHE_SECONDS = int(os.getenv('SUPABASE_JWKS_CACHE_SECONDS', 600))
+
+# Shortest interval between refetches forced by an unknown key id
+JWKS_REFRESH_SECONDS = int(os.getenv('SUPABASE_JWKS_REFRESH_SECONDS', 30))
+
+ASYMMETRIC_ALGORITHMS = ['RS256', 'ES256', 'EdDSA']
 
 
 class SupabaseUser:
@@ -18,58 +53,175 @@ class SupabaseUser:
         return str(self.user_id)
 
 
+class VerifiedTokenCache:
+    """
+    Bounded LRU of verified tokens keyed by the SHA-256 of the token.
+    Entries are dropped once the token's exp has passed.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, key: bytes):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user
+
+    def set(self, key: bytes, user, expires_at: float):
+        with self._lock:
+            self._entries[key] = (user, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SupabaseJWKClient(jwt.PyJWKClient):
+    """
+    PyJWKClient that refetches the JWKS for an unknown key id at most once per
+    JWKS_REFRESH_SECONDS. Keys Supabase rotates in are still picked up by the
+    first refetch.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._last_refresh = None
+        self._refresh_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def _may_refresh(self) -> bool:
+        with self._refresh_lock:
+            now = time.monotonic()
+            if self._last_refresh is not None and now - self._last_refresh < JWKS_REFRESH_SECONDS:
+                return False
+            self._last_refresh = now
+            return True
+
+    def get_signing_key(self, kid: str):
+        signing_key = self.match_kid(self.get_signing_keys(), kid)
+        if signing_key is None and self._may_refresh():
+            signing_key = self.match_kid(self.get_signing_keys(refresh=True), kid)
+        if signing_key is None:
+            raise jwt.PyJWKClientError(f'Unable to find a signing key that matches: "{kid}"')
+        return signing_key
+
+
+_token_cache = VerifiedTokenCache(TOKEN_CACHE_SIZE)
+
+_jwks_client = None
+_jwks_lock = threading.Lock()
+
+
+def get_jwks_client():
+    """Return the process-wide JWKS client for the Supabase project, or None if not configured."""
+    global _jwks_client
+    if _jwks_client is None and SUPABASE_URL:
+        with _jwks_lock:
+            if _jwks_client is None:
+                _jwks_client = SupabaseJWKClient(
+                    f"{SUPABASE_URL.rstrip('/')}/auth/v1/.well-known/jwks.json",
+                    cache_keys=True,
+                    lifespan=JWKS_CACHE_SECONDS,
+                    timeout=5,
+                )
+    return _jwks_client
+
+
+def verify_token(token: str) -> dict:
+    """
+    Verify a Supabase access token and return its claims.
+    Raises AuthenticationFailed for expired, invalid or unverifiable tokens.
+    """
+    try:
+        algorithm = jwt.get_unverified_header(token).get('alg')
+    except jwt.InvalidTokenError as e:
+        raise exceptions.AuthenticationFailed(f'Invalid token: {str(e)}')
+
+    if algorithm in ASYMMETRIC_ALGORITHMS:
+        jwks_client = get_jwks_client()
+        if jwks_client is None:
+            raise exceptions.AuthenticationFailed(
+                'Server configuration error: SUPABASE_URL not set'
+            )
+        try:
+            key = jwks_client.get_signing_key_from_jwt(token).key
+        except jwt.PyJWKClientError as e:
+            raise exceptions.AuthenticationFailed(f'Invalid token: {str(e)}')
+        algorithms = [algorithm]
+    else:
+        if not JWT_SECRET:
+            raise exceptions.AuthenticationFailed(
+                'Server configuration error: JWT secret not set'
+            )
+        key = JWT_SECRET
+        algorithms = ['HS256']
+
+    try:
+        return jwt.decode(token, key, algorithms=algorithms, audience=JWT_AUDIENCE)
+    except jwt.ExpiredSignatureError:
+        raise exceptions.AuthenticationFailed('Token has expired')
+    except jwt.InvalidTokenError as e:
+        raise exceptions.AuthenticationFailed(f'Invalid token: {str(e)}')
+
+
 class SupabaseAuthentication(authentication.BaseAuthentication):
     """
     Custom authentication class to verify Supabase JWT tokens.
+    Repeat requests with the same token are served from the verified-token cache.
     """
-    
+
     def authenticate(self, request):
         auth_header = request.META.get('HTTP_AUTHORIZATION')
-        
+
         if not auth_header:
             return None
-        
+
         try:
             # Extract the token from "Bearer <token>"
             parts = auth_header.split()
             if len(parts) != 2 or parts[0].lower() != 'bearer':
                 return None
-            
+
             token = parts[1]
-            
-            # Get Supabase JWT secret from environment
-            jwt_secret = os.getenv('SUPABASE_JWT_SECRET')
-            
-            if not jwt_secret:
-                raise exceptions.AuthenticationFailed(
-                    'Server configuration error: JWT secret not set'
-                )
-            
-            # Decode and verify the token
-            try:
-                payload = jwt.decode(
-                    token,
-                    jwt_secret,
-                    algorithms=['HS256'],
-                    audience='authenticated'
-                )
-            except jwt.ExpiredSignatureError:
-                raise exceptions.AuthenticationFailed('Token has expired')
-            except jwt.InvalidTokenError as e:
-                raise exceptions.AuthenticationFailed(f'Invalid token: {str(e)}')
-            
+
+            cache_key = VerifiedTokenCache.key(token)
+            user = _token_cache.get(cache_key)
+            if user is not None:
+                return (user, token)
+
+            payload = verify_token(token)
+
             # Extract user info from payload
             user_id = payload.get('sub')
             email = payload.get('email')
-            
+
             if not user_id:
                 raise exceptions.AuthenticationFailed('Invalid token payload')
-            
+
             # Create a simple user object
             user = SupabaseUser(user_id=user_id, email=email)
-            
+
+            # Tokens without an expiry are verified every time
+            if isinstance(payload.get('exp'), (int, float)):
+                _token_cache.set(cache_key, user, payload['exp'])
+
             return (user, token)
-            
+
         except exceptions.AuthenticationFailed:
             raise
         except Exception as e:
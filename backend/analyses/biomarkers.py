@@ -0,0 +1,586 @@
+"""
+Biomarker canonicalization for extracted test results.
+
+Labs and extraction runs name the same test differently ("Hb", "Haemoglobin",
+"HGB") and report it in different units (mmol/L vs mg/dL). Results are
+mapped to a canonical marker key through a synonym index, converted to the
+marker's canonical unit with a precompiled conversion table. Statuses are
+checked against the reference range when it is a single unambiguous interval
+or bound. All of this is local, so no model call is needed to compare
+results across analyses.
+
+Functions that take a list process a whole test_results array in one pass;
+repeated value and range strings are parsed once.
+"""
+import re
+from datetime import date, datetime
+from functools import lru_cache
+
+# Formats the extraction model writes test dates in, most common first
+DATE_FORMATS = [
+    '%Y-%m-%d',
+    '%d/%m/%Y',
+    '%d-%m-%Y',
+    '%d.%m.%Y',
+    '%d %b %Y',
+    '%d %B %Y',
+    '%b %d, %Y',
+    '%B %d, %Y',
+    '%Y/%m/%d',
+    '%m/%d/%Y',
+]
+
+# Canonical markers: display name, canonical unit, synonyms, and how other
+# units convert to the canonical one as (unit, scale) or (unit, scale, offset)
+MARKERS = {
+    'hemoglobin': {
+        'name': 'Hemoglobin', 'unit': 'g/dL',
+        'synonyms': ['hb', 'hgb', 'haemoglobin', 'hemoglobin', 'hb total'],
+        'units': [('g/l', 0.1), ('mmol/l', 1.611)],
+    },
+    'hematocrit': {
+        'name': 'Hematocrit', 'unit': '%',
+        'synonyms': ['hct', 'haematocrit', 'hematocrit', 'pcv', 'packed cell volume'],
+        'units': [('l/l', 100)],
+    },
+    'rbc': {
+        'name': 'Red Blood Cells', 'unit': '10^12/L',
+        'synonyms': ['rbc', 'red blood cells', 'red blood cell count', 'red cell count', 'erythrocytes', 'rbc count'],
+        'units': [('10^6/ul', 1), ('m/ul', 1), ('mill/ul', 1), ('million/ul', 1), ('10^6/mm3', 1)],
+    },
+    'wbc': {
+        'name': 'White Blood Cells', 'unit': '10^9/L',
+        'synonyms': ['wbc', 'white blood cells', 'white blood cell count', 'white cell count', 'leukocytes',
+                     'leucocytes', 'total leukocyte count', 'tlc', 'wbc count'],
+        'units': [('10^3/ul', 1), ('k/ul', 1), ('thou/ul', 1), ('10^3/mm3', 1), ('/ul', 0.001),
+                  ('cells/ul', 0.001), ('/mm3', 0.001), ('cells/mm3', 0.001)],
+    },
+    'platelets': {
+        'name': 'Platelets', 'unit': '10^9/L',
+        'synonyms': ['plt', 'platelets', 'platelet count', 'thrombocytes', 'plt count'],
+        'units': [('10^3/ul', 1), ('k/ul', 1), ('thou/ul', 1), ('10^3/mm3', 1), ('lakh/mm3', 100),
+                  ('/ul', 0.001), ('/mm3', 0.001)],
+    },
+    'mcv': {
+        'name': 'MCV', 'unit': 'fL',
+        'synonyms': ['mcv', 'mean corpuscular volume', 'mean cell volume'],
+        'units': [('um3', 1)],
+    },
+    'mch': {
+        'name': 'MCH', 'unit': 'pg',
+        'synonyms': ['mch', 'mean corpuscular hemoglobin', 'mean corpuscular haemoglobin', 'mean cell hemoglobin'],
+        'units': [],
+    },
+    'mchc': {
+        'name': 'MCHC', 'unit': 'g/dL',
+        'synonyms': ['mchc', 'mean corpuscular hemoglobin concentration',
+                     'mean corpuscular haemoglobin concentration', 'mean cell hemoglobin concentration'],
+        'units': [('g/l', 0.1), ('%', 1)],
+    },
+    'rdw': {
+        'name': 'RDW', 'unit': '%',
+        'synonyms': ['rdw', 'rdw cv', 'red cell distribution width'],
+        'units': [],
+    },
+    'glucose': {
+        'name': 'Glucose', 'unit': 'mg/dL',
+        'synonyms': ['glucose', 'blood glucose', 'fasting glucose', 'fasting blood glucose', 'fbs', 'fbg',
+                     'glucose fasting', 'plasma glucose', 'blood sugar', 'fasting blood sugar'],
+        'units': [('mmol/l', 18.016)],
+    },
+    'hba1c': {
+        'name': 'HbA1c', 'unit': '%',
+        'synonyms': ['hba1c', 'a1c', 'hemoglobin a1c', 'haemoglobin a1c', 'glycated hemoglobin',
+                     'glycated haemoglobin', 'glycosylated hemoglobin'],
+        # IFCC mmol/mol to NGSP %
+        'units': [('mmol/mol', 0.09148, 2.152)],
+    },
+    'total_cholesterol': {
+        'name': 'Total Cholesterol', 'unit': 'mg/dL',
+        'synonyms': ['cholesterol', 'total cholesterol', 'cholesterol total', 'tc', 'serum cholesterol'],
+        'units': [('mmol/l', 38.67)],
+    },
+    'ldl': {
+        'name': 'LDL Cholesterol', 'unit': 'mg/dL',
+        'synonyms': ['ldl', 'ldl c', 'ldl cholesterol', 'cholesterol ldl', 'ldl direct',
+                     'low density lipoprotein', 'low density lipoprotein cholesterol'],
+        'units': [('mmol/l', 38.67)],
+    },
+    'hdl': {
+        'name': 'HDL Cholesterol', 'unit': 'mg/dL',
+        'synonyms': ['hdl', 'hdl c', 'hdl cholesterol', 'cholesterol hdl',
+                     'high density lipoprotein', 'high density lipoprotein cholesterol'],
+        'units': [('mmol/l', 38.67)],
+    },
+    'triglycerides': {
+        'name': 'Triglycerides', 'unit': 'mg/dL',
+        'synonyms': ['triglycerides', 'triglyceride', 'tg', 'trigs'],
+        'units': [('mmol/l', 88.57)],
+    },
+    'creatinine': {
+        'name': 'Creatinine', 'unit': 'mg/dL',
+        'synonyms': ['creatinine', 'creat', 'serum creatinine', 'cr'],
+        'units': [('umol/l', 0.01131)],
+    },
+    'urea': {
+        'name': 'Urea', 'unit': 'mmol/L',
+        'synonyms': ['urea', 'serum urea', 'blood urea'],
+        'units': [('mg/dl', 0.1665)],
+    },
+    'bun': {
+        'name': 'Blood Urea Nitrogen', 'unit': 'mg/dL',
+        'synonyms': ['bun', 'blood urea nitrogen', 'urea nitrogen'],
+        'units': [('mmol/l', 2.801)],
+    },
+    'egfr': {
+        'name': 'eGFR', 'unit': 'mL/min/1.73m2',
+        'synonyms': ['egfr', 'gfr', 'estimated gfr', 'estimated glomerular filtration rate'],
+        'units': [('ml/min', 1), ('ml/min/1.73m^2', 1)],
+    },
+    'sodium': {
+        'name': 'Sodium', 'unit': 'mmol/L',
+        'synonyms': ['sodium', 'na', 'serum sodium'],
+        'units': [('meq/l', 1)],
+    },
+    'potassium': {
+        'name': 'Potassium', 'unit': 'mmol/L',
+        'synonyms': ['potassium', 'k', 'serum potassium'],
+        'units': [('meq/l', 1)],
+    },
+    'chloride': {
+        'name': 'Chloride', 'unit': 'mmol/L',
+        'synonyms': ['chloride', 'cl', 'serum chloride'],
+        'units': [('meq/l', 1)],
+    },
+    'calcium': {
+        'name': 'Calcium', 'unit': 'mg/dL',
+        'synonyms': ['calcium', 'ca', 'serum calcium', 'total calcium'],
+        'units': [('mmol/l', 4.008)],
+    },
+    'magnesium': {
+        'name': 'Magnesium', 'unit': 'mg/dL',
+        'synonyms': ['magnesium', 'mg', 'serum magnesium'],
+        'units': [('mmol/l', 2.431)],
+    },
+    'phosphate': {
+        'name': 'Phosphate', 'unit': 'mg/dL',
+        'synonyms': ['phosphate', 'phosphorus', 'inorganic phosphorus', 'po4'],
+        'units': [('mmol/l', 3.097)],
+    },
+    'uric_acid': {
+        'name': 'Uric Acid', 'unit': 'mg/dL',
+        'synonyms': ['uric acid', 'urate', 'serum uric acid'],
+        'units': [('umol/l', 0.01681), ('mmol/l', 16.81)],
+    },
+    'alt': {
+        'name': 'ALT', 'unit': 'U/L',
+        'synonyms': ['alt', 'sgpt', 'alanine aminotransferase', 'alanine transaminase', 'alt sgpt'],
+        'units': [('iu/l', 1), ('ukat/l', 60)],
+    },
+    'ast': {
+        'name': 'AST', 'unit': 'U/L',
+        'synonyms': ['ast', 'sgot', 'aspartate aminotransferase', 'aspartate transaminase', 'ast sgot'],
+        'units': [('iu/l', 1), ('ukat/l', 60)],
+    },
+    'alp': {
+        'name': 'Alkaline Phosphatase', 'unit': 'U/L',
+        'synonyms': ['alp', 'alkaline phosphatase', 'alk phos'],
+        'units': [('iu/l', 1), ('ukat/l', 60)],
+    },
+    'ggt': {
+        'name': 'GGT', 'unit': 'U/L',
+        'synonyms': ['ggt', 'gamma gt', 'gamma glutamyl transferase', 'gamma glutamyltransferase', 'ggtp'],
+        'units': [('iu/l', 1), ('ukat/l', 60)],
+    },
+    'bilirubin_total': {
+        'name': 'Total Bilirubin', 'unit': 'mg/dL',
+        'synonyms': ['bilirubin', 'total bilirubin', 'bilirubin total', 't bil', 'tbil'],
+        'units': [('umol/l', 0.05848)],
+    },
+    'albumin': {
+        'name': 'Albumin', 'unit': 'g/dL',
+        'synonyms': ['albumin', 'serum albumin', 'alb'],
+        'units': [('g/l', 0.1)],
+    },
+    'total_protein': {
+        'name': 'Total Protein', 'unit': 'g/dL',
+        'synonyms': ['total protein', 'protein total', 'serum protein', 'tp'],
+        'units': [('g/l', 0.1)],
+    },
+    'tsh': {
+        'name': 'TSH', 'unit': 'mIU/L',
+        'synonyms': ['tsh', 'thyroid stimulating hormone', 'thyrotropin'],
+        'units': [('uiu/ml', 1), ('miu/ml', 1000)],
+    },
+    'free_t4': {
+        'name': 'Free T4', 'unit': 'ng/dL',
+        'synonyms': ['free t4', 'ft4', 't4 free', 'free thyroxine'],
+        'units': [('pmol/l', 0.0777)],
+    },
+    'free_t3': {
+        'name': 'Free T3', 'unit': 'pg/mL',
+        'synonyms': ['free t3', 'ft3', 't3 free', 'free triiodothyronine'],
+        'units': [('pmol/l', 0.651)],
+    },
+    'ferritin': {
+        'name': 'Ferritin', 'unit': 'ng/mL',
+        'synonyms': ['ferritin', 'serum ferritin'],
+        'units': [('ug/l', 1), ('pmol/l', 0.445)],
+    },
+    'iron': {
+        'name': 'Iron', 'unit': 'ug/dL',
+        'synonyms': ['iron', 'serum iron', 'fe'],
+        'units': [('umol/l', 5.585)],
+    },
+    'vitamin_d': {
+        'name': 'Vitamin D', 'unit': 'ng/mL',
+        'synonyms': ['vitamin d', 'vit d', '25 oh vitamin d', '25 hydroxy vitamin d', '25 hydroxyvitamin d',
+                     'vitamin d 25 oh', 'vitamin d3', 'vitamin d total', '25 oh d'],
+        'units': [('nmol/l', 0.4006), ('ug/l', 1)],
+    },
+    'vitamin_b12': {
+        'name': 'Vitamin B12', 'unit': 'pg/mL',
+        'synonyms': ['vitamin b12', 'vit b12', 'b12', 'cobalamin', 'cyanocobalamin'],
+        'units': [('pmol/l', 1.355), ('ng/l', 1)],
+    },
+    'folate': {
+        'name': 'Folate', 'unit': 'ng/mL',
+        'synonyms': ['folate', 'folic acid', 'serum folate'],
+        'units': [('nmol/l', 0.441), ('ug/l', 1)],
+    },
+    'crp': {
+        'name': 'CRP', 'unit': 'mg/L',
+        'synonyms': ['crp', 'c reactive protein'],
+        'units': [('mg/dl', 10)],
+    },
+    'hs_crp': {
+        'name': 'hs-CRP', 'unit': 'mg/L',
+        'synonyms': ['hs crp', 'hscrp', 'high sensitivity crp', 'high sensitivity c reactive protein'],
+        'units': [('mg/dl', 10)],
+    },
+    'esr': {
+        'name': 'ESR', 'unit': 'mm/h',
+        'synonyms': ['esr', 'erythrocyte sedimentation rate', 'sed rate'],
+        'units': [('mm/hr', 1), ('mm/1hr', 1)],
+    },
+    'insulin': {
+        'name': 'Insulin', 'unit': 'uIU/mL',
+        'synonyms': ['insulin', 'fasting insulin'],
+        'units': [('pmol/l', 0.144), ('miu/l', 1)],
+    },
+    'cortisol': {
+        'name': 'Cortisol', 'unit': 'ug/dL',
+        'synonyms': ['cortisol', 'serum cortisol'],
+        'units': [('nmol/l', 0.03625)],
+    },
+    'testosterone': {
+        'name': 'Testosterone', 'unit': 'ng/dL',
+        'synonyms': ['testosterone', 'total testosterone', 'testosterone total'],
+        'units': [('nmol/l', 28.84), ('ng/ml', 100)],
+    },
+    'psa': {
+        'name': 'PSA', 'unit': 'ng/mL',
+        'synonyms': ['psa', 'prostate specific antigen', 'total psa'],
+        'units': [('ug/l', 1)],
+    },
+}
+
+# Synonyms shorter than this ('k', 'na', 'mg', ...) only match the whole name,
+# less noise words ('Serum K'), never a parenthetical: '(mg)' is a unit
+MIN_PARTIAL_SYNONYM_LENGTH = 3
+
+# Words that do not change which test a name refers to
+NOISE_WORDS = {'serum', 'plasma', 'blood', 'level', 'levels', 's', 'p', 'b', 'count', 'test'}
+
+# Non-blood specimens; names with these are never mapped to a (serum) marker
+_SPECIMEN = re.compile(
+    r'\b(?:urine|urinary|csf|cerebrospinal|stool|fecal|faecal|pleural|ascitic|peritoneal|synovial|'
+    r'saliva|salivary|24 ?h|24 ?hrs?|24 ?hours?)\b'
+)
+
+_NON_KEY = re.compile(r'[^a-z0-9]+')
+_PARENTHESES = re.compile(r'\(([^)]*)\)')
+
+# Result values: optional comparator, then a number using ',' or '.' as separators
+_VALUE = re.compile(r'(?P<op>[<>≤≥]=?)?\s*(?P<num>[-+]?\d[\d,]*(?:\.\d+)?)')
+
+# Reference ranges: "4.0-5.5", "4.0 to 5.5", "<200", ">= 40", "up to 5"
+_RANGE_BETWEEN = re.compile(r'(?P<low>[-+]?\d[\d,]*(?:\.\d+)?)\s*(?:-|–|—|to)\s*(?P<high>[-+]?\d[\d,]*(?:\.\d+)?)')
+_RANGE_BOUND = re.compile(r'(?P<op><|>|≤|≥|up to|below|above|less than|greater than|under|over)\s*=?\s*(?P<num>\d[\d,]*(?:\.\d+)?)', re.IGNORECASE)
+
+_UPPER_OPS = {'<', '≤', 'up to', 'below', 'less than', 'under'}
+
+# Standalone numbers in a range, ignoring digits inside units such as 10^9/L, mm3 or /1.73m2
+_RANGE_NUMBER = re.compile(r'(?<![\w^*/.,])[-+]?\d[\d,]*(?:\.\d+)?(?![\w^*])')
+
+# Labels and separators of tiered, sex- or age-specific ranges ("Desirable: <200; Borderline: 200-239")
+_RANGE_TIERS = re.compile(r'[:;|\n]')
+
+
+def _key(text) -> str:
+    return _NON_KEY.sub(' ', str(text).lower()).strip()
+
+
+def _unit_key(unit) -> str:
+    """Spelling-insensitive unit key: 'x10^9 /L', '10e9/l' and '10*9/L' all give '10^9/l'."""
+    text = str(unit).lower().replace('µ', 'u').replace('μ', 'u').replace('mcg', 'ug').replace('×', 'x')
+    text = text.replace('litre', 'l').replace('liter', 'l').replace(' ', '')
+    text = re.sub(r'10(?:\^|\*\*|\*|e)(\d+)', r'10^\1', text)
+    if text.startswith('x10^'):
+        text = text[1:]
+    return text
+
+
+def _build_synonym_index() -> dict:
+    index = {}
+    for marker, spec in MARKERS.items():
+        for name in [marker, spec['name'], *spec['synonyms']]:
+            index.setdefault(_key(name), marker)
+    return index
+
+
+def _build_conversions() -> dict:
+    """(marker, unit key) -> (scale, offset), including identity for the canonical unit."""
+    conversions = {}
+    for marker, spec in MARKERS.items():
+        conversions[(marker, _unit_key(spec['unit']))] = (1.0, 0.0)
+        for conversion in spec['units']:
+            unit, scale, offset = (conversion + (0.0,))[:3]
+            conversions[(marker, _unit_key(unit))] = (float(scale), float(offset))
+    return conversions
+
+
+SYNONYMS = _build_synonym_index()
+CONVERSIONS = _build_conversions()
+
+
+def canonical_marker(name) -> str:
+    """
+    Canonical key for a marker name: 'Haemoglobin (Hb)' -> 'hemoglobin'.
+    Unknown names, and names of urine, CSF or 24h tests, fall back to a
+    normalized key of the full name: 'Glucose (Urine)' -> 'glucose_urine'.
+    """
+    if not name:
+        return ''
+    return _canonical_marker(str(name))
+
+
+def _strip_noise(key: str) -> str:
+    return ' '.join(word for word in key.split() if word not in NOISE_WORDS)
+
+
+@lru_cache(maxsize=4096)
+def _canonical_marker(name: str) -> str:
+    key = _key(name)
+    if _SPECIMEN.search(key):
+        return key.replace(' ', '_')[:128]
+    candidates = [key, _key(_PARENTHESES.sub(' ', name))]
+    candidates += [_key(inner) for inner in _PARENTHESES.findall(name)]
+    candidates += [_strip_noise(candidate) for candidate in candidates]
+    whole_names = {key, _strip_noise(key)}
+    for candidate in candidates:
+        if candidate in SYNONYMS and (candidate in whole_names or len(candidate) >= MIN_PARTIAL_SYNONYM_LENGTH):
+            return SYNONYMS[candidate]
+    return key.replace(' ', '_')[:128]
+
+
+def _to_float(text: str):
+    """'1,234.5' -> 1234.5 and '3,1' -> 3.1 (decimal comma)."""
+    if ',' in text and '.' not in text and re.fullmatch(r'[-+]?\d+,\d{1,2}', text):
+        text = text.replace(',', '.')
+    try:
+        return float(text.replace(',', ''))
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=4096)
+def _parse_value_text(text: str):
+    match = _VALUE.search(text)
+    return _to_float(match.group('num')) if match else None
+
+
+def parse_value(value):
+    """First number in a result value such as '13.5', '<5', '1,234' or '3,1'. None if there is none."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if not isinstance(value, str):
+        return None
+    return _parse_value_text(value.strip())
+
+
+def parse_values(values: list) -> list:
+    """parse_value over a whole column of values."""
+    return [parse_value(value) for value in values]
+
+
+@lru_cache(maxsize=4096)
+def _parse_range_text(text: str) -> tuple:
+    # Only a single interval or bound is trusted; tiered or per-sex ranges are left unparsed
+    if _RANGE_TIERS.search(text):
+        return None, None
+    numbers = len(_RANGE_NUMBER.findall(text))
+    match = _RANGE_BETWEEN.search(text)
+    if match:
+        if numbers != 2:
+            return None, None
+        return _to_float(match.group('low')), _to_float(match.group('high'))
+    match = _RANGE_BOUND.search(text)
+    if match:
+        if numbers != 1:
+            return None, None
+        bound = _to_float(match.group('num'))
+        if match.group('op').lower() in _UPPER_OPS:
+            return None, bound
+        return bound, None
+    return None, None
+
+
+def parse_range(reference_range) -> tuple:
+    """
+    (low, high) bounds of a reference range string; either may be None.
+    Both are None unless the text is one unambiguous interval or bound.
+    """
+    if not isinstance(reference_range, str) or not reference_range.strip():
+        return None, None
+    return _parse_range_text(reference_range.strip())
+
+
+def parse_ranges(reference_ranges: list) -> list:
+    """parse_range over a whole column of reference ranges."""
+    return [parse_range(reference_range) for reference_range in reference_ranges]
+
+
+def compute_statuses(values: list, ranges: list) -> list:
+    """'low', 'high' or 'normal' for each value against its (low, high) range; None if unknown."""
+    statuses = []
+    for value, (low, high) in zip(values, ranges):
+        if value is None or (low is None and high is None):
+            statuses.append(None)
+        elif low is not None and value < low:
+            statuses.append('low')
+        elif high is not None and value > high:
+            statuses.append('high')
+        else:
+            statuses.append('normal')
+    return statuses
+
+
+def convert_to_canonical(marker: str, value, unit) -> tuple:
+    """
+    (value, unit) in the marker's canonical unit. Values whose unit has no
+    known conversion are returned unchanged with the unit as reported.
+    """
+    spec = MARKERS.get(marker)
+    if value is None or spec is None:
+        return value, unit
+    if not unit:
+        # Reports often leave out the unit when it is the usual one
+        return value, spec['unit']
+    conversion = CONVERSIONS.get((marker, _unit_key(unit)))
+    if conversion is None:
+        return value, unit
+    scale, offset = conversion
+    return round(value * scale + offset, 4), spec['unit']
+
+
+def canonicalize_results(test_results) -> list:
+    """
+    Add canonical_marker, numeric_value, canonical_value and canonical_unit to
+    each result of a test_results array. Every other field, status included,
+    is kept as reported.
+    """
+    if not isinstance(test_results, list):
+        return []
+    results = [dict(result) for result in test_results if isinstance(result, dict)]
+
+    values = parse_values([result.get('value') for result in results])
+    for result, value in zip(results, values):
+        marker = canonical_marker(result.get('marker'))
+        canonical_value, canonical_unit = convert_to_canonical(marker, value, result.get('unit'))
+        result.update({
+            'canonical_marker': marker,
+            'numeric_value': value,
+            'canonical_value': canonical_value,
+            'canonical_unit': canonical_unit,
+        })
+    return results
+
+
+def normalize_results(test_results) -> list:
+    """
+    Canonicalize a whole test_results array (see canonicalize_results) and
+    check statuses. The status is computed from the value and reference_range
+    only when the range is a single unambiguous interval or bound; otherwise
+    the status the extraction reported is kept.
+    """
+    results = canonicalize_results(test_results)
+
+    ranges = parse_ranges([result.get('reference_range') for result in results])
+    statuses = compute_statuses([result['numeric_value'] for result in results], ranges)
+
+    for result, status in zip(results, statuses):
+        reported = str(result.get('status') or '').lower()
+        result['status'] = status or (reported if reported in ('high', 'low', 'normal') else None)
+    return results
+
+
+def normalize_parsed_data(parsed_data):
+    """Return parsed_data with its test_results canonicalized and statuses checked. Other keys are left alone."""
+    if not isinstance(parsed_data, dict):
+        return parsed_data
+    return {**parsed_data, 'test_results': normalize_results(parsed_data.get('test_results', []))}
+
+
+def canonicalize_parsed_data(parsed_data):
+    """Return parsed_data with canonical marker fields added to its test_results; statuses are untouched."""
+    if not isinstance(parsed_data, dict):
+        return parsed_data
+    return {**parsed_data, 'test_results': canonicalize_results(parsed_data.get('test_results', []))}
+
+
+def parse_test_date(value):
+    """Parse a test date written in any of DATE_FORMATS. None if it cannot be read."""
+    if not value:
+        return None
+    text = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    try:
+        return datetime.fromisoformat(text).date()
+    except ValueError:
+        return None
+
+
+def build_results(analysis) -> list:
+    """Unsaved BiomarkerResult rows for an analysis, one per recognisable test result."""
+    from .models import BiomarkerResult
+
+    parsed_data = analysis.parsed_data if isinstance(analysis.parsed_data, dict) else {}
+    # Statuses were checked when the analysis was stored
+    test_results = canonicalize_results(parsed_data.get('test_results'))
+
+    taken_on = parse_test_date(analysis.test_date)
+    if taken_on is None:
+        taken_on = analysis.created_at.date() if analysis.created_at else date.today()
+
+    results = []
+    for result in test_results:
+        marker = result['canonical_marker']
+        if not marker:
+            continue
+        unit = result['canonical_unit']
+        results.append(BiomarkerResult(
+            user_id=analysis.user_id,
+            analysis_id=analysis.id,
+            marker=marker,
+            name=str(result.get('marker'))[:255],
+            value=result['canonical_value'],
+            unit=str(unit)[:32] if unit else None,
+            status=str(result.get('status') or '').lower()[:16] or None,
+            date=taken_on,
+        ))
+    return results
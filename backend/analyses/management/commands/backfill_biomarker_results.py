@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from analyses.models import Analysis, BiomarkerResult
+from analyses.biomarkers import build_results
+
+
+class Command(BaseCommand):
+    help = 'Populate biomarker_results from the test results of existing analyses'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Number of analyses processed per batch (default: 200)'
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Rebuild results for analyses that already have them'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        rebuild = options['rebuild']
+
+        analyses = Analysis.objects.only('id', 'user_id', 'parsed_data', 'test_date', 'created_at')
+        if not rebuild:
+            analyses = analyses.filter(~Exists(BiomarkerResult.objects.filter(analysis_id=OuterRef('pk'))))
+
+        totals = {'batches': 0, 'analyses': 0, 'results': 0}
+        last_id = None
+
+        while True:
+            # Keyset over the primary key, so each batch is an index range scan
+            batch_query = analyses.order_by('id')
+            if last_id is not None:
+                batch_query = batch_query.filter(id__gt=last_id)
+            batch = list(batch_query[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            results = [result for analysis in batch for result in build_results(analysis)]
+            with transaction.atomic():
+                if rebuild:
+                    BiomarkerResult.objects.filter(analysis_id__in=[analysis.id for analysis in batch]).delete()
+                BiomarkerResult.objects.bulk_create(results, batch_size=1000)
+
+            totals['batches'] += 1
+            totals['analyses'] += len(batch)
+            totals['results'] += len(results)
+            self.stdout.write(
+                f"Batch {totals['batches']}: {len(batch)} analyses, {len(results)} results, "
+                f"{totals['analyses']} analyses total"
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Successfully backfilled {totals['results']} biomarker results "
+                f"from {totals['analyses']} analyses in {totals['batches']} batches"
+            )
+        )
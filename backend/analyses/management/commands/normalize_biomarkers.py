@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from analyses.models import Analysis
+from analyses.biomarkers import canonicalize_parsed_data
+
+
+class Command(BaseCommand):
+    help = 'Add canonical marker keys and units to stored test results. Statuses, counts and updated_at are left alone'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Number of analyses processed per batch (default: 200)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report how many analyses would change without saving them'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        totals = {'batches': 0, 'analyses': 0, 'changed': 0}
+        last_id = None
+
+        while True:
+            # Keyset over the primary key, so each batch is an index range scan
+            batch_query = Analysis.objects.only('id', 'user_id', 'parsed_data', 'created_at').order_by('id')
+            if last_id is not None:
+                batch_query = batch_query.filter(id__gt=last_id)
+            batch = list(batch_query[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            changed = 0
+            for analysis in batch:
+                parsed_data = canonicalize_parsed_data(analysis.parsed_data)
+                if parsed_data == analysis.parsed_data:
+                    continue
+                changed += 1
+                if not dry_run:
+                    analysis.parsed_data = parsed_data
+                    # update() skips save(), so updated_at is not bumped and the
+                    # row is not sent again to clients syncing with updated_since
+                    with transaction.atomic():
+                        Analysis.objects.filter(pk=analysis.pk).update(parsed_data=parsed_data)
+                        analysis.sync_biomarker_results()
+
+            totals['batches'] += 1
+            totals['analyses'] += len(batch)
+            totals['changed'] += changed
+            self.stdout.write(
+                f"Batch {totals['batches']}: {changed} of {len(batch)} analyses changed, "
+                f"{totals['analyses']} analyses total"
+            )
+
+        if dry_run:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Dry run: {totals['changed']} of {totals['analyses']} analyses would be normalized"
+                )
+            )
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Successfully normalized {totals['changed']} of {totals['analyses']} analyses "
+                f"in {totals['batches']} batches"
+            )
+        )
@@ -0,0 +1,74 @@
+# Generated manually to add summary columns to the existing analyses table
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyses', '0001_change_analysis_to_jsonb'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            # The table was created in Supabase, so only tell Django about the model
+            state_operations=[
+                migrations.CreateModel(
+                    name='Analysis',
+                    fields=[
+                        ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                        ('user_id', models.UUIDField(db_index=True)),
+                        ('parsed_data', models.JSONField()),
+                        ('analysis', models.JSONField()),
+                        ('title', models.CharField(blank=True, max_length=255, null=True)),
+                        ('markers_count', models.PositiveIntegerField(default=0)),
+                        ('abnormal_count', models.PositiveIntegerField(default=0)),
+                        ('test_date', models.CharField(blank=True, max_length=64, null=True)),
+                        ('created_at', models.DateTimeField(auto_now_add=True)),
+                        ('updated_at', models.DateTimeField(auto_now=True)),
+                    ],
+                    options={
+                        'verbose_name': 'Analysis',
+                        'verbose_name_plural': 'Analyses',
+                        'db_table': 'analyses',
+                        'ordering': ['-created_at'],
+                    },
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    # Add the summary columns and backfill them from parsed_data,
+                    # matching Analysis.refresh_summary
+                    sql="""
+                        ALTER TABLE analyses
+                        ADD COLUMN IF NOT EXISTS markers_count integer NOT NULL DEFAULT 0
+                            CHECK (markers_count >= 0),
+                        ADD COLUMN IF NOT EXISTS abnormal_count integer NOT NULL DEFAULT 0
+                            CHECK (abnormal_count >= 0),
+                        ADD COLUMN IF NOT EXISTS test_date varchar(64) NULL;
+
+                        UPDATE analyses
+                        SET markers_count = jsonb_array_length(parsed_data->'test_results'),
+                            abnormal_count = (
+                                SELECT count(*)
+                                FROM jsonb_array_elements(parsed_data->'test_results') AS result
+                                WHERE result->>'status' IN ('high', 'low')
+                            )
+                        WHERE jsonb_typeof(parsed_data->'test_results') = 'array';
+
+                        UPDATE analyses
+                        SET test_date = left(parsed_data #>> '{patient_info,test_date}', 64)
+                        WHERE jsonb_typeof(parsed_data->'patient_info') = 'object'
+                        AND coalesce(parsed_data #>> '{patient_info,test_date}', '') != '';
+                    """,
+                    reverse_sql="""
+                        ALTER TABLE analyses
+                        DROP COLUMN IF EXISTS markers_count,
+                        DROP COLUMN IF EXISTS abnormal_count,
+                        DROP COLUMN IF EXISTS test_date;
+                    """,
+                ),
+            ],
+        ),
+    ]
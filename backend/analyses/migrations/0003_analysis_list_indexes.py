@@ -0,0 +1,21 @@
+# Generated by Django 4.2.27 on 2026-10-19 08:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyses', '0002_analysis_summary_columns'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='analysis',
+            index=models.Index(fields=['user_id', '-created_at', '-id'], name='analyses_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analysis',
+            index=models.Index(fields=['user_id', 'updated_at', 'id'], name='analyses_user_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.27 on 2026-10-19 08:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analyses', '0003_analysis_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BiomarkerResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.UUIDField()),
+                ('marker', models.CharField(max_length=128)),
+                ('name', models.CharField(max_length=255)),
+                ('value', models.FloatField(blank=True, null=True)),
+                ('unit', models.CharField(blank=True, max_length=32, null=True)),
+                ('status', models.CharField(blank=True, max_length=16, null=True)),
+                ('date', models.DateField()),
+                ('analysis', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='biomarker_results', to='analyses.analysis')),
+            ],
+            options={
+                'db_table': 'biomarker_results',
+                'indexes': [models.Index(fields=['user_id', 'marker', 'date'], name='biomarker_user_marker_date_idx')],
+            },
+        ),
+    ]
@@ -1,5 +1,5 @@
 import uuid
-from django.db import models
+from django.db import models, transaction
 
 
 class Analysis(models.Model):
@@ -12,30 +12,112 @@ class Analysis(models.Model):
     parsed_data = models.JSONField()
     analysis = models.JSONField()
     title = models.CharField(max_length=255, blank=True, null=True)
+    # Summary of parsed_data, kept in sync on save so listings never load the JSON
+    markers_count = models.PositiveIntegerField(default=0)
+    abnormal_count = models.PositiveIntegerField(default=0)
+    test_date = models.CharField(max_length=64, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'analyses'
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of a user's list, newest first
+            models.Index(fields=['user_id', '-created_at', '-id'], name='analyses_user_created_idx'),
+            # Delta sync by updated_since
+            models.Index(fields=['user_id', 'updated_at', 'id'], name='analyses_user_updated_idx'),
+        ]
         verbose_name = 'Analysis'
         verbose_name_plural = 'Analyses'
 
     def __str__(self):
         return f"Analysis {self.id} for user {self.user_id}"
 
+    def save(self, *args, **kwargs):
+        self.refresh_summary()
+        update_fields = kwargs.get('update_fields')
+        parsed_data_changed = update_fields is None or 'parsed_data' in update_fields
+        if update_fields is not None and parsed_data_changed:
+            kwargs['update_fields'] = set(update_fields) | set(SUMMARY_FIELDS)
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if parsed_data_changed:
+                self.sync_biomarker_results(replace=not adding)
+
+    def sync_biomarker_results(self, replace: bool = True) -> int:
+        """Rebuild this analysis's BiomarkerResult rows from parsed_data. Returns the row count."""
+        from .biomarkers import build_results
+
+        if replace:
+            self.biomarker_results.all().delete()
+        results = build_results(self)
+        BiomarkerResult.objects.bulk_create(results)
+        return len(results)
+
+    def refresh_summary(self):
+        """Recompute the summary columns from parsed_data."""
+        parsed_data = self.parsed_data if isinstance(self.parsed_data, dict) else {}
+
+        test_results = parsed_data.get('test_results')
+        if not isinstance(test_results, list):
+            test_results = []
+        self.markers_count = len(test_results)
+        self.abnormal_count = sum(
+            1 for r in test_results
+            if isinstance(r, dict) and r.get('status') in ['high', 'low']
+        )
+
+        patient_info = parsed_data.get('patient_info')
+        test_date = patient_info.get('test_date') if isinstance(patient_info, dict) else None
+        self.test_date = str(test_date)[:64] if test_date else None
+
     def generate_title(self):
-        """Generate a title from the parsed data if not set."""
+        """Generate a title from the test date if not set."""
         if self.title:
             return self.title
         
-        # Try to get test date from parsed data
-        try:
-            patient_info = self.parsed_data.get('patient_info', {})
-            test_date = patient_info.get('test_date')
-            if test_date:
-                return f"Blood Test - {test_date}"
-        except (AttributeError, TypeError):
-            pass
+        if self.test_date:
+            return f"Blood Test - {self.test_date}"
         
         return f"Blood Test Analysis"
+
+    def generate_summary(self):
+        """Brief summary of the analysis status."""
+        if self.abnormal_count == 0:
+            return "All markers normal"
+        return f"{self.abnormal_count} of {self.markers_count} markers abnormal"
+
+
+# Columns derived from parsed_data by Analysis.refresh_summary
+SUMMARY_FIELDS = ['markers_count', 'abnormal_count', 'test_date']
+
+# Columns the analyses list reads; the JSON columns are never loaded for it
+LIST_FIELDS = ['id', 'title', 'test_date', 'markers_count', 'abnormal_count', 'created_at', 'updated_at']
+
+
+class BiomarkerResult(models.Model):
+    """
+    One test result from an analysis, keyed by canonical marker.
+    Lets a marker's trend be read from an index instead of every analysis's JSON.
+    """
+    user_id = models.UUIDField()
+    analysis = models.ForeignKey(Analysis, on_delete=models.CASCADE, related_name='biomarker_results')
+    marker = models.CharField(max_length=128)
+    # Marker name as it appeared in the report
+    name = models.CharField(max_length=255)
+    value = models.FloatField(blank=True, null=True)
+    unit = models.CharField(max_length=32, blank=True, null=True)
+    status = models.CharField(max_length=16, blank=True, null=True)
+    # When the test was taken, or when the analysis was created if the report has no date
+    date = models.DateField()
+
+    class Meta:
+        db_table = 'biomarker_results'
+        indexes = [
+            models.Index(fields=['user_id', 'marker', 'date'], name='biomarker_user_marker_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.marker}={self.value} {self.unit or ''} on {self.date}"
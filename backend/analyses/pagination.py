@@ -0,0 +1,25 @@
+"""
+Keyset pagination for the analyses list.
+
+Pages are walked by (timestamp, id) rather than OFFSET, so every page is a
+single index range scan regardless of how many analyses a user has.
+Cursors are built with backend.cursors.
+"""
+from django.db.models import Q
+
+
+def keyset_page(queryset, field: str, cursor: tuple = None, limit: int = 20, descending: bool = True) -> tuple:
+    """
+    Return (items, has_more) for the page after cursor, ordered by (field, id).
+    One extra row is fetched to tell whether another page follows.
+    """
+    if cursor:
+        timestamp, analysis_id = cursor
+        op = 'lt' if descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'{field}__{op}': timestamp}) | Q(**{field: timestamp, f'id__{op}': analysis_id})
+        )
+
+    prefix = '-' if descending else ''
+    items = list(queryset.order_by(f'{prefix}{field}', f'{prefix}id')[:limit + 1])
+    return items[:limit], len(items) > limit
@@ -1,5 +1,7 @@
+import uuid
 from rest_framework import serializers
-from .models import Analysis
+from .models import Analysis, BiomarkerResult
+from backend.cursors import decode_cursor
 
 
 class AnalysisSerializer(serializers.ModelSerializer):
@@ -16,40 +18,23 @@ class AnalysisSerializer(serializers.ModelSerializer):
 
 
 class AnalysisListSerializer(serializers.ModelSerializer):
-    """Serializer for analysis list (lighter version)."""
+    """
+    Serializer for analysis list (lighter version).
+    Reads only the summary columns, see LIST_FIELDS.
+    """
     title = serializers.SerializerMethodField()
-    markers_count = serializers.SerializerMethodField()
     summary = serializers.SerializerMethodField()
 
     class Meta:
         model = Analysis
-        fields = ['id', 'title', 'markers_count', 'summary', 'created_at']
+        fields = ['id', 'title', 'markers_count', 'summary', 'created_at', 'updated_at']
 
     def get_title(self, obj):
         return obj.generate_title()
 
-    def get_markers_count(self, obj):
-        """Get the number of test markers in this analysis."""
-        try:
-            test_results = obj.parsed_data.get('test_results', [])
-            return len(test_results)
-        except (AttributeError, TypeError):
-            return 0
-
     def get_summary(self, obj):
         """Get a brief summary of the analysis status."""
-        try:
-            test_results = obj.parsed_data.get('test_results', [])
-            abnormal_count = sum(
-                1 for r in test_results 
-                if r.get('status') in ['high', 'low']
-            )
-            total = len(test_results)
-            if abnormal_count == 0:
-                return "All markers normal"
-            return f"{abnormal_count} of {total} markers abnormal"
-        except (AttributeError, TypeError):
-            return "Analysis complete"
+        return obj.generate_summary()
 
 
 class CreateAnalysisSerializer(serializers.Serializer):
@@ -57,3 +42,33 @@ class CreateAnalysisSerializer(serializers.Serializer):
     parsed_data = serializers.JSONField()
     analysis = serializers.JSONField()
     title = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+
+
+class ListAnalysesSerializer(serializers.Serializer):
+    """Query parameters for a paginated analyses list."""
+    limit = serializers.IntegerField(default=20, min_value=1, max_value=100)
+    # Cursor from a previous response's next_cursor
+    cursor = serializers.CharField(max_length=255, required=False)
+    # Delta sync: only analyses changed after this time, oldest change first
+    updated_since = serializers.DateTimeField(required=False)
+
+    def validate_cursor(self, value):
+        try:
+            return decode_cursor(value, uuid.UUID)
+        except ValueError:
+            raise serializers.ValidationError('Invalid cursor.')
+
+
+class BiomarkerTrendSerializer(serializers.Serializer):
+    """Query parameters for a marker's trend."""
+    marker = serializers.CharField(max_length=255)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+
+class BiomarkerResultSerializer(serializers.ModelSerializer):
+    """One point in a marker's trend."""
+
+    class Meta:
+        model = BiomarkerResult
+        fields = ['analysis_id', 'date', 'value', 'unit', 'status', 'name']
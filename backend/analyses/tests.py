@@ -0,0 +1,252 @@
+import os
+import time
+import uuid
+from unittest import mock
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ec
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import exceptions
+from rest_framework.test import APIClient
+from . import authentication
+from .biomarkers import canonical_marker, convert_to_canonical, normalize_results, parse_range, parse_value
+from .authentication import SupabaseAuthentication, SupabaseJWKClient, VerifiedTokenCache, verify_token
+from .models import Analysis, BiomarkerResult
+
+
+def auth_header(user_id: str, expires_in: int = 3600) -> str:
+    """Bearer header with an HS256 Supabase access token for user_id."""
+    token = jwt.encode(
+        {'sub': user_id, 'aud': 'authenticated', 'exp': int(time.time()) + expires_in},
+        os.environ['SUPABASE_JWT_SECRET'],
+        algorithm='HS256',
+    )
+    return f'Bearer {token}'
+
+
+def make_analysis(user_id: str, test_date: str, glucose: float) -> Analysis:
+    return Analysis.objects.create(
+        user_id=user_id,
+        parsed_data={
+            'patient_info': {'test_date': test_date},
+            'test_results': [
+                {'marker': 'Glucose', 'value': glucose, 'unit': 'mg/dL', 'reference_range': '70-99', 'status': 'normal'},
+                {'marker': 'Hemoglobin', 'value': 14.1, 'unit': 'g/dL', 'reference_range': '13.5-17.5', 'status': 'normal'},
+            ],
+        },
+        analysis={'summary': 'ok'},
+    )
+
+
+class QueryBudgetTests(TestCase):
+    """Each read endpoint is served by a single query, however many analyses a user has."""
+
+    LIST_QUERY_BUDGET = 1
+    TREND_QUERY_BUDGET = 1
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user_id = str(uuid.uuid4())
+        for day, glucose in enumerate([88, 92, 101, 97, 110], start=1):
+            make_analysis(cls.user_id, f'2025-01-{day:02d}', glucose)
+        make_analysis(str(uuid.uuid4()), '2025-01-01', 200)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=auth_header(self.user_id))
+
+    def get(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response, queries
+
+    def test_full_list(self):
+        response, queries = self.get('/api/analyses/')
+        self.assertEqual(len(response.json()), 5)
+        self.assertLessEqual(len(queries), self.LIST_QUERY_BUDGET, [q['sql'] for q in queries])
+        # The list never loads the parsed_data or analysis JSON
+        self.assertNotIn('parsed_data', queries[0]['sql'])
+
+    def test_paginated_list(self):
+        response, queries = self.get('/api/analyses/', {'limit': 2})
+        body = response.json()
+        self.assertEqual(len(body['results']), 2)
+        self.assertTrue(body['has_more'])
+        self.assertLessEqual(len(queries), self.LIST_QUERY_BUDGET, [q['sql'] for q in queries])
+
+        response, queries = self.get('/api/analyses/', {'limit': 2, 'cursor': body['next_cursor']})
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertLessEqual(len(queries), self.LIST_QUERY_BUDGET, [q['sql'] for q in queries])
+
+    def test_delta_sync(self):
+        response, queries = self.get('/api/analyses/', {'updated_since': '2000-01-01T00:00:00Z', 'limit': 100})
+        self.assertEqual(len(response.json()['results']), 5)
+        self.assertLessEqual(len(queries), self.LIST_QUERY_BUDGET, [q['sql'] for q in queries])
+
+    def test_trend(self):
+        response, queries = self.get('/api/analyses/trends/', {'marker': 'glucose'})
+        values = [point['value'] for point in response.json()['results']]
+        self.assertEqual(values, [88, 92, 101, 97, 110])
+        self.assertLessEqual(len(queries), self.TREND_QUERY_BUDGET, [q['sql'] for q in queries])
+
+    def test_trend_with_date_range(self):
+        response, queries = self.get('/api/analyses/trends/', {'marker': 'Glucose', 'date_from': '2025-01-02', 'date_to': '2025-01-04'})
+        self.assertEqual(len(response.json()['results']), 3)
+        self.assertLessEqual(len(queries), self.TREND_QUERY_BUDGET, [q['sql'] for q in queries])
+
+    def test_results_are_per_user(self):
+        self.assertEqual(BiomarkerResult.objects.filter(user_id=self.user_id, marker='glucose').count(), 5)
+
+
+class DeleteAccountTests(TestCase):
+
+    def test_counts_only_analyses(self):
+        user_id = str(uuid.uuid4())
+        make_analysis(user_id, '2025-01-01', 90)
+        make_analysis(user_id, '2025-02-01', 95)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=auth_header(user_id))
+
+        response = client.delete('/api/analyses/delete-account/')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['analyses_deleted'], 2)
+        # No Stripe subscription is configured in the tests
+        self.assertFalse(response.json()['subscription_cancellation_queued'])
+        self.assertFalse(BiomarkerResult.objects.filter(user_id=user_id).exists())
+
+
+class TokenCacheTests(SimpleTestCase):
+    """A verified token is only checked again once it expires."""
+
+    def setUp(self):
+        authentication._token_cache.clear()
+        self.addCleanup(authentication._token_cache.clear)
+        verify = mock.patch('analyses.authentication.verify_token', side_effect=verify_token)
+        self.verify = verify.start()
+        self.addCleanup(verify.stop)
+
+    def authenticate(self, header):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=header)
+        return SupabaseAuthentication().authenticate(request)
+
+    def test_repeat_token_is_served_from_cache(self):
+        header = auth_header('user-1')
+        first, _ = self.authenticate(header)
+        second, _ = self.authenticate(header)
+        self.assertEqual((first.user_id, second.user_id), ('user-1', 'user-1'))
+        self.assertEqual(self.verify.call_count, 1)
+
+    def test_cached_token_is_verified_again_after_its_expiry(self):
+        header = auth_header('user-1', expires_in=60)
+        self.authenticate(header)
+        with mock.patch('analyses.authentication.time.time', return_value=time.time() + 61):
+            self.authenticate(header)
+        self.assertEqual(self.verify.call_count, 2)
+
+    def test_expired_token_is_rejected_and_not_cached(self):
+        header = auth_header('user-1', expires_in=-10)
+        for _ in range(2):
+            with self.assertRaisesMessage(exceptions.AuthenticationFailed, 'Token has expired'):
+                self.authenticate(header)
+        self.assertEqual(self.verify.call_count, 2)
+
+    def test_cache_is_bounded(self):
+        cache = VerifiedTokenCache(max_size=2)
+        for token in ('a', 'b', 'c'):
+            cache.set(VerifiedTokenCache.key(token), token, time.time() + 60)
+        self.assertIsNone(cache.get(VerifiedTokenCache.key('a')))
+        self.assertEqual(cache.get(VerifiedTokenCache.key('c')), 'c')
+
+
+class JWKSTests(SimpleTestCase):
+    """Asymmetric tokens are checked against the cached JWKS."""
+
+    def setUp(self):
+        self.private_key = ec.generate_private_key(ec.SECP256R1())
+        jwk = jwt.algorithms.ECAlgorithm.to_jwk(self.private_key.public_key(), as_dict=True)
+        self.client = SupabaseJWKClient('https://example.supabase.co/auth/v1/.well-known/jwks.json', cache_keys=True)
+        fetch = mock.patch.object(self.client, 'fetch_data', return_value={'keys': [{**jwk, 'kid': 'key-1', 'use': 'sig'}]})
+        self.fetch = fetch.start()
+        self.addCleanup(fetch.stop)
+        get_client = mock.patch('analyses.authentication.get_jwks_client', return_value=self.client)
+        get_client.start()
+        self.addCleanup(get_client.stop)
+
+    def token(self, kid):
+        claims = {'sub': 'user-1', 'aud': 'authenticated', 'exp': int(time.time()) + 3600}
+        return jwt.encode(claims, self.private_key, algorithm='ES256', headers={'kid': kid})
+
+    def test_known_key(self):
+        self.assertEqual(verify_token(self.token('key-1'))['sub'], 'user-1')
+        self.assertEqual(verify_token(self.token('key-1'))['sub'], 'user-1')
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def test_unknown_key_refetches_at_most_once_per_interval(self):
+        verify_token(self.token('key-1'))
+        for _ in range(3):
+            with self.assertRaises(exceptions.AuthenticationFailed):
+                verify_token(self.token('made-up'))
+        # One refetch for the unknown key, the rest are refused without a request
+        self.assertEqual(self.fetch.call_count, 2)
+
+        self.client._last_refresh -= authentication.JWKS_REFRESH_SECONDS
+        with self.assertRaises(exceptions.AuthenticationFailed):
+            verify_token(self.token('made-up'))
+        self.assertEqual(self.fetch.call_count, 3)
+
+
+class BiomarkerCanonicalizationTests(SimpleTestCase):
+
+    def test_synonyms(self):
+        self.assertEqual(canonical_marker('Haemoglobin (Hb)'), 'hemoglobin')
+        self.assertEqual(canonical_marker('HGB'), 'hemoglobin')
+        self.assertEqual(canonical_marker('Serum Ferritin'), 'ferritin')
+        self.assertEqual(canonical_marker('S. Creatinine'), 'creatinine')
+
+    def test_short_synonyms_only_match_whole_names(self):
+        for name, marker in [('K', 'potassium'), ('Na', 'sodium'), ('Ca', 'calcium'), ('Cr', 'creatinine'),
+                             ('Mg', 'magnesium'), ('TP', 'total_protein'), ('TC', 'total_cholesterol')]:
+            self.assertEqual(canonical_marker(name), marker)
+        # A unit or abbreviation in parentheses is not the marker
+        self.assertEqual(canonical_marker('Microalbumin (mg)'), 'microalbumin_mg')
+        self.assertEqual(canonical_marker('Vitamin K'), 'vitamin_k')
+        self.assertEqual(canonical_marker('Ferritin (ng/mL) (Fe)'), 'ferritin')
+        # Qualifiers such as 'serum' are not part of the name
+        self.assertEqual(canonical_marker('Serum K'), 'potassium')
+
+    def test_specimen_is_kept_apart(self):
+        self.assertEqual(canonical_marker('Glucose (Urine)'), 'glucose_urine')
+        self.assertEqual(canonical_marker('24h Urine Protein'), '24h_urine_protein')
+
+    def test_unit_conversion(self):
+        self.assertEqual(convert_to_canonical('glucose', 5.5, 'mmol/L'), (99.088, 'mg/dL'))
+        self.assertEqual(convert_to_canonical('hemoglobin', 141, 'g/L'), (14.1, 'g/dL'))
+        self.assertEqual(convert_to_canonical('platelets', 250, 'x10^3/µL'), (250, '10^9/L'))
+        # HbA1c converts from IFCC mmol/mol with an offset
+        self.assertEqual(convert_to_canonical('hba1c', 48, 'mmol/mol'), (6.543, '%'))
+        # Unknown units are kept as reported
+        self.assertEqual(convert_to_canonical('glucose', 5.5, 'furlongs'), (5.5, 'furlongs'))
+
+    def test_values(self):
+        self.assertEqual(parse_value('3,1'), 3.1)
+        self.assertEqual(parse_value('1,234'), 1234)
+        self.assertEqual(parse_value('<5'), 5)
+        self.assertIsNone(parse_value('negative'))
+
+    def test_ranges(self):
+        self.assertEqual(parse_range('4.0 - 5.5'), (4.0, 5.5))
+        self.assertEqual(parse_range('<200'), (None, 200))
+        self.assertEqual(parse_range('>= 40'), (40, None))
+        self.assertEqual(parse_range('Desirable: <200; Borderline: 200-239'), (None, None))
+        self.assertEqual(parse_range('150-400 x10^9/L'), (150, 400))
+
+    def test_status_is_kept_for_tiered_range(self):
+        results = normalize_results([
+            {'marker': 'Cholesterol', 'value': '210', 'unit': 'mg/dL',
+             'reference_range': 'Desirable: <200; Borderline: 200-239', 'status': 'High'},
+            {'marker': 'Glucose', 'value': '6,1', 'unit': 'mmol/L', 'reference_range': '3,9-5,5', 'status': 'normal'},
+        ])
+        self.assertEqual(results[0]['status'], 'high')
+        self.assertEqual((results[1]['canonical_marker'], results[1]['status']), ('glucose', 'high'))
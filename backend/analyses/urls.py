@@ -1,8 +1,9 @@
 from django.urls import path
-from .views import AnalysisListCreateView, AnalysisDetailView, DeleteAccountView
+from .views import AnalysisListCreateView, AnalysisDetailView, BiomarkerTrendView, DeleteAccountView
 
 urlpatterns = [
     path('', AnalysisListCreateView.as_view(), name='analysis-list-create'),
+    path('trends/', BiomarkerTrendView.as_view(), name='biomarker-trend'),
     path('<uuid:analysis_id>/', AnalysisDetailView.as_view(), name='analysis-detail'),
     path('delete-account/', DeleteAccountView.as_view(), name='delete-account'),
 ]
@@ -4,11 +4,18 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
-from .models import Analysis
-from .serializers import AnalysisSerializer, AnalysisListSerializer, CreateAnalysisSerializer
+from .models import Analysis, BiomarkerResult, LIST_FIELDS
+from .serializers import (
+    AnalysisSerializer, AnalysisListSerializer, CreateAnalysisSerializer, ListAnalysesSerializer,
+    BiomarkerTrendSerializer, BiomarkerResultSerializer,
+)
+from .biomarkers import canonical_marker, normalize_parsed_data
+from backend.cursors import encode_cursor
+from .pagination import keyset_page
 from .authentication import SupabaseAuthentication
-from chat.models import ChatMessage
-from supabase import create_client
+from chat.store import get_chat_store
+from backend.supabase_clients import get_supabase_client, supabase_url
+from subscriptions.tasks import cancel_subscription
 
 # Initialize Stripe (only if key is available, don't fail if not set)
 if os.environ.get('STRIPE_SECRET_KEY'):
@@ -17,18 +24,60 @@ if os.environ.get('STRIPE_SECRET_KEY'):
 
 class AnalysisListCreateView(APIView):
     """
-    GET: List all analyses for the authenticated user
+    GET: List analyses for the authenticated user
     POST: Create a new analysis
+
+    With limit, cursor or updated_since the list is paginated by (created_at, id),
+    newest first. With updated_since it returns only analyses changed after
+    that time, ordered by (updated_at, id). Without any of them the full list
+    is returned as a bare array, as older app versions expect.
     """
     authentication_classes = [SupabaseAuthentication]
     permission_classes = [IsAuthenticated]
 
+    PAGE_PARAMS = ('limit', 'cursor', 'updated_since')
+
     def get(self, request):
-        """Get all analyses for the authenticated user."""
+        """Get analyses for the authenticated user."""
         user_id = request.user.user_id
-        analyses = Analysis.objects.filter(user_id=user_id).order_by('-created_at')
-        serializer = AnalysisListSerializer(analyses, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        analyses = Analysis.objects.filter(user_id=user_id).only(*LIST_FIELDS)
+        
+        if not any(param in request.query_params for param in self.PAGE_PARAMS):
+            serializer = AnalysisListSerializer(analyses.order_by('-created_at'), many=True)
+            return Response(serializer.data, status=status.HTTP_200_OK)
+        
+        params = ListAnalysesSerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response(
+                {'error': 'Invalid parameters', 'details': params.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        updated_since = params.validated_data.get('updated_since')
+        if updated_since:
+            # Deletions are not reported; clients reconcile them with a full list
+            field, descending = 'updated_at', False
+            analyses = analyses.filter(updated_at__gt=updated_since)
+        else:
+            field, descending = 'created_at', True
+        
+        page, has_more = keyset_page(
+            analyses,
+            field,
+            cursor=params.validated_data.get('cursor'),
+            limit=params.validated_data['limit'],
+            descending=descending,
+        )
+        
+        body = {
+            'results': AnalysisListSerializer(page, many=True).data,
+            'has_more': has_more,
+            'next_cursor': encode_cursor(getattr(page[-1], field), page[-1].id) if has_more else None,
+        }
+        if updated_since:
+            # Pass as updated_since on the next sync once has_more is false
+            body['sync_time'] = page[-1].updated_at if page else updated_since
+        return Response(body, status=status.HTTP_200_OK)
 
     def post(self, request):
         """Create a new analysis for the authenticated user."""
@@ -43,7 +92,8 @@ class AnalysisListCreateView(APIView):
         # Create the analysis with the authenticated user's ID
         analysis = Analysis.objects.create(
             user_id=request.user.user_id,
-            parsed_data=serializer.validated_data['parsed_data'],
+            # Older app versions send results without canonical markers or computed statuses
+            parsed_data=normalize_parsed_data(serializer.validated_data['parsed_data']),
             analysis=serializer.validated_data['analysis'],
             title=serializer.validated_data.get('title')
         )
@@ -94,10 +144,43 @@ class AnalysisDetailView(APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class BiomarkerTrendView(APIView):
+    """
+    GET: A marker's results across the authenticated user's analyses, oldest first
+    Query: marker (name or canonical key), optional date_from / date_to
+    """
+    authentication_classes = [SupabaseAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = BiomarkerTrendSerializer(data=request.query_params)
+        if not params.is_valid():
+            return Response(
+                {'error': 'Invalid parameters', 'details': params.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        marker = canonical_marker(params.validated_data['marker'])
+        # Served from the (user_id, marker, date) index
+        results = BiomarkerResult.objects.filter(user_id=request.user.user_id, marker=marker)
+        if params.validated_data.get('date_from'):
+            results = results.filter(date__gte=params.validated_data['date_from'])
+        if params.validated_data.get('date_to'):
+            results = results.filter(date__lte=params.validated_data['date_to'])
+        results = results.only('analysis_id', 'date', 'value', 'unit', 'status', 'name').order_by('date', 'id')
+        
+        return Response({
+            'marker': marker,
+            'results': BiomarkerResultSerializer(results, many=True).data,
+        }, status=status.HTTP_200_OK)
+
+
 class DeleteAccountView(APIView):
     """
     DELETE: Delete all user data (analyses, chat messages, subscription)
     Note: This does NOT delete the Supabase auth user - that must be done from the frontend
+    The Stripe subscription is cancelled by a task worker after the response;
+    subscription_cancellation_queued only says the cancellation was queued.
     """
     authentication_classes = [SupabaseAuthentication]
     permission_classes = [IsAuthenticated]
@@ -107,48 +190,37 @@ class DeleteAccountView(APIView):
         user_id = request.user.user_id
         
         try:
-            # Cancel Stripe subscription if exists
-            subscription_cancelled = False
-            supabase_url = os.environ.get("SUPABASE_URL") or os.environ.get("SUPABASE_PROJECT_URL")
-            supabase_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY") or os.environ.get("SUPABASE_ANON_KEY")
+            # Queue cancellation of the Stripe subscription if one exists
+            subscription_cancellation_queued = False
             
-            if supabase_url and supabase_key and stripe.api_key:
+            if supabase_url() and stripe.api_key:
                 try:
-                    supabase = create_client(supabase_url, supabase_key)
+                    supabase = get_supabase_client()
                     # Get user's subscription
                     subscription_response = supabase.table('subscriptions').select('stripe_subscription_id').eq('user_id', user_id).eq('status', 'active').execute()
                     
                     if subscription_response.data and len(subscription_response.data) > 0:
                         stripe_subscription_id = subscription_response.data[0].get('stripe_subscription_id')
                         if stripe_subscription_id:
-                            # Cancel the subscription in Stripe
-                            stripe.Subscription.delete(stripe_subscription_id)
-                            subscription_cancelled = True
-                            
-                            # Update subscription status in Supabase
-                            supabase.table('subscriptions').update({
-                                'status': 'cancelled',
-                            }).eq('stripe_subscription_id', stripe_subscription_id).execute()
+                            # Cancelled in Stripe and marked cancelled by the task workers, with retries
+                            cancel_subscription.enqueue(stripe_subscription_id=stripe_subscription_id)
+                            subscription_cancellation_queued = True
                 except Exception as sub_error:
                     # Log error but don't fail the entire deletion if subscription cancellation fails
                     print(f'Warning: Failed to cancel subscription during account deletion: {str(sub_error)}')
             
-            # Delete all analyses for the user
-            analyses_count = Analysis.objects.filter(user_id=user_id).delete()[0]
+            # Delete all analyses for the user; the total also counts their cascaded biomarker rows
+            analyses_count = Analysis.objects.filter(user_id=user_id).delete()[1].get('analyses.Analysis', 0)
             
             # Delete all chat messages for the user (this also deletes associated files)
-            chat_messages = ChatMessage.objects.filter(user_id=user_id)
-            # Delete files first
-            for msg in chat_messages:
-                msg.delete_file()
-            chat_count = chat_messages.delete()[0]
+            chat_count = get_chat_store().clear(user_id)
             
             return Response(
                 {
                     'message': 'Account data deleted successfully',
                     'analyses_deleted': analyses_count,
                     'chat_messages_deleted': chat_count,
-                    'subscription_cancelled': subscription_cancelled,
+                    'subscription_cancellation_queued': subscription_cancellation_queued,
                 },
                 status=status.HTTP_200_OK
             )
@@ -7,18 +7,7 @@ from django.views.decorators.http import require_http_methods
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-from supabase import create_client, Client
-
-
-def get_supabase_client() -> Client:
-    """Get Supabase client instance."""
-    url = os.environ.get("SUPABASE_URL") or os.environ.get("SUPABASE_PROJECT_URL")
-    key = os.environ.get("SUPABASE_ANON_KEY") or os.environ.get("SUPABASE_KEY") or os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-    
-    if not url or not key:
-        raise RuntimeError('Supabase credentials are missing. Set SUPABASE_URL and SUPABASE_ANON_KEY.')
-    
-    return create_client(url, key)
+from backend.supabase_clients import ANON, get_supabase_client
 
 
 @api_view(['POST'])
@@ -42,7 +31,7 @@ def google_oauth_initiate(request):
             )
         
         # Get Supabase client
-        supabase = get_supabase_client()
+        supabase = get_supabase_client(ANON)
         
         # Generate OAuth URL using Supabase
         # The Python client uses a different API - we need to build the URL manually
@@ -122,22 +111,20 @@ def google_oauth_callback(request):
             )
         
         # Get Supabase client
-        supabase = get_supabase_client()
+        supabase = get_supabase_client(ANON)
         
-        # Set the session using the access token
+        # Look up the user for the access token. The shared client must not
+        # hold a session, so the token is passed per call instead of set_session()
         try:
-            session_response = supabase.auth.set_session(
-                access_token=access_token,
-                refresh_token=refresh_token or ''
-            )
+            user_response = supabase.auth.get_user(access_token)
             
-            if not session_response or not session_response.user:
+            if not user_response or not user_response.user:
                 return Response(
                     {'error': 'Failed to set session'},
                     status=500
                 )
             
-            user = session_response.user
+            user = user_response.user
         except Exception as e:
             return Response(
                 {'error': f'Failed to set session: {str(e)}'},
@@ -0,0 +1,27 @@
+"""
+Opaque keyset pagination cursors, shared by the analyses and chat endpoints.
+
+A cursor encodes a row's (timestamp, id) position as unpadded URL-safe
+base64, so clients pass it back without parsing it.
+"""
+import base64
+from datetime import datetime
+
+
+def encode_cursor(timestamp: datetime, item_id) -> str:
+    """Opaque cursor for a row's (timestamp, id) position."""
+    raw = f"{timestamp.isoformat()}|{item_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, id_type=int) -> tuple:
+    """
+    Inverse of encode_cursor, with the id converted by id_type (e.g. int or uuid.UUID).
+    Raises ValueError for malformed cursors.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, item_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), id_type(item_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
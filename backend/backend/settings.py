@@ -1,4 +1,5 @@
 from pathlib import Path
+from corsheaders.defaults import default_headers
 from dotenv import load_dotenv
 import os
 
@@ -51,6 +52,8 @@ INSTALLED_APPS = [
     'chat',
     'auth.apps.AuthConfig',  # Use the full app config path
     'subscriptions',
+    'idempotency',
+    'tasks',
 ]
 
 MIDDLEWARE = [
@@ -84,6 +87,42 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'backend.wsgi.application'
 
+# Serve the chat and analysis endpoints with async views (set by backend/asgi.py)
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False').lower() in ('1', 'true', 'yes')
+
+# Idempotency-Key handling for chat and analysis POST endpoints
+IDEMPOTENCY_WAIT_SECONDS = int(os.getenv('IDEMPOTENCY_WAIT_SECONDS', 120))
+IDEMPOTENCY_STALE_SECONDS = int(os.getenv('IDEMPOTENCY_STALE_SECONDS', 300))
+
+# Uploads larger than this are spooled to a temporary file instead of memory,
+# and the chat pipeline reads them from disk
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(os.getenv('FILE_UPLOAD_MAX_MEMORY_SIZE', 1024 * 1024))
+
+# Cache shared by the web and worker processes, so a webhook applied by a
+# worker updates what every web process serves. Redis when CACHE_REDIS_URL
+# is set, otherwise a table in the database (python manage.py createcachetable)
+if os.getenv('CACHE_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+        }
+    }
+
+# Cache alias holding subscription entitlements; it must be shared across
+# processes, a process-local cache is never used for them
+ENTITLEMENT_CACHE_ALIAS = os.getenv('ENTITLEMENT_CACHE_ALIAS', 'default')
+
+# Seconds a user's subscription entitlement is cached
+ENTITLEMENT_CACHE_SECONDS = int(os.getenv('ENTITLEMENT_CACHE_SECONDS', 60))
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
@@ -146,4 +185,5 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # CORS Configuration - Allow all origins in development
 CORS_ALLOW_ALL_ORIGINS = True
-CORS_ALLOW_CREDENTIALS = True
\ No newline at end of file
+CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
\ No newline at end of file
@@ -0,0 +1,144 @@
+"""
+Process-wide Supabase clients.
+
+One client per role (service role and anon) is built on first use and
+shared by every app, each on its own keep-alive httpx pool with fixed
+timeouts, so client construction and TLS setup happen once per worker.
+Clients never hold a user session: they are configured without session
+persistence or token refresh, and callers must not call auth.set_session()
+or sign in on them.
+
+Clients are dropped in a forked child (gunicorn with --preload) so workers
+never share sockets with their parent.
+"""
+import os
+import logging
+import threading
+import httpx
+from supabase import Client, ClientOptions, create_client
+
+logger = logging.getLogger(__name__)
+
+SERVICE_ROLE = 'service_role'
+ANON = 'anon'
+
+# Keep-alive pool and timeouts for PostgREST, auth and storage calls
+MAX_CONNECTIONS = int(os.getenv('SUPABASE_MAX_CONNECTIONS', 10))
+KEEPALIVE_EXPIRY = 60
+TIMEOUT = httpx.Timeout(float(os.getenv('SUPABASE_TIMEOUT', 15)), connect=5.0)
+
+
+def supabase_url() -> str:
+    return os.getenv('SUPABASE_URL') or os.getenv('SUPABASE_PROJECT_URL')
+
+
+def supabase_key(role: str) -> str:
+    """API key for a role. Each falls back to the other, as the per-call helpers used to."""
+    service_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
+    anon_key = os.getenv('SUPABASE_ANON_KEY') or os.getenv('SUPABASE_KEY')
+    if role == SERVICE_ROLE:
+        return service_key or anon_key
+    return anon_key or service_key
+
+
+class SupabaseClientRegistry:
+    """
+    Lazily built Supabase clients keyed by role.
+    Counts requests and new TCP connections to show how often connections are reused.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._http_clients = {}
+        self._lock = threading.Lock()
+        self._stats = {'clients_created': 0, 'requests': 0, 'connections_opened': 0}
+
+    def get(self, role: str = SERVICE_ROLE) -> Client:
+        client = self._clients.get(role)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(role)
+                if client is None:
+                    client = self._create(role)
+                    self._clients[role] = client
+        return client
+
+    def _create(self, role: str) -> Client:
+        url = supabase_url()
+        key = supabase_key(role)
+        if not url or not key:
+            raise RuntimeError('Supabase credentials are missing. Set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY.')
+
+        http_client = httpx.Client(
+            timeout=TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            follow_redirects=True,
+            event_hooks={'request': [self._on_request]},
+        )
+        options = ClientOptions(
+            httpx_client=http_client,
+            auto_refresh_token=False,
+            persist_session=False,
+        )
+        client = create_client(url, key, options)
+        self._http_clients[role] = http_client
+        self._stats['clients_created'] += 1
+        logger.info("Created Supabase %s client (pid %d)", role, os.getpid())
+        return client
+
+    def _increment(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _on_request(self, request: httpx.Request):
+        self._increment('requests')
+        request.extensions['trace'] = self._trace
+
+    def _trace(self, event_name: str, info: dict):
+        # Only fired when the pool has to open a new TCP connection
+        if event_name == 'connection.connect_tcp.complete':
+            self._increment('connections_opened')
+
+    def metrics(self) -> dict:
+        """Snapshot of client and connection counters."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['connections_reused'] = max(stats['requests'] - stats['connections_opened'], 0)
+        stats['roles'] = sorted(self._clients)
+        return stats
+
+    def close(self):
+        """Close every pool. Used on shutdown."""
+        with self._lock:
+            http_clients = list(self._http_clients.values())
+            self._clients.clear()
+            self._http_clients.clear()
+        for http_client in http_clients:
+            http_client.close()
+
+    def _after_fork(self):
+        # The parent's sockets and lock must not be used by the child; drop without closing
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._http_clients = {}
+        self._stats = {'clients_created': 0, 'requests': 0, 'connections_opened': 0}
+
+
+_registry = SupabaseClientRegistry()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_registry._after_fork)
+
+
+def get_supabase_client(role: str = SERVICE_ROLE) -> Client:
+    """Return the shared Supabase client for a role (SERVICE_ROLE or ANON)."""
+    return _registry.get(role)
+
+
+def supabase_metrics() -> dict:
+    """Request and connection counters for the shared clients."""
+    return _registry.metrics()
@@ -0,0 +1,50 @@
+"""
+Settings for the test suite: python manage.py test --settings=backend.test_settings
+
+Tests run against a local SQLite database instead of the Supabase pooler.
+The analyses table predates the Django migrations (which alter it with
+PostgreSQL-only SQL), so migrations are disabled and every table is created
+straight from the models.
+"""
+import os
+
+# Placeholder credentials so modules that build API clients at import time load
+os.environ.setdefault('OPENAI_API_KEY', 'test-openai-key')
+os.environ.setdefault('STRIPE_SECRET_KEY', 'sk_test_placeholder')
+os.environ.setdefault('STRIPE_WEBHOOK_SECRET', 'whsec_placeholder')
+os.environ.setdefault('SUPABASE_JWT_SECRET', 'test-jwt-secret-with-at-least-32-bytes')
+
+from .settings import *  # noqa: E402,F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'test_db.sqlite3',
+    }
+}
+
+
+class DisableMigrations:
+    def __contains__(self, app_label):
+        return True
+
+    def __getitem__(self, app_label):
+        return None
+
+
+MIGRATION_MODULES = DisableMigrations()
+
+# The same database cache as production, plus a second alias on the same
+# table standing in for another process
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+    },
+    'other_process': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+    },
+}
+
+ALLOWED_HOSTS = ['testserver']
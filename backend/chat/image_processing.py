@@ -0,0 +1,244 @@
+"""
+Image normalization for the vision chat path.
+
+Uploads are turned into a base64 JPEG that fits the vision model limits.
+Large JPEGs are decoded at a reduced scale (draft mode), images that are
+already compliant are passed through untouched, oversized images are
+rejected before decoding, and work runs in a small bounded thread pool
+with results cached by content hash.
+
+Images can be given as bytes or as the path of an upload spooled to disk,
+in which case Pillow reads the file directly and the raw bytes are never
+held in memory. Peak Python memory is then bounded by the output: the
+normalized JPEG and its base64 string, under 3x the base64 length whatever
+the upload size.
+"""
+import base64
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Longest side sent to the vision model
+MAX_DIMENSION = 2048
+
+# JPEG quality used when an image has to be re-encoded
+JPEG_QUALITY = 85
+
+# Already-compliant JPEGs up to this size are sent as-is
+PASSTHROUGH_MAX_BYTES = 2 * 1024 * 1024
+
+# Refuse to decode anything larger than this (decompression bomb guard)
+MAX_PIXELS = int(os.getenv('CHAT_IMAGE_MAX_PIXELS', 50_000_000))
+
+# Number of images processed concurrently per worker process
+MAX_WORKERS = int(os.getenv('CHAT_IMAGE_WORKERS', 2))
+
+# Seconds to wait for a normalization job before giving up
+NORMALIZE_TIMEOUT = 30
+
+# Result cache limits
+CACHE_MAX_ENTRIES = 64
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Pillow raises DecompressionBombError at twice this value
+Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+# Read size when hashing files on disk
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an image exceeds the pixel budget."""
+
+
+class _ResultCache:
+    """Thread-safe LRU of base64 results (and small per-image metadata) keyed by content hash."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value, size: int = None):
+        """Store a value; size defaults to len(value) and counts towards max_bytes."""
+        size = len(value) if size is None else size
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._data[key] = (value, size)
+            self._size += size
+            while len(self._data) > self.max_entries or self._size > self.max_bytes:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+
+_cache = _ResultCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='chat-image')
+
+
+def content_hash(source) -> str:
+    """
+    Return the SHA-256 hex digest used as the cache key.
+    source is bytes or a file path; files are hashed in chunks.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        digest = hashlib.sha256()
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    return hashlib.sha256(source).hexdigest()
+
+
+def source_size(source) -> int:
+    """Size in bytes of image bytes or a file path."""
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    return len(source)
+
+
+def read_source(source) -> bytes:
+    """Return the raw bytes of a source. Only used for small files."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return f.read()
+    return source
+
+
+def open_image(source) -> Image.Image:
+    """
+    Open an image lazily, rejecting it if it exceeds the pixel budget.
+    Only the header is read, so this is cheap even for huge files.
+    source is bytes or a file path.
+    """
+    try:
+        if isinstance(source, (str, os.PathLike)):
+            image = Image.open(source)
+        else:
+            image = Image.open(BytesIO(source))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e)) from e
+
+    width, height = image.size
+    if width * height > MAX_PIXELS:
+        raise ImageTooLargeError(
+            f'Image is too large ({width}x{height}). Maximum is {MAX_PIXELS} pixels.'
+        )
+    return image
+
+
+def _is_compliant(image: Image.Image, size_in_bytes: int, max_dimension: int) -> bool:
+    """True if the original bytes can be sent without re-encoding."""
+    return (
+        image.format == 'JPEG'
+        and image.mode in ('RGB', 'L')
+        and max(image.size) <= max_dimension
+        and size_in_bytes <= PASSTHROUGH_MAX_BYTES
+    )
+
+
+def _normalize(source, max_dimension: int = MAX_DIMENSION) -> bytes:
+    """Return JPEG bytes no larger than max_dimension on the longest side."""
+    image = open_image(source)
+
+    if _is_compliant(image, source_size(source), max_dimension):
+        image.close()
+        return read_source(source)
+
+    target = (max_dimension, max_dimension)
+
+    # Let libjpeg decode at 1/2, 1/4 or 1/8 scale instead of full resolution
+    if image.format == 'JPEG':
+        image.draft('RGB', target)
+
+    # Palette and bilevel images cannot be resampled with LANCZOS
+    if image.mode in ('1', 'P'):
+        image = image.convert('RGB')
+
+    # thumbnail() uses reduce() before resampling for non-JPEG sources
+    if max(image.size) > max_dimension:
+        image.thumbnail(target, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    buffered = BytesIO()
+    image.save(buffered, format='JPEG', quality=JPEG_QUALITY)
+    return buffered.getvalue()
+
+
+def encode_image(source, key: str = None, max_dimension: int = MAX_DIMENSION) -> str:
+    """
+    Normalize on the calling thread and return a base64 JPEG string.
+    Use this from code already running on the image pool.
+    """
+    cache_key = f"{key or content_hash(source)}:{max_dimension}"
+    cached = _cache.get(cache_key)
+    if cached is not None:
+        logger.debug("Image cache hit for %s", cache_key)
+        return cached
+    encoded = base64.b64encode(_normalize(source, max_dimension)).decode('ascii')
+    _cache.set(cache_key, encoded)
+    return encoded
+
+
+def cache_get(key: str):
+    """Look up a value cached alongside the normalized images."""
+    return _cache.get(key)
+
+
+def cache_set(key: str, value, size: int) -> None:
+    """Cache a small value alongside the normalized images, e.g. an image's vision profile."""
+    _cache.set(key, value, size)
+
+
+def submit(fn, *args, **kwargs):
+    """Run image work on the bounded image pool. Returns a Future."""
+    return _executor.submit(fn, *args, **kwargs)
+
+
+def normalize_image_async(source, key: str = None, max_dimension: int = MAX_DIMENSION):
+    """
+    Schedule normalization on the image pool.
+    Returns a Future resolving to the base64 JPEG string.
+    """
+    key = key or content_hash(source)
+    cached = _cache.get(f"{key}:{max_dimension}")
+    if cached is not None:
+        future = Future()
+        future.set_result(cached)
+        return future
+    return _executor.submit(encode_image, source, key, max_dimension)
+
+
+def normalize_image(source, key: str = None, max_dimension: int = MAX_DIMENSION) -> str:
+    """
+    Normalize image bytes or an image file for the vision model and return a base64 JPEG string.
+    Raises ImageTooLargeError for images above the pixel budget.
+    """
+    return normalize_image_async(source, key, max_dimension).result(timeout=NORMALIZE_TIMEOUT)
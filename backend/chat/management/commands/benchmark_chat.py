@@ -0,0 +1,117 @@
+import asyncio
+import json
+import statistics
+import time
+import httpx
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Send concurrent requests to a chat/analysis endpoint and report latency and throughput. '
+        'Run it against the WSGI (gunicorn sync) and ASGI (uvicorn) deployments with the same '
+        'options to compare them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            default='http://127.0.0.1:8000/api/chat/send/',
+            help='Endpoint to call (default: local /api/chat/send/)'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=50,
+            help='Number of requests in flight at once (default: 50)'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Total number of requests to send (default: 200)'
+        )
+        parser.add_argument(
+            '--user-id',
+            default='benchmark-user',
+            help='user_id sent with chat requests (default: benchmark-user)'
+        )
+        parser.add_argument(
+            '--message',
+            default='What does a high LDL cholesterol result mean?',
+            help='Message sent with chat requests'
+        )
+        parser.add_argument(
+            '--file',
+            default=None,
+            help='Send this file as multipart "file" (for send-file/ and analyze/) instead of JSON'
+        )
+        parser.add_argument(
+            '--timeout',
+            type=float,
+            default=120.0,
+            help='Per-request timeout in seconds (default: 120)'
+        )
+
+    def handle(self, *args, **options):
+        results = asyncio.run(self.run_benchmark(options))
+        self.report(results, options)
+
+    async def run_benchmark(self, options):
+        file_bytes = None
+        if options['file']:
+            with open(options['file'], 'rb') as f:
+                file_bytes = f.read()
+
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        limits = httpx.Limits(max_connections=options['concurrency'])
+
+        async with httpx.AsyncClient(timeout=options['timeout'], limits=limits) as client:
+            async def one_request():
+                async with semaphore:
+                    started = time.perf_counter()
+                    try:
+                        if file_bytes is not None:
+                            response = await client.post(
+                                options['url'],
+                                data={'user_id': options['user_id'], 'message': options['message']},
+                                files={'file': (options['file'].split('/')[-1], file_bytes)},
+                            )
+                        else:
+                            response = await client.post(
+                                options['url'],
+                                content=json.dumps({'user_id': options['user_id'], 'message': options['message']}),
+                                headers={'Content-Type': 'application/json'},
+                            )
+                        ok = response.status_code < 400
+                    except httpx.HTTPError:
+                        ok = False
+                    return ok, time.perf_counter() - started
+
+            started = time.perf_counter()
+            outcomes = await asyncio.gather(*(one_request() for _ in range(options['requests'])))
+            wall_time = time.perf_counter() - started
+
+        return {'outcomes': outcomes, 'wall_time': wall_time}
+
+    def report(self, results, options):
+        latencies = sorted(latency for ok, latency in results['outcomes'] if ok)
+        errors = sum(1 for ok, _ in results['outcomes'] if not ok)
+        wall_time = results['wall_time']
+
+        def percentile(p):
+            if not latencies:
+                return 0.0
+            index = min(len(latencies) - 1, int(round(p / 100 * (len(latencies) - 1))))
+            return latencies[index]
+
+        self.stdout.write(f"URL:          {options['url']}")
+        self.stdout.write(f"Requests:     {options['requests']} ({options['concurrency']} concurrent)")
+        self.stdout.write(f"Errors:       {errors}")
+        self.stdout.write(f"Wall time:    {wall_time:.2f}s")
+        self.stdout.write(f"Throughput:   {len(latencies) / wall_time if wall_time else 0:.2f} req/s")
+        if latencies:
+            self.stdout.write(f"Latency mean: {statistics.mean(latencies):.3f}s")
+            self.stdout.write(f"Latency p50:  {percentile(50):.3f}s")
+            self.stdout.write(f"Latency p95:  {percentile(95):.3f}s")
+            self.stdout.write(f"Latency p99:  {percentile(99):.3f}s")
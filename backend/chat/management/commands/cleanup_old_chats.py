@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
-from chat.models import ChatMessage
+from chat.store import get_chat_store
+from chat.tasks import expire_chat_messages
 
 
 class Command(BaseCommand):
@@ -12,16 +13,70 @@ class Command(BaseCommand):
             default=30,
             help='Delete messages older than this many minutes (default: 30)'
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of messages deleted per batch (default: 500)'
+        )
+        parser.add_argument(
+            '--max-seconds',
+            type=float,
+            default=None,
+            help='Stop starting new batches after this many seconds (default: no limit)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would be deleted without deleting anything'
+        )
+        parser.add_argument(
+            '--enqueue',
+            action='store_true',
+            help='Queue the cleanup for the task workers instead of running it here'
+        )
 
     def handle(self, *args, **options):
         minutes = options['minutes']
-        deleted_count = ChatMessage.cleanup_old_messages(minutes=minutes)
+        dry_run = options['dry_run']
+        
+        if options['enqueue'] and not dry_run:
+            queued = expire_chat_messages.enqueue(minutes=minutes, batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Queued chat cleanup as task #{queued.id}"))
+            return
+        
+        totals = {'batches': 0, 'matched': 0, 'deleted': 0, 'files': 0, 'files_removed': 0}
+        elapsed = 0.0
+        
+        for batch in get_chat_store().expire_in_batches(
+            minutes=minutes,
+            batch_size=options['batch_size'],
+            dry_run=dry_run,
+            max_seconds=options['max_seconds'],
+        ):
+            totals['batches'] += 1
+            for key in ('matched', 'deleted', 'files', 'files_removed'):
+                totals[key] += batch[key]
+            elapsed = batch['elapsed']
+            
+            self.stdout.write(
+                f"Batch {totals['batches']}: {batch['matched']} messages, {batch['files']} files "
+                f"({batch['oldest']:%Y-%m-%d %H:%M:%S} .. {batch['newest']:%Y-%m-%d %H:%M:%S}), "
+                f"{totals['matched']} total in {elapsed:.1f}s"
+            )
+        
+        if dry_run:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Dry run: {totals['matched']} messages and {totals['files']} files older than "
+                    f"{minutes} minutes would be deleted ({totals['batches']} batches)"
+                )
+            )
+            return
         
         self.stdout.write(
             self.style.SUCCESS(
-                f'Successfully deleted {deleted_count} messages older than {minutes} minutes'
+                f"Successfully deleted {totals['deleted']} messages older than {minutes} minutes and queued "
+                f"{totals['files_removed']} files for removal in {totals['batches']} batches ({elapsed:.1f}s)"
             )
         )
-
-
-
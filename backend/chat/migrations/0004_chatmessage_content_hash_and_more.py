@@ -0,0 +1,22 @@
+# Generated by Django 4.2.27 on 2026-10-19 08:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_rename_file_path_chatmessage_storage_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['user_id', 'content_hash'], name='chat_chatme_user_id_ee3a77_idx'),
+        ),
+    ]
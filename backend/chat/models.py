@@ -1,8 +1,14 @@
 import os
+import time
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 from datetime import timedelta
-from .supabase_client import get_supabase_client
+from .storage import get_storage_gateway, remove_files
+
+# Attachments are only reused from messages this recent, so the stored file
+# cannot be expired by cleanup_old_chats between lookup and reuse
+ATTACHMENT_REUSE_MINUTES = int(os.getenv('CHAT_ATTACHMENT_REUSE_MINUTES', 20))
 
 
 class ChatMessage(models.Model):
@@ -32,6 +38,7 @@ class ChatMessage(models.Model):
     file_name = models.CharField(max_length=255, blank=True, null=True)
     storage_path = models.CharField(max_length=500, blank=True, null=True)
     file_size = models.IntegerField(blank=True, null=True)  # Size in bytes
+    content_hash = models.CharField(max_length=64, blank=True, null=True)  # SHA-256 of the file bytes
     
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     
@@ -39,6 +46,7 @@ class ChatMessage(models.Model):
         ordering = ['created_at']
         indexes = [
             models.Index(fields=['user_id', 'created_at']),
+            models.Index(fields=['user_id', 'content_hash']),
         ]
     
     def __str__(self):
@@ -47,15 +55,18 @@ class ChatMessage(models.Model):
         return f"{self.role}: [{self.message_type}] {self.file_name}"
     
     def delete_file(self):
-        """Delete the associated file from Supabase storage if it exists."""
+        """Delete the associated file from Supabase storage if no other message uses it."""
         if self.storage_path:
-            try:
-                client = get_supabase_client()
-                bucket = ChatStorage.bucket_name()
-                client.storage.from_(bucket).remove([self.storage_path])
-            except Exception:
-                # Ignore storage deletion errors to avoid blocking DB cleanup
-                pass
+            if ChatMessage.objects.filter(storage_path=self.storage_path).exclude(pk=self.pk).exists():
+                return
+            # Queued for the task workers so DB cleanup never waits on storage
+            remove_files(ChatStorage.bucket_name(), [self.storage_path])
+
+    def get_signed_url(self, expires_in: int = 3600):
+        """Return a temporary download URL for the attached file, or None."""
+        if not self.storage_path:
+            return None
+        return get_storage_gateway().create_signed_url(ChatStorage.bucket_name(), self.storage_path, expires_in)
 
     def delete(self, *args, **kwargs):
         """Override delete to also remove the file."""
@@ -85,46 +96,188 @@ class ChatMessage(models.Model):
         If user_id is provided, only clean up that user's messages.
         Also deletes associated files.
         """
+        if not user_id:
+            return sum(batch['deleted'] for batch in cls.expire_in_batches(minutes))
+        
         cutoff_time = timezone.now() - timedelta(minutes=minutes)
-        queryset = cls.objects.filter(created_at__lt=cutoff_time)
+        queryset = cls.objects.filter(created_at__lt=cutoff_time, user_id=user_id)
         
-        if user_id:
-            queryset = queryset.filter(user_id=user_id)
+        return cls.delete_messages(queryset)
+    
+    @classmethod
+    def expire_in_batches(cls, minutes: int = 30, batch_size: int = 500, dry_run: bool = False, max_seconds: float = None):
+        """
+        Delete messages older than the specified minutes across all users in small batches.
+        Walks the created_at index with a (created_at, id) keyset cursor so each batch is
+        an index range scan and each DELETE only locks batch_size rows.
+        Yields a stats dict per batch. Stops early once max_seconds is exceeded.
+        """
+        cutoff_time = timezone.now() - timedelta(minutes=minutes)
+        started = time.monotonic()
+        cursor = None
         
-        # Collect storage paths before delete
-        storage_paths = [msg.storage_path for msg in queryset if msg.storage_path]
+        while True:
+            if max_seconds is not None and time.monotonic() - started >= max_seconds:
+                return
+            
+            queryset = cls.objects.filter(created_at__lt=cutoff_time)
+            if cursor:
+                last_created_at, last_id = cursor
+                queryset = queryset.filter(
+                    Q(created_at__gt=last_created_at) | Q(created_at=last_created_at, id__gt=last_id)
+                )
+            rows = list(
+                queryset.order_by('created_at', 'id')
+                .values_list('id', 'created_at', 'storage_path')[:batch_size]
+            )
+            if not rows:
+                return
+            
+            ids = [row[0] for row in rows]
+            storage_paths = [row[2] for row in rows if row[2]]
+            cursor = (rows[-1][1], rows[-1][0])
+            
+            deleted = 0
+            files_removed = 0
+            if not dry_run:
+                deleted, _ = cls.objects.filter(id__in=ids).delete()
+                files_removed = remove_files(ChatStorage.bucket_name(), cls.unreferenced_paths(storage_paths))
+            
+            yield {
+                'matched': len(ids),
+                'deleted': deleted,
+                'files': len(storage_paths),
+                'files_removed': files_removed,
+                'oldest': rows[0][1],
+                'newest': rows[-1][1],
+                'elapsed': time.monotonic() - started,
+            }
+    
+    @classmethod
+    def delete_messages(cls, queryset) -> int:
+        """
+        Delete the messages in a queryset together with their files.
+        Storage paths are collected in one query, rows are removed with a single
+        DELETE and files are queued for removal in chunked multi-path requests.
+        Returns the number of messages deleted.
+        """
+        storage_paths = list(
+            queryset.exclude(storage_path__isnull=True)
+            .exclude(storage_path='')
+            .values_list('storage_path', flat=True)
+        )
         deleted_count, _ = queryset.delete()
-
-        # Delete storage objects best-effort
-        if storage_paths:
-            try:
-                client = get_supabase_client()
-                bucket = ChatStorage.bucket_name()
-                client.storage.from_(bucket).remove(storage_paths)
-            except Exception:
-                pass
-
+        
+        # Storage objects are removed by the task workers, with retries
+        remove_files(ChatStorage.bucket_name(), cls.unreferenced_paths(storage_paths))
+        
         return deleted_count
     
+    @classmethod
+    def unreferenced_paths(cls, storage_paths: list) -> list:
+        """
+        Filter out storage paths still used by remaining messages.
+        Deduplicated attachments share one stored file between messages.
+        """
+        storage_paths = list(set(storage_paths))
+        if not storage_paths:
+            return []
+        still_used = set(
+            cls.objects.filter(storage_path__in=storage_paths).values_list('storage_path', flat=True)
+        )
+        return [path for path in storage_paths if path not in still_used]
+    
+    @classmethod
+    def find_attachment(cls, user_id: str, content_hash: str, minutes: int = ATTACHMENT_REUSE_MINUTES):
+        """Storage path of a recent attachment this user sent with the same bytes, or None."""
+        cutoff_time = timezone.now() - timedelta(minutes=minutes)
+        return (
+            cls.objects.filter(
+                user_id=user_id,
+                content_hash=content_hash,
+                created_at__gte=cutoff_time,
+                storage_path__isnull=False,
+            )
+            .exclude(storage_path='')
+            .order_by('-created_at')
+            .values_list('storage_path', flat=True)
+            .first()
+        )
+    
     @classmethod
     def get_conversation_history(cls, user_id: str, minutes: int = 30):
         """
         Get the conversation history formatted for OpenAI API.
         Returns a list of message dicts with 'role' and 'content'.
         For file messages, includes a description of the attachment.
+        Expired rows are filtered out here and deleted by cleanup_old_chats,
+        so a chat turn does not pay for the cleanup.
         """
-        messages = cls.get_user_messages(user_id, minutes)
-        history = []
+        return [msg.to_history_entry() for msg in cls.history_queryset(user_id, minutes)]
+    
+    @classmethod
+    async def aget_conversation_history(cls, user_id: str, minutes: int = 30):
+        """Async version of get_conversation_history using the async ORM."""
+        return [msg.to_history_entry() async for msg in cls.history_queryset(user_id, minutes)]
+    
+    @classmethod
+    def history_queryset(cls, user_id: str, minutes: int = 30):
+        """Messages in the conversation window, with only the columns the prompt needs."""
+        cutoff_time = timezone.now() - timedelta(minutes=minutes)
+        return cls.objects.filter(
+            user_id=user_id,
+            created_at__gte=cutoff_time
+        ).only('role', 'content', 'message_type', 'file_name').order_by('created_at', 'id')
+    
+    @classmethod
+    def window_queryset(cls, user_id: str, minutes: int = 30):
+        """Messages in the window, served by the (user_id, created_at) index."""
+        cutoff_time = timezone.now() - timedelta(minutes=minutes)
+        return cls.objects.filter(user_id=user_id, created_at__gte=cutoff_time)
+    
+    @classmethod
+    def latest_position(cls, user_id: str, minutes: int = 30):
+        """(created_at, id) of the newest message in the window, or None. One indexed lookup."""
+        return (
+            cls.window_queryset(user_id, minutes)
+            .order_by('-created_at', '-id')
+            .values_list('created_at', 'id')
+            .first()
+        )
+    
+    @classmethod
+    def get_page(cls, user_id: str, minutes: int = 30, since: tuple = None, before: tuple = None, limit: int = 100):
+        """
+        Keyset page of messages on (created_at, id), returned oldest first.
+        since returns the messages after a cursor, before the messages older
+        than a cursor, and neither the newest page. Returns (messages, has_more),
+        where has_more means there are further messages in the direction paged.
+        """
+        queryset = cls.window_queryset(user_id, minutes)
         
-        for msg in messages:
-            if msg.message_type == 'text':
-                history.append({'role': msg.role, 'content': msg.content})
-            else:
-                # For file messages, include the content (AI analysis) or description
-                content = msg.content if msg.content else f"[{msg.message_type.upper()}: {msg.file_name}]"
-                history.append({'role': msg.role, 'content': content})
+        if since:
+            created_at, message_id = since
+            queryset = queryset.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=message_id)
+            ).order_by('created_at', 'id')
+            messages = list(queryset[:limit + 1])
+            return messages[:limit], len(messages) > limit
         
-        return history
+        if before:
+            created_at, message_id = before
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id)
+            )
+        messages = list(queryset.order_by('-created_at', '-id')[:limit + 1])
+        return messages[:limit][::-1], len(messages) > limit
+    
+    def to_history_entry(self) -> dict:
+        """Format this message for the OpenAI messages array."""
+        if self.message_type == 'text':
+            return {'role': self.role, 'content': self.content}
+        # For file messages, include the content (AI analysis) or description
+        content = self.content if self.content else f"[{self.message_type.upper()}: {self.file_name}]"
+        return {'role': self.role, 'content': content}
 
 
 class ChatStorage:
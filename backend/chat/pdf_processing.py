@@ -0,0 +1,374 @@
+"""
+PDF text extraction for the chat PDF path.
+
+Only as much of a document as fits in the prompt budget is parsed. Short
+documents are read page by page until the budget is reached; long ones are
+sampled and the pages with the most lab and health terms are kept. Parsing
+runs in a small process pool with a timeout so a pathological PDF cannot
+pin a web worker's CPU.
+
+Scanned documents have no text layer, so a bounded number of their pages
+are rasterized at the size the vision model reads and sent as images.
+
+Uploads spooled to disk are passed to the pool as a path, so the document
+is opened by MuPDF from the file and never copied into the parser process.
+The web process only holds what comes back: the text and at most
+MAX_SCANNED_PAGES page JPEGs (and their pickled copy while they arrive).
+"""
+import os
+import re
+import logging
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from io import BytesIO
+from dataclasses import dataclass, field
+import multiprocessing
+from .vision import HIGH_DETAIL_MAX_SIDE, HIGH_DETAIL_SHORT_SIDE
+
+logger = logging.getLogger(__name__)
+
+# Characters of document text sent to the model
+TEXT_BUDGET = 8000
+
+# Documents longer than this are ranked instead of read front to back
+RANK_MIN_PAGES = 12
+
+# Most pages parsed when ranking a long document
+MAX_SCAN_PAGES = int(os.getenv('CHAT_PDF_MAX_SCAN_PAGES', 30))
+
+# Leading pages always scanned; lab reports usually start with the results
+LEADING_PAGES = 5
+
+# Parser processes per web worker, and seconds a document may take
+MAX_WORKERS = int(os.getenv('CHAT_PDF_WORKERS', 2))
+EXTRACT_TIMEOUT = float(os.getenv('CHAT_PDF_TIMEOUT', 20))
+
+TRUNCATED_NOTE = "\n\n[Document truncated due to length...]"
+
+# Pages with less text than this are treated as scanned
+MIN_PAGE_TEXT = 25
+
+# Documents with less text than this overall go to the vision model
+SCANNED_DOCUMENT_TEXT = 200
+
+# Scanned pages rasterized per document, and their JPEG quality
+MAX_SCANNED_PAGES = int(os.getenv('CHAT_PDF_MAX_IMAGES', 4))
+SCAN_JPEG_QUALITY = 80
+
+# Terms that mark a page as lab results or clinical content
+HEALTH_TERMS = re.compile(
+    r"\b(result|reference|range|units?|flag|abnormal|high|low|normal|"
+    r"mg/dl|mmol/l|g/dl|u/l|iu/l|ng/ml|pg/ml|µmol/l|umol/l|x10|%|"
+    r"h(a)?emoglobin|hematocrit|wbc|rbc|platelets?|neutrophils?|lymphocytes?|"
+    r"glucose|a1c|hba1c|cholesterol|ldl|hdl|triglycerides?|"
+    r"creatinine|egfr|urea|bun|sodium|potassium|chloride|calcium|"
+    r"alt|ast|alp|ggt|bilirubin|albumin|protein|"
+    r"tsh|t3|t4|ferritin|iron|transferrin|vitamin|b12|folate|"
+    r"crp|esr|insulin|cortisol|testosterone|estradiol|psa|"
+    r"diagnosis|medication|dose|blood|urine|serum|plasma|specimen)\b",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class PageImage:
+    """A rasterized page, already at the size the vision model reads."""
+    page_num: int
+    jpeg_bytes: bytes
+    width: int
+    height: int
+
+
+@dataclass
+class PdfContent:
+    """What was extracted from a PDF: text within budget plus any scanned page images."""
+    text: str
+    page_count: int = 0
+    text_chars: int = 0
+    scanned_pages: list = field(default_factory=list)
+    images: list = field(default_factory=list)
+
+    @property
+    def is_scanned(self) -> bool:
+        return bool(self.images)
+
+
+def health_term_density(text: str) -> float:
+    """Health terms per 100 words."""
+    words = len(text.split())
+    if not words:
+        return 0.0
+    return 100.0 * len(HEALTH_TERMS.findall(text)) / words
+
+
+def _page_sample(page_count: int, limit: int) -> list:
+    """Leading pages plus evenly spaced pages across the rest of the document."""
+    leading = list(range(min(LEADING_PAGES, page_count)))
+    remaining = limit - len(leading)
+    rest = page_count - len(leading)
+    if remaining <= 0 or rest <= 0:
+        return leading
+    step = max(rest / remaining, 1)
+    sampled = {len(leading) + int(i * step) for i in range(min(remaining, rest))}
+    return leading + sorted(sampled)
+
+
+def _format_page(page_num: int, text: str) -> str:
+    return f"--- Page {page_num} ---\n{text}"
+
+
+def _read_in_order(pages, budget: int, content: PdfContent) -> str:
+    """
+    Join page texts until the budget is reached, then stop parsing.
+    pages yields (page_num, text) lazily. Text-less pages are recorded on content.
+    """
+    text_parts = []
+    used = 0
+    for page_num, text in pages:
+        stripped = len(text.strip())
+        content.text_chars += stripped
+        if stripped < MIN_PAGE_TEXT:
+            content.scanned_pages.append(page_num)
+        if not stripped:
+            continue
+        part = _format_page(page_num, text)
+        text_parts.append(part)
+        used += len(part) + 2
+        if used > budget:
+            return "\n\n".join(text_parts)[:budget] + TRUNCATED_NOTE
+    return "\n\n".join(text_parts)
+
+
+def _select_relevant(page_texts: dict, page_count: int, budget: int) -> str:
+    """Keep the highest scoring pages that fit, in document order."""
+    ranked = sorted(
+        (page_num for page_num, text in page_texts.items() if text.strip()),
+        key=lambda page_num: health_term_density(page_texts[page_num]),
+        reverse=True,
+    )
+
+    if not ranked:
+        return ''
+
+    chosen = []
+    used = 0
+    for page_num in ranked:
+        size = len(page_texts[page_num]) + 20
+        if used + size > budget and chosen:
+            continue
+        chosen.append(page_num)
+        used += size
+
+    full_text = "\n\n".join(_format_page(page_num, page_texts[page_num]) for page_num in sorted(chosen))
+    full_text = full_text[:budget]
+    return full_text + f"\n\n[Showing the {len(chosen)} most relevant of {page_count} pages...]"
+
+
+def render_zoom(width: float, height: float) -> float:
+    """
+    Zoom that renders a page at the size the model downscales a high-detail
+    image to, so no pixels are rendered only to be thrown away.
+    """
+    zoom = HIGH_DETAIL_SHORT_SIDE / min(width, height)
+    return min(zoom, HIGH_DETAIL_MAX_SIDE / max(width, height))
+
+
+def _render_pages(doc, page_nums: list) -> list:
+    import fitz  # PyMuPDF
+
+    images = []
+    for page_num in page_nums[:MAX_SCANNED_PAGES]:
+        page = doc[page_num - 1]
+        zoom = render_zoom(page.rect.width, page.rect.height)
+        # Scans of lab reports are read as documents, grayscale keeps them small
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+        images.append(PageImage(
+            page_num=page_num,
+            jpeg_bytes=pixmap.tobytes('jpeg', jpg_quality=SCAN_JPEG_QUALITY),
+            width=pixmap.width,
+            height=pixmap.height,
+        ))
+    return images
+
+
+def _is_path(source) -> bool:
+    return isinstance(source, (str, os.PathLike))
+
+
+def _extract_with_pymupdf(source, budget: int) -> PdfContent:
+    import fitz  # PyMuPDF
+
+    with (fitz.open(source, filetype="pdf") if _is_path(source) else fitz.open("pdf", source)) as doc:
+        content = PdfContent(text='', page_count=len(doc))
+
+        if content.page_count <= RANK_MIN_PAGES:
+            content.text = _read_in_order(
+                ((index + 1, doc[index].get_text()) for index in range(content.page_count)),
+                budget,
+                content,
+            )
+        else:
+            page_texts = {
+                index + 1: doc[index].get_text()
+                for index in _page_sample(content.page_count, MAX_SCAN_PAGES)
+            }
+            content.text_chars = sum(len(text.strip()) for text in page_texts.values())
+            content.scanned_pages = [
+                page_num for page_num, text in page_texts.items() if len(text.strip()) < MIN_PAGE_TEXT
+            ]
+            content.text = _select_relevant(page_texts, content.page_count, budget)
+
+        # No usable text layer: send the scanned pages to the vision model instead
+        if content.scanned_pages and content.text_chars < SCANNED_DOCUMENT_TEXT:
+            content.images = _render_pages(doc, content.scanned_pages)
+
+        return content
+
+
+def _extract_with_pypdf2(source, budget: int) -> PdfContent:
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(source if _is_path(source) else BytesIO(source))
+    content = PdfContent(text='', page_count=len(reader.pages))
+    content.text = _read_in_order(
+        ((page_num, page.extract_text() or '') for page_num, page in enumerate(reader.pages, 1)),
+        budget,
+        content,
+    )
+    return content
+
+
+def extract_content_in_process(source, budget: int = TEXT_BUDGET) -> PdfContent:
+    """
+    Extract text and scanned page images on the current process. Runs inside the parser pool.
+    source is PDF bytes or the path of a PDF on disk.
+    """
+    try:
+        return _extract_with_pymupdf(source, budget)
+    except ImportError:
+        # Fallback to PyPDF2 if PyMuPDF not available (no rasterization)
+        try:
+            return _extract_with_pypdf2(source, budget)
+        except ImportError:
+            return PdfContent(text="[Unable to extract PDF text - PDF library not installed]")
+
+
+def _parser_worker(conn):
+    """
+    Parser process loop. Acknowledges each job as it starts, so the caller's
+    timeout only covers running it, then sends back the result or the error.
+    """
+    while True:
+        try:
+            fn, args = conn.recv()
+        except EOFError:
+            return
+        conn.send(('started', None))
+        try:
+            reply = ('ok', fn(*args))
+        except Exception as e:
+            reply = ('error', e)
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # The result or the error could not be pickled
+            conn.send(('error', RuntimeError(f'{type(e).__name__}: {e}')))
+
+
+class _ParserProcess:
+    """One spawned parser process and the pipe jobs are sent over."""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_parser_worker, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class _ParserPool:
+    """
+    Lazily started parser processes, at most max_workers running at once.
+    Spawned workers keep MuPDF state out of the web process. A job waits for
+    a free worker before its timeout starts; when it times out, only its own
+    process is killed and the next job starts a new one.
+    """
+
+    # Seconds a new worker may take to start and pick up its first job
+    START_TIMEOUT = 30
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._context = multiprocessing.get_context('spawn')
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _checkout(self) -> _ParserProcess:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.is_alive():
+                    return worker
+                worker.kill()
+        return _ParserProcess(self._context)
+
+    def _wait(self, worker: _ParserProcess, timeout: float):
+        if not worker.conn.poll(timeout):
+            raise FutureTimeoutError()
+        return worker.conn.recv()
+
+    def run(self, fn, *args, timeout: float):
+        with self._slots:
+            worker = self._checkout()
+            try:
+                worker.conn.send((fn, args))
+                self._wait(worker, self.START_TIMEOUT)
+                outcome, value = self._wait(worker, timeout)
+            except (FutureTimeoutError, EOFError, OSError) as e:
+                # A runaway job cannot be interrupted, and a dead worker cannot be reused
+                worker.kill()
+                if isinstance(e, FutureTimeoutError):
+                    raise
+                raise RuntimeError('PDF parser process exited unexpectedly') from e
+            with self._lock:
+                self._idle.append(worker)
+        if outcome == 'error':
+            raise value
+        return value
+
+
+_pool = _ParserPool(MAX_WORKERS)
+
+
+def extract_pdf_content(source, budget: int = TEXT_BUDGET, timeout: float = EXTRACT_TIMEOUT) -> PdfContent:
+    """
+    Extract up to budget characters of text from PDF bytes or a PDF file path
+    in the parser pool, plus rasterized pages when the document has no usable
+    text layer. Pass a path for large uploads so only the path is sent to the
+    parser process.
+    Returns placeholder text if parsing fails or takes longer than timeout.
+    """
+    try:
+        return _pool.run(extract_content_in_process, source, budget, timeout=timeout)
+    except FutureTimeoutError:
+        logger.warning(
+            "PDF extraction timed out after %.0fs (%d bytes)",
+            timeout, os.path.getsize(source) if _is_path(source) else len(source),
+        )
+        return PdfContent(text="[Unable to extract PDF text - the document took too long to process]")
+    except Exception as e:
+        logger.warning("PDF extraction failed: %s", e)
+        return PdfContent(text="[Unable to extract PDF text - the document could not be read]")
+
+
+def extract_pdf_text(source, budget: int = TEXT_BUDGET, timeout: float = EXTRACT_TIMEOUT) -> str:
+    """Text-only view of extract_pdf_content."""
+    return extract_pdf_content(source, budget, timeout).text
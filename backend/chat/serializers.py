@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import ChatMessage
+from backend.cursors import decode_cursor
 
 
 class ChatMessageSerializer(serializers.ModelSerializer):
@@ -31,6 +32,22 @@ class GetHistorySerializer(serializers.Serializer):
     
     user_id = serializers.CharField(max_length=255)
     minutes = serializers.IntegerField(default=30, min_value=1, max_value=1440)
+    limit = serializers.IntegerField(default=100, min_value=1, max_value=500)
+    # Cursors from a previous response: since fetches newer messages, before older ones
+    since = serializers.CharField(max_length=255, required=False)
+    before = serializers.CharField(max_length=255, required=False)
+    
+    def validate(self, attrs):
+        if attrs.get('since') and attrs.get('before'):
+            raise serializers.ValidationError('Use either since or before, not both.')
+        
+        for field in ('since', 'before'):
+            if attrs.get(field):
+                try:
+                    attrs[field] = decode_cursor(attrs[field])
+                except ValueError:
+                    raise serializers.ValidationError({field: 'Invalid cursor.'})
+        return attrs
 
 
 class ClearHistorySerializer(serializers.Serializer):
@@ -1,10 +1,52 @@
 import os
 import base64
-from io import BytesIO
-from PIL import Image
-from openai import OpenAI
+import asyncio
+import logging
+from contextlib import contextmanager
+from datetime import timedelta
+from concurrent.futures import Future, ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from openai import OpenAI, AsyncOpenAI
 from django.db import connection
+from django.utils import timezone
 from .models import ChatMessage, ChatStorage
+from .storage import get_storage_gateway, remove_files
+from .store import get_chat_store
+from .image_processing import normalize_image, content_hash, NORMALIZE_TIMEOUT
+from .vision import VisionImage, prepare_vision_image_async, plan_rendered_image, log_vision_usage
+from .pdf_processing import extract_pdf_text, extract_pdf_content
+
+logger = logging.getLogger(__name__)
+
+# Storage uploads run in the background while the model call is in flight
+UPLOAD_WORKERS = int(os.getenv('CHAT_UPLOAD_WORKERS', 4))
+UPLOAD_TIMEOUT = 60
+
+_upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='chat-upload')
+
+# Queries allowed per chat turn: one combined read and one INSERT for both messages
+TURN_QUERY_BUDGET = int(os.getenv('CHAT_TURN_QUERY_BUDGET', 2))
+
+
+@contextmanager
+def query_budget(label: str, limit: int = TURN_QUERY_BUDGET):
+    """
+    Count the queries run inside the block and log a warning when a turn goes
+    over budget. Only enforced on PostgreSQL, where each query is a round trip
+    to the remote pooler.
+    """
+    queries = []
+
+    def count(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count):
+        yield queries
+
+    if connection.vendor == 'postgresql' and len(queries) > limit:
+        statements = [' '.join(sql.split())[:80] for sql in queries]
+        logger.warning("Chat %s ran %d queries (budget %d): %s", label, len(queries), limit, statements)
 
 
 class ChatService:
@@ -69,8 +111,12 @@ Do NOT:
     ALLOWED_IMAGE_TYPES = ['image/jpeg', 'image/png', 'image/gif', 'image/webp']
     ALLOWED_PDF_TYPES = ['application/pdf']
 
+    # Columns read from public.users for the user context prompt
+    PROFILE_FIELDS = ['first_name', 'last_name', 'biological_sex', 'date_of_birth', 'height_cm', 'weight_kg', 'email']
+
     def __init__(self):
         self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        self.async_client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'))
     
     def get_user_profile_info(self, user_id: str) -> dict:
         """
@@ -97,15 +143,7 @@ Do NOT:
                 row = cursor.fetchone()
                 
                 if row:
-                    user_info = {
-                        'first_name': row[0],
-                        'last_name': row[1],
-                        'biological_sex': row[2],
-                        'date_of_birth': row[3],
-                        'height_cm': row[4],
-                        'weight_kg': row[5],
-                        'email': row[6],
-                    }
+                    user_info = dict(zip(self.PROFILE_FIELDS, row))
                     return user_info
                     
             return {}
@@ -163,145 +201,249 @@ Do NOT:
         user_context = "\n\n**Current User's Information (use this when answering questions about the user):**\n" + "\n".join(f"- {part}" for part in context_parts)
         return user_context
     
-    def encode_image_to_base64(self, image_bytes: bytes) -> str:
-        """Convert image bytes to base64 string with resize/compression."""
-        image = Image.open(BytesIO(image_bytes))
-        
-        # Convert to RGB if necessary (for PNG with transparency, etc.)
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Resize if too large (max 2048px on longest side for efficiency)
-        max_size = 2048
-        if max(image.size) > max_size:
-            ratio = max_size / max(image.size)
-            new_size = (int(image.size[0] * ratio), int(image.size[1] * ratio))
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-        
-        # Save to bytes
-        buffered = BytesIO()
-        image.save(buffered, format="JPEG", quality=85)
-        img_bytes = buffered.getvalue()
-        
-        return base64.b64encode(img_bytes).decode('utf-8')
+    def build_system_prompt(self, user_id: str) -> str:
+        """Build the system prompt including the user's profile information."""
+        user_profile = self.get_user_profile_info(user_id)
+        return self.SYSTEM_PROMPT + self.build_user_context_prompt(user_profile)
     
-    def extract_pdf_text(self, pdf_bytes: bytes) -> str:
-        """Extract text from PDF bytes."""
-        try:
-            import fitz  # PyMuPDF
-            
-            text_parts = []
-            with fitz.open("pdf", pdf_bytes) as doc:
-                for page_num, page in enumerate(doc, 1):
-                    text = page.get_text()
-                    if text.strip():
-                        text_parts.append(f"--- Page {page_num} ---\n{text}")
-            
-            full_text = "\n\n".join(text_parts)
-            
-            # Truncate if too long (max ~8000 chars to leave room for response)
-            if len(full_text) > 8000:
-                full_text = full_text[:8000] + "\n\n[Document truncated due to length...]"
-            
-            return full_text
-        except ImportError:
-            # Fallback to PyPDF2 if PyMuPDF not available
-            try:
-                import PyPDF2
-                
-                text_parts = []
-                reader = PyPDF2.PdfReader(BytesIO(pdf_bytes))
-                for page_num, page in enumerate(reader.pages, 1):
-                    text = page.extract_text()
-                    if text.strip():
-                        text_parts.append(f"--- Page {page_num} ---\n{text}")
-                
-                full_text = "\n\n".join(text_parts)
-                
-                if len(full_text) > 8000:
-                    full_text = full_text[:8000] + "\n\n[Document truncated due to length...]"
-                
-                return full_text
-            except ImportError:
-                return "[Unable to extract PDF text - PDF library not installed]"
+    def build_image_message(self, prompt: str, vision_image) -> dict:
+        """Build the vision message for an image turn prepared by the vision policy."""
+        return self.build_images_message(prompt, [vision_image])
     
-    def get_response(self, user_id: str, user_message: str, conversation_minutes: int = 30) -> str:
+    def build_images_message(self, prompt: str, vision_images: list) -> dict:
+        """Build one vision message carrying several images."""
+        content = [{"type": "text", "text": prompt}]
+        for vision_image in vision_images:
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/jpeg;base64,{vision_image.base64_image}",
+                    "detail": vision_image.plan.detail
+                }
+            })
+        return {
+            "role": "user",
+            "content": content
+        }
+    
+    def encode_image_to_base64(self, image_source) -> str:
         """
-        Get a response from the AI for the user's text message.
-        Maintains conversation context within the specified time window.
+        Convert image bytes or an image file to a base64 JPEG sized for the vision model.
+        Compliant JPEGs are passed through; results are cached by content hash.
+        """
+        return normalize_image(image_source)
+    
+    def extract_pdf_text(self, pdf_source) -> str:
+        """
+        Extract text from PDF bytes or a PDF file.
+        Parsing stops at the prompt budget and runs in a process pool with a timeout.
         """
-        # Save the user's message first
-        ChatMessage.objects.create(
-            user_id=user_id,
-            role='user',
-            content=user_message,
-            message_type='text'
+        return extract_pdf_text(pdf_source)
+    
+    def build_pdf_request(self, base_prompt: str, content) -> tuple:
+        """
+        Build the user message for a PDF turn from extracted content.
+        Returns (message, model, vision_plans). Scanned documents go to the
+        vision model with their rasterized pages in a single message;
+        vision_plans is None for text documents.
+        """
+        if not content.is_scanned:
+            full_prompt = f"{base_prompt}\n\n--- Document Content ---\n{content.text}"
+            return {"role": "user", "content": full_prompt}, "gpt-4o-mini", None
+        
+        vision_images = [
+            VisionImage(
+                base64_image=base64.b64encode(image.jpeg_bytes).decode('ascii'),
+                plan=plan_rendered_image(image.width, image.height),
+            )
+            for image in content.images
+        ]
+        pages = ', '.join(str(image.page_num) for image in content.images)
+        full_prompt = (
+            f"{base_prompt}\n\n--- Document Content ---\n"
+            f"This is a scanned document without a text layer. "
+            f"Page(s) {pages} of {content.page_count} are attached as images."
         )
+        if content.text.strip():
+            full_prompt += f"\n\nText found in the document:\n{content.text}"
+        return self.build_images_message(full_prompt, vision_images), "gpt-4o", [image.plan for image in vision_images]
+    
+    def load_turn_context(self, user_id: str, conversation_minutes: int = 30) -> tuple:
+        """
+        Return (system_prompt, history) for a chat turn.
+        When messages live in the PostgreSQL database the profile and the
+        conversation window are read in a single round trip; otherwise the
+        profile query and the chat store are read separately.
+        """
+        chat_store = get_chat_store()
+        if not chat_store.in_database or connection.vendor != 'postgresql':
+            return self.build_system_prompt(user_id), chat_store.get_history(user_id, conversation_minutes)
         
-        # Get user profile information
-        user_profile = self.get_user_profile_info(user_id)
-        user_context = self.build_user_context_prompt(user_profile)
-        system_prompt = self.SYSTEM_PROMPT + user_context
+        cutoff_time = timezone.now() - timedelta(minutes=conversation_minutes)
+        try:
+            with connection.cursor() as cursor:
+                # One row per message, each carrying the profile columns
+                # (or a single row of profile columns when there is no history)
+                cursor.execute(f"""
+                    SELECT 
+                        u.first_name, 
+                        u.last_name, 
+                        u.biological_sex, 
+                        u.date_of_birth, 
+                        u.height_cm, 
+                        u.weight_kg, 
+                        u.email,
+                        m.role,
+                        m.content,
+                        m.message_type,
+                        m.file_name
+                    FROM (SELECT 1) AS turn
+                    LEFT JOIN public.users u ON u.id = %s
+                    LEFT JOIN (
+                        SELECT id, role, content, message_type, file_name, created_at
+                        FROM {ChatMessage._meta.db_table}
+                        WHERE user_id = %s AND created_at >= %s
+                    ) m ON TRUE
+                    ORDER BY m.created_at, m.id
+                """, [user_id, user_id, cutoff_time])
+                rows = cursor.fetchall()
+        except Exception as e:
+            logger.warning("Combined turn context query failed, falling back: %s", e)
+            return self.build_system_prompt(user_id), chat_store.get_history(user_id, conversation_minutes)
         
-        # Get conversation history
-        history = ChatMessage.get_conversation_history(user_id, conversation_minutes)
+        user_profile = {}
+        if rows and any(value is not None for value in rows[0][:len(self.PROFILE_FIELDS)]):
+            user_profile = dict(zip(self.PROFILE_FIELDS, rows[0]))
         
-        # Build messages array for OpenAI
-        messages = [
-            {"role": "system", "content": system_prompt}
+        history = [
+            ChatMessage(role=row[7], content=row[8], message_type=row[9], file_name=row[10]).to_history_entry()
+            for row in rows if row[7] is not None
         ]
-        messages.extend(history)
-        
-        # Call OpenAI API
-        response = self.client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            max_tokens=1000,
-            temperature=0.7,
-        )
-        
-        assistant_message = response.choices[0].message.content
         
-        # Save the assistant's response
-        ChatMessage.objects.create(
-            user_id=user_id,
-            role='assistant',
-            content=assistant_message,
-            message_type='text'
+        system_prompt = self.SYSTEM_PROMPT + self.build_user_context_prompt(user_profile)
+        return system_prompt, history
+
+    def save_turn(self, user_chat_message: ChatMessage, assistant_message: str) -> None:
+        """
+        Save the user's message and the reply together once the reply exists.
+        """
+        get_chat_store().add_turn(
+            user_chat_message,
+            ChatMessage(
+                user_id=user_chat_message.user_id,
+                role='assistant',
+                content=assistant_message,
+                message_type='text'
+            )
         )
-        
-        return assistant_message
+
+    def get_response(self, user_id: str, user_message: str, conversation_minutes: int = 30) -> str:
+        """
+        Get a response from the AI for the user's text message.
+        Maintains conversation context within the specified time window.
+        """
+        with query_budget('text turn'):
+            # Get user profile information and conversation history
+            system_prompt, history = self.load_turn_context(user_id, conversation_minutes)
+            
+            # Build messages array for OpenAI
+            messages = [
+                {"role": "system", "content": system_prompt}
+            ]
+            messages.extend(history)
+            messages.append({"role": "user", "content": user_message})
+            
+            # Call OpenAI API
+            response = self.client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                max_tokens=1000,
+                temperature=0.7,
+            )
+            
+            assistant_message = response.choices[0].message.content
+            
+            # Save the user's message and the assistant's response
+            self.save_turn(
+                ChatMessage(
+                    user_id=user_id,
+                    role='user',
+                    content=user_message,
+                    message_type='text'
+                ),
+                assistant_message
+            )
+            
+            return assistant_message
     
-    def upload_to_storage(self, file_bytes: bytes, file_name: str, content_type: str) -> str:
-        """Upload file bytes to Supabase storage and return storage path."""
-        # Use storage3 directly to avoid gotrue proxy issue
-        from storage3 import create_client as create_storage_client
-        
-        url = os.getenv('SUPABASE_URL') or os.getenv('SUPABASE_PROJECT_URL')
-        key = os.getenv('SUPABASE_SERVICE_ROLE_KEY') or os.getenv('SUPABASE_KEY') or os.getenv('SUPABASE_ANON_KEY')
-        
-        if not url or not key:
-            raise RuntimeError('Supabase credentials are missing.')
-        
-        bucket = ChatStorage.bucket_name()
+    def upload_to_storage(self, file_source, file_name: str, content_type: str) -> str:
+        """
+        Upload file bytes, an open binary file or a file path to Supabase
+        storage and return storage path. Files are streamed, not read into memory.
+        """
         path = f"chat/{file_name}"
-        
-        # Create storage client directly (bypasses auth client)
-        storage_url = f"{url}/storage/v1"
-        storage_client = create_storage_client(
-            url=storage_url,
-            is_async=False,
-            headers={"apikey": key, "Authorization": f"Bearer {key}"}
-        )
-        
-        # Upload file
-        storage_client.from_(bucket).upload(path, file_bytes, {"content-type": content_type, "upsert": "true"})
-        return path
+        if isinstance(file_source, (str, os.PathLike)):
+            with open(file_source, 'rb') as f:
+                return get_storage_gateway().upload(ChatStorage.bucket_name(), path, f, content_type)
+        if hasattr(file_source, 'read'):
+            with file_source:
+                return get_storage_gateway().upload(ChatStorage.bucket_name(), path, file_source, content_type)
+        return get_storage_gateway().upload(ChatStorage.bucket_name(), path, file_source, content_type)
+
+    def start_upload(self, file_source, file_name: str, content_type: str):
+        """Start uploading a file in the background. Returns a Future for the storage path."""
+        if isinstance(file_source, (str, os.PathLike)):
+            # Open here so the upload keeps its own handle if the request
+            # finishes first and Django deletes the temporary file
+            file_source = open(file_source, 'rb')
+        return _upload_executor.submit(self.upload_to_storage, file_source, file_name, content_type)
+
+    def start_attachment_upload(self, user_id: str, file_source, file_name: str, content_type: str) -> tuple:
+        """
+        Start uploading an attachment unless this user recently sent the same file.
+        file_source is bytes or the path of an upload spooled to disk.
+        Returns (upload_future, content_hash, reused). A reused attachment resolves
+        to the existing storage path without uploading anything.
+        """
+        file_hash = content_hash(file_source)
+        storage_path = get_chat_store().find_attachment(user_id, file_hash)
+        if storage_path:
+            future = Future()
+            future.set_result(storage_path)
+            return future, file_hash, True
+        return self.start_upload(file_source, file_name, content_type), file_hash, False
+
+    def wait_for_upload(self, file_name: str, upload_future):
+        """
+        Wait for a background upload and return its storage path.
+        Upload failures are logged and return None, leaving the message without a stored file.
+        An upload still running after UPLOAD_TIMEOUT is removed once it finishes.
+        """
+        try:
+            return upload_future.result(timeout=UPLOAD_TIMEOUT)
+        except TimeoutError:
+            self.discard_late_upload(file_name, upload_future)
+            return None
+        except Exception as e:
+            logger.warning("Chat upload failed for %s: %s", file_name, e)
+            return None
+
+    def discard_upload(self, upload_future) -> None:
+        """Remove an uploaded file once its upload finishes, for turns that were never saved."""
+        def remove(future):
+            if not future.cancelled() and future.exception() is None:
+                remove_files(ChatStorage.bucket_name(), [future.result()])
+        upload_future.add_done_callback(remove)
+
+    def discard_late_upload(self, file_name: str, upload_future) -> None:
+        """Give up on an upload that timed out; the message is saved without it."""
+        logger.warning("Chat upload for %s timed out after %ss, removing it when it finishes", file_name, UPLOAD_TIMEOUT)
+        self.discard_upload(upload_future)
 
     def get_response_with_image(
         self, 
         user_id: str, 
-        image_bytes: bytes, 
+        image_source, 
         file_name: str,
         file_size: int,
         user_message: str = None,
@@ -312,57 +454,55 @@ Do NOT:
         Get a response from the AI for an image attachment.
         Uses GPT-4o Vision to analyze the image.
         """
-        # Upload to storage
-        storage_path = self.upload_to_storage(image_bytes, file_name, content_type)
-
-        # Encode image
-        base64_image = self.encode_image_to_base64(image_bytes)
-        
         # Create prompt
         prompt = user_message if user_message else "Please analyze this image and provide any relevant health insights."
         
-        # Save the user's image message
-        ChatMessage.objects.create(
-            user_id=user_id,
-            role='user',
-            content=f"[Shared an image: {file_name}] {prompt}",
-            message_type='image',
-            file_name=file_name,
-            storage_path=storage_path,
-            file_size=file_size
-        )
-        
-        # Get user profile information
-        user_profile = self.get_user_profile_info(user_id)
-        user_context = self.build_user_context_prompt(user_profile)
-        system_prompt = self.SYSTEM_PROMPT + user_context
-        
-        # Get conversation history (text only for context)
-        history = ChatMessage.get_conversation_history(user_id, conversation_minutes)
+        # One more query than a text turn: the duplicate attachment lookup
+        with query_budget('image turn', TURN_QUERY_BUDGET + 1):
+            # Upload to storage (unless already stored) and prepare the image in the background
+            upload_future, file_hash, reused = self.start_attachment_upload(user_id, image_source, file_name, content_type)
+            image_future = prepare_vision_image_async(image_source, prompt, key=file_hash)
+            
+            try:
+                assistant_message = self._complete_image_turn(
+                    user_id, image_future, prompt, conversation_minutes
+                )
+            except Exception:
+                if not reused:
+                    self.discard_upload(upload_future)
+                raise
+            
+            # Save the user's image message with its storage path, and the reply
+            self.save_turn(
+                ChatMessage(
+                    user_id=user_id,
+                    role='user',
+                    content=f"[Shared an image: {file_name}] {prompt}",
+                    message_type='image',
+                    file_name=file_name,
+                    file_size=file_size,
+                    storage_path=self.wait_for_upload(file_name, upload_future),
+                    content_hash=file_hash
+                ),
+                assistant_message
+            )
+            
+            return assistant_message
+
+    def _complete_image_turn(self, user_id: str, image_future, prompt: str, conversation_minutes: int) -> str:
+        """Build the vision request for an image message and return the reply."""
+        # Get user profile information and conversation history (text only for context)
+        system_prompt, history = self.load_turn_context(user_id, conversation_minutes)
         
         # Build messages - include history but use vision for the current image
         messages = [
             {"role": "system", "content": system_prompt}
         ]
-        
-        # Add history (excluding the just-added image message)
-        for msg in history[:-1]:
-            messages.append(msg)
+        messages.extend(history)
         
         # Add the image message with vision
-        messages.append({
-            "role": "user",
-            "content": [
-                {"type": "text", "text": prompt},
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_image}",
-                        "detail": "high"
-                    }
-                }
-            ]
-        })
+        vision_image = image_future.result(timeout=NORMALIZE_TIMEOUT)
+        messages.append(self.build_image_message(prompt, vision_image))
         
         # Call OpenAI API with vision model
         response = self.client.chat.completions.create(
@@ -371,23 +511,14 @@ Do NOT:
             max_tokens=1500,
             temperature=0.7,
         )
+        log_vision_usage(vision_image.plan, response)
         
-        assistant_message = response.choices[0].message.content
-        
-        # Save the assistant's response
-        ChatMessage.objects.create(
-            user_id=user_id,
-            role='assistant',
-            content=assistant_message,
-            message_type='text'
-        )
-        
-        return assistant_message
-    
+        return response.choices[0].message.content
+
     def get_response_with_pdf(
         self, 
         user_id: str, 
-        pdf_bytes: bytes, 
+        pdf_source, 
         file_name: str,
         file_size: int,
         user_message: str = None,
@@ -398,80 +529,248 @@ Do NOT:
         Get a response from the AI for a PDF attachment.
         Extracts text from PDF and sends to GPT for analysis.
         """
-        # Extract text from PDF
-        pdf_text = self.extract_pdf_text(pdf_bytes)
-        
         # Create prompt
         base_prompt = user_message if user_message else "Please analyze this document and provide any relevant health insights."
-        full_prompt = f"{base_prompt}\n\n--- Document Content ---\n{pdf_text}"
-        
-        # Save the user's PDF message
-        storage_path = self.upload_to_storage(pdf_bytes, file_name, content_type)
-
-        ChatMessage.objects.create(
-            user_id=user_id,
-            role='user',
-            content=f"[Shared a PDF: {file_name}] {base_prompt}",
-            message_type='pdf',
-            file_name=file_name,
-            storage_path=storage_path,
-            file_size=file_size
-        )
         
-        # Get user profile information
-        user_profile = self.get_user_profile_info(user_id)
-        user_context = self.build_user_context_prompt(user_profile)
-        system_prompt = self.SYSTEM_PROMPT + user_context
+        # One more query than a text turn: the duplicate attachment lookup
+        with query_budget('pdf turn', TURN_QUERY_BUDGET + 1):
+            # Upload to storage in the background, unless already stored
+            upload_future, file_hash, reused = self.start_attachment_upload(user_id, pdf_source, file_name, content_type)
+            
+            try:
+                assistant_message = self._complete_pdf_turn(
+                    user_id, pdf_source, base_prompt, conversation_minutes
+                )
+            except Exception:
+                if not reused:
+                    self.discard_upload(upload_future)
+                raise
+            
+            # Save the user's PDF message with its storage path, and the reply
+            self.save_turn(
+                ChatMessage(
+                    user_id=user_id,
+                    role='user',
+                    content=f"[Shared a PDF: {file_name}] {base_prompt}",
+                    message_type='pdf',
+                    file_name=file_name,
+                    file_size=file_size,
+                    storage_path=self.wait_for_upload(file_name, upload_future),
+                    content_hash=file_hash
+                ),
+                assistant_message
+            )
+            
+            return assistant_message
+
+    def _complete_pdf_turn(self, user_id: str, pdf_source, base_prompt: str, conversation_minutes: int) -> str:
+        """Extract the PDF content and return the reply."""
+        # Extract text from PDF, or rasterize its pages if it is scanned
+        content = extract_pdf_content(pdf_source)
+        pdf_message, model, vision_plans = self.build_pdf_request(base_prompt, content)
         
-        # Get conversation history
-        history = ChatMessage.get_conversation_history(user_id, conversation_minutes)
+        # Get user profile information and conversation history
+        system_prompt, history = self.load_turn_context(user_id, conversation_minutes)
         
         # Build messages
         messages = [
             {"role": "system", "content": system_prompt}
         ]
-        
-        # Add history (excluding the just-added PDF message)
-        for msg in history[:-1]:
-            messages.append(msg)
+        messages.extend(history)
         
         # Add the PDF analysis request
-        messages.append({
-            "role": "user",
-            "content": full_prompt
-        })
+        messages.append(pdf_message)
         
         # Call OpenAI API
         response = self.client.chat.completions.create(
-            model="gpt-4o-mini",
+            model=model,
             messages=messages,
             max_tokens=1500,
             temperature=0.7,
         )
+        if vision_plans:
+            log_vision_usage(vision_plans, response)
         
-        assistant_message = response.choices[0].message.content
-        
-        # Save the assistant's response
-        ChatMessage.objects.create(
-            user_id=user_id,
-            role='assistant',
-            content=assistant_message,
-            message_type='text'
-        )
-        
-        return assistant_message
-    
+        return response.choices[0].message.content
+
     def clear_conversation(self, user_id: str) -> int:
         """
         Clear all messages for a user.
         Returns the number of messages deleted.
         Also deletes associated files.
         """
-        messages = ChatMessage.objects.filter(user_id=user_id)
-        for msg in messages:
-            msg.delete_file()
-        deleted_count, _ = messages.delete()
-        return deleted_count
+        return get_chat_store().clear(user_id)
+
+    # Async variants used by the ASGI views. They share prompt building with the
+    # sync methods but await the model call instead of blocking a worker on it.
+    
+    async def asave_turn(self, user_chat_message: ChatMessage, assistant_message: str) -> None:
+        """Async version of save_turn."""
+        await get_chat_store().aadd_turn(
+            user_chat_message,
+            ChatMessage(
+                user_id=user_chat_message.user_id,
+                role='assistant',
+                content=assistant_message,
+                message_type='text'
+            )
+        )
+
+    async def await_upload(self, file_name: str, upload_future):
+        """Async version of wait_for_upload."""
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(upload_future), UPLOAD_TIMEOUT)
+        except TimeoutError:
+            self.discard_late_upload(file_name, upload_future)
+            return None
+        except Exception as e:
+            logger.warning("Chat upload failed for %s: %s", file_name, e)
+            return None
+
+    async def aget_response(self, user_id: str, user_message: str, conversation_minutes: int = 30) -> str:
+        """Async version of get_response."""
+        system_prompt, history = await sync_to_async(self.load_turn_context)(user_id, conversation_minutes)
+        
+        messages = [{"role": "system", "content": system_prompt}]
+        messages.extend(history)
+        messages.append({"role": "user", "content": user_message})
+        
+        response = await self.async_client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=messages,
+            max_tokens=1000,
+            temperature=0.7,
+        )
+        
+        assistant_message = response.choices[0].message.content
+        
+        await self.asave_turn(
+            ChatMessage(
+                user_id=user_id,
+                role='user',
+                content=user_message,
+                message_type='text'
+            ),
+            assistant_message
+        )
+        
+        return assistant_message
+
+    async def aget_response_with_image(
+        self,
+        user_id: str,
+        image_source,
+        file_name: str,
+        file_size: int,
+        user_message: str = None,
+        conversation_minutes: int = 30,
+        content_type: str = "image/jpeg",
+    ) -> str:
+        """Async version of get_response_with_image."""
+        prompt = user_message if user_message else "Please analyze this image and provide any relevant health insights."
+        
+        upload_future, file_hash, reused = await sync_to_async(self.start_attachment_upload)(
+            user_id, image_source, file_name, content_type
+        )
+        image_future = asyncio.wrap_future(prepare_vision_image_async(image_source, prompt, key=file_hash))
+        
+        try:
+            system_prompt, history = await sync_to_async(self.load_turn_context)(user_id, conversation_minutes)
+            
+            # Include history but use vision for the current image
+            messages = [{"role": "system", "content": system_prompt}]
+            messages.extend(history)
+            vision_image = await asyncio.wait_for(image_future, NORMALIZE_TIMEOUT)
+            messages.append(self.build_image_message(prompt, vision_image))
+            
+            response = await self.async_client.chat.completions.create(
+                model="gpt-4o",  # Use gpt-4o for vision
+                messages=messages,
+                max_tokens=1500,
+                temperature=0.7,
+            )
+            log_vision_usage(vision_image.plan, response)
+        except BaseException:
+            if not reused:
+                self.discard_upload(upload_future)
+            raise
+        
+        assistant_message = response.choices[0].message.content
+        
+        await self.asave_turn(
+            ChatMessage(
+                user_id=user_id,
+                role='user',
+                content=f"[Shared an image: {file_name}] {prompt}",
+                message_type='image',
+                file_name=file_name,
+                file_size=file_size,
+                storage_path=await self.await_upload(file_name, upload_future),
+                content_hash=file_hash
+            ),
+            assistant_message
+        )
+        
+        return assistant_message
+
+    async def aget_response_with_pdf(
+        self,
+        user_id: str,
+        pdf_source,
+        file_name: str,
+        file_size: int,
+        user_message: str = None,
+        conversation_minutes: int = 30,
+        content_type: str = "application/pdf",
+    ) -> str:
+        """Async version of get_response_with_pdf."""
+        upload_future, file_hash, reused = await sync_to_async(self.start_attachment_upload)(
+            user_id, pdf_source, file_name, content_type
+        )
+        
+        base_prompt = user_message if user_message else "Please analyze this document and provide any relevant health insights."
+        
+        try:
+            # PyMuPDF is CPU-bound, keep it off the event loop
+            content = await asyncio.to_thread(extract_pdf_content, pdf_source)
+            pdf_message, model, vision_plans = self.build_pdf_request(base_prompt, content)
+            
+            system_prompt, history = await sync_to_async(self.load_turn_context)(user_id, conversation_minutes)
+            
+            messages = [{"role": "system", "content": system_prompt}]
+            messages.extend(history)
+            messages.append(pdf_message)
+            
+            response = await self.async_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=1500,
+                temperature=0.7,
+            )
+            if vision_plans:
+                log_vision_usage(vision_plans, response)
+        except BaseException:
+            if not reused:
+                self.discard_upload(upload_future)
+            raise
+        
+        assistant_message = response.choices[0].message.content
+        
+        await self.asave_turn(
+            ChatMessage(
+                user_id=user_id,
+                role='user',
+                content=f"[Shared a PDF: {file_name}] {base_prompt}",
+                message_type='pdf',
+                file_name=file_name,
+                file_size=file_size,
+                storage_path=await self.await_upload(file_name, upload_future),
+                content_hash=file_hash
+            ),
+            assistant_message
+        )
+        
+        return assistant_message
 
 
 # Singleton instance
@@ -0,0 +1,194 @@
+"""
+Shared Supabase storage gateway.
+
+One thread-safe storage client per process, backed by a keep-alive httpx
+pool, so chat uploads, removals and signed URLs reuse TLS connections
+instead of building a new client for every call.
+"""
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import httpx
+from storage3 import SyncStorageClient
+from backend.supabase_clients import SERVICE_ROLE, supabase_key, supabase_url
+from tasks.queue import task
+
+logger = logging.getLogger(__name__)
+
+# Supabase accepts up to 1000 paths per remove call
+REMOVE_CHUNK_SIZE = 1000
+
+# Keep-alive pool settings
+MAX_CONNECTIONS = int(os.getenv('SUPABASE_STORAGE_MAX_CONNECTIONS', 10))
+KEEPALIVE_EXPIRY = 60
+TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+
+# Queued removals are retried by the task workers with exponential backoff
+ORPHAN_MAX_ATTEMPTS = 5
+ORPHAN_RETRY_DELAY = 5
+
+
+class StorageRemoveError(Exception):
+    """Raised when some chunks of a removal failed. Carries the failed paths."""
+
+    def __init__(self, failed_paths: list, errors: list):
+        self.failed_paths = failed_paths
+        self.errors = errors
+        super().__init__(f'Failed to remove {len(failed_paths)} storage objects: {errors[0]}')
+
+
+class StorageGateway:
+    """
+    Wrapper around a single storage3 client with a pooled HTTP session.
+    Tracks request and connection counts to show how often connections are reused.
+    """
+
+    def __init__(self, url: str, key: str):
+        self._lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'connections_opened': 0,
+            'uploads': 0,
+            'removed_paths': 0,
+            'remove_calls': 0,
+            'signed_urls': 0,
+        }
+
+        headers = {"apikey": key, "Authorization": f"Bearer {key}"}
+        self._http = httpx.Client(
+            headers=headers,
+            timeout=TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            follow_redirects=True,
+            event_hooks={'request': [self._on_request]},
+        )
+        # storage3 is used directly to avoid the gotrue proxy issue in the full client
+        self._client = SyncStorageClient(f"{url}/storage/v1/", headers, http_client=self._http)
+
+    def _increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _on_request(self, request: httpx.Request):
+        self._increment('requests')
+        request.extensions['trace'] = self._trace
+
+    def _trace(self, event_name: str, info: dict):
+        # Only fired when the pool has to open a new TCP connection
+        if event_name == 'connection.connect_tcp.complete':
+            self._increment('connections_opened')
+
+    def upload(self, bucket: str, path: str, data, content_type: str) -> str:
+        """Upload bytes or a file object and return the storage path."""
+        self._client.from_(bucket).upload(path, data, {"content-type": content_type, "upsert": "true"})
+        self._increment('uploads')
+        return path
+
+    def remove(self, bucket: str, paths: list, chunk_size: int = REMOVE_CHUNK_SIZE, max_parallel: int = 1) -> int:
+        """
+        Remove paths in as few requests as possible, optionally sending chunks in parallel.
+        Returns the number of paths removed. Raises StorageRemoveError with the
+        paths of any chunks that failed.
+        """
+        paths = [p for p in paths if p]
+        chunks = [paths[start:start + chunk_size] for start in range(0, len(paths), chunk_size)]
+        if not chunks:
+            return 0
+
+        if max_parallel > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=min(max_parallel, len(chunks))) as executor:
+                results = list(executor.map(lambda chunk: self._remove_chunk(bucket, chunk), chunks))
+        else:
+            results = [self._remove_chunk(bucket, chunk) for chunk in chunks]
+
+        failed_paths = []
+        errors = []
+        for chunk, error in zip(chunks, results):
+            if error is not None:
+                failed_paths.extend(chunk)
+                errors.append(error)
+        if failed_paths:
+            raise StorageRemoveError(failed_paths, errors)
+        return len(paths)
+
+    def _remove_chunk(self, bucket: str, chunk: list):
+        """Remove one chunk of paths. Returns the exception instead of raising it."""
+        try:
+            self._client.from_(bucket).remove(chunk)
+        except Exception as e:
+            return e
+        self._increment('remove_calls')
+        self._increment('removed_paths', len(chunk))
+        return None
+
+    def create_signed_url(self, bucket: str, path: str, expires_in: int = 3600) -> str:
+        """Return a signed URL for a stored file."""
+        response = self._client.from_(bucket).create_signed_url(path, expires_in)
+        self._increment('signed_urls')
+        return response.get('signedURL') or response.get('signedUrl')
+
+    def metrics(self) -> dict:
+        """Snapshot of request and connection counters."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['connections_reused'] = max(stats['requests'] - stats['connections_opened'], 0)
+        return stats
+
+    def close(self):
+        self._http.close()
+
+
+_gateway: Optional[StorageGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_storage_gateway() -> StorageGateway:
+    """Return the process-wide storage gateway, creating it on first use."""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                url = supabase_url()
+                key = supabase_key(SERVICE_ROLE)
+
+                if not url or not key:
+                    raise RuntimeError('Supabase credentials are missing. Set SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY.')
+
+                _gateway = StorageGateway(url, key)
+    return _gateway
+
+
+def _reset_gateway_after_fork():
+    # A forked worker builds its own pool instead of sharing the parent's sockets
+    global _gateway, _gateway_lock
+    _gateway = None
+    _gateway_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_gateway_after_fork)
+
+
+@task(max_attempts=ORPHAN_MAX_ATTEMPTS, retry_delay=ORPHAN_RETRY_DELAY)
+def remove_storage_files(bucket: str, paths: list, max_parallel: int = 4):
+    """Remove storage objects. Paths that are already gone are not an error, so retries resend them all."""
+    get_storage_gateway().remove(bucket, paths, max_parallel=max_parallel)
+
+
+def remove_files(bucket: str, paths: list) -> int:
+    """
+    Queue storage objects for removal by the task workers, so callers never
+    wait on Supabase. Failed removals are retried with backoff.
+    Returns the number of paths queued.
+    """
+    paths = list(dict.fromkeys(p for p in paths if p))
+    if not paths:
+        return 0
+    remove_storage_files.enqueue(bucket=bucket, paths=paths)
+    return len(paths)
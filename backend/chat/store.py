@@ -0,0 +1,397 @@
+"""
+Pluggable storage for ephemeral chat messages.
+
+Chat messages only live for a short window, so they do not have to sit in
+the primary database. CHAT_STORE_BACKEND selects where they go:
+
+- django (default): the ChatMessage table, expired by cleanup_old_chats
+- memory: an in-process TTL LRU, for single-node deployments
+- redis: a Redis-compatible server at CHAT_STORE_REDIS_URL with native key expiry
+
+Every backend hands out ChatMessage instances so views and serializers do not
+care which one is in use. Memory and Redis messages are never saved to the
+database; their ids come from the store.
+"""
+import os
+import abc
+import json
+import time
+import itertools
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Optional
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+from .models import ChatMessage, ChatStorage, ATTACHMENT_REUSE_MINUTES
+from .storage import remove_files
+
+logger = logging.getLogger(__name__)
+
+# How long the TTL backends keep messages. History requests for a longer
+# window only see what is still retained.
+TTL_MINUTES = int(os.getenv('CHAT_STORE_TTL_MINUTES', 30))
+
+# Users kept by the in-process backend before the least recently used is evicted
+MEMORY_MAX_USERS = int(os.getenv('CHAT_STORE_MAX_USERS', 10000))
+
+# Fields copied between ChatMessage instances and the TTL backends
+MESSAGE_FIELDS = ['id', 'user_id', 'role', 'content', 'message_type', 'file_name', 'storage_path', 'file_size', 'content_hash']
+
+
+class ChatStore(abc.ABC):
+    """
+    Interface for chat message storage.
+    Async methods default to running the sync ones in a thread.
+    """
+    # True when messages live in the Django database, so they can be joined
+    # with other tables in a single query
+    in_database = False
+
+    @abc.abstractmethod
+    def add_turn(self, user_message: ChatMessage, assistant_message: ChatMessage) -> None:
+        """Store the user's message and the reply together."""
+
+    @abc.abstractmethod
+    def get_messages(self, user_id: str, minutes: int = 30) -> list:
+        """Messages for a user within the last N minutes, oldest first."""
+
+    def get_history(self, user_id: str, minutes: int = 30) -> list:
+        """The conversation formatted for the OpenAI messages array."""
+        return [msg.to_history_entry() for msg in self.get_messages(user_id, minutes)]
+
+    def latest_position(self, user_id: str, minutes: int = 30):
+        """
+        (created_at, id) of the newest message in the window, or None.
+        Ids alone are not enough to tell versions apart: the memory backend
+        numbers messages from 1 again in every process.
+        """
+        messages = self.get_messages(user_id, minutes)
+        return (messages[-1].created_at, messages[-1].id) if messages else None
+
+    def get_page(self, user_id: str, minutes: int = 30, since: tuple = None, before: tuple = None, limit: int = 100):
+        """
+        Keyset page on (created_at, id), oldest first. See ChatMessage.get_page.
+        Returns (messages, has_more).
+        """
+        messages = self.get_messages(user_id, minutes)
+        if since:
+            messages = [msg for msg in messages if (msg.created_at, msg.id) > since]
+            return messages[:limit], len(messages) > limit
+        if before:
+            messages = [msg for msg in messages if (msg.created_at, msg.id) < before]
+        return messages[-limit:], len(messages) > limit
+
+    def find_attachment(self, user_id: str, content_hash: str):
+        """Storage path of a recent attachment this user sent with the same bytes, or None."""
+        for message in reversed(self.get_messages(user_id, ATTACHMENT_REUSE_MINUTES)):
+            if message.content_hash == content_hash and message.storage_path:
+                return message.storage_path
+        return None
+
+    @abc.abstractmethod
+    def clear(self, user_id: str) -> int:
+        """Delete all messages for a user and their files. Returns the number deleted."""
+
+    @abc.abstractmethod
+    def expire_in_batches(self, minutes: int = 30, batch_size: int = 500, dry_run: bool = False, max_seconds: float = None):
+        """
+        Remove messages older than minutes and their files. Yields a stats dict
+        per batch with the same keys as ChatMessage.expire_in_batches.
+        """
+
+    async def aadd_turn(self, user_message: ChatMessage, assistant_message: ChatMessage) -> None:
+        await sync_to_async(self.add_turn)(user_message, assistant_message)
+
+    async def aget_history(self, user_id: str, minutes: int = 30) -> list:
+        return await sync_to_async(self.get_history)(user_id, minutes)
+
+
+class DjangoChatStore(ChatStore):
+    """Messages stored in the ChatMessage table."""
+    in_database = True
+
+    def add_turn(self, user_message, assistant_message):
+        # bulk_create writes both rows with one INSERT inside one transaction
+        ChatMessage.objects.bulk_create([user_message, assistant_message])
+
+    async def aadd_turn(self, user_message, assistant_message):
+        await ChatMessage.objects.abulk_create([user_message, assistant_message])
+
+    def get_messages(self, user_id, minutes=30):
+        # Expired rows are filtered out here and deleted by cleanup_old_chats
+        return list(ChatMessage.window_queryset(user_id, minutes).order_by('created_at', 'id'))
+
+    def latest_position(self, user_id, minutes=30):
+        return ChatMessage.latest_position(user_id, minutes)
+
+    def get_page(self, user_id, minutes=30, since=None, before=None, limit=100):
+        return ChatMessage.get_page(user_id, minutes, since, before, limit)
+
+    def find_attachment(self, user_id, content_hash):
+        return ChatMessage.find_attachment(user_id, content_hash)
+
+    def get_history(self, user_id, minutes=30):
+        return ChatMessage.get_conversation_history(user_id, minutes)
+
+    async def aget_history(self, user_id, minutes=30):
+        return await ChatMessage.aget_conversation_history(user_id, minutes)
+
+    def clear(self, user_id):
+        return ChatMessage.delete_messages(ChatMessage.objects.filter(user_id=user_id))
+
+    def expire_in_batches(self, minutes=30, batch_size=500, dry_run=False, max_seconds=None):
+        return ChatMessage.expire_in_batches(minutes, batch_size, dry_run, max_seconds)
+
+
+def _expiry_stats(paths: list, oldest: datetime, newest: datetime, deleted: int, files_removed: int, started: float) -> dict:
+    return {
+        'matched': deleted,
+        'deleted': deleted,
+        'files': len(paths),
+        'files_removed': files_removed,
+        'oldest': oldest,
+        'newest': newest,
+        'elapsed': time.monotonic() - started,
+    }
+
+
+class MemoryChatStore(ChatStore):
+    """
+    In-process TTL LRU keyed by user.
+    Only suitable when a single process serves all chat traffic. Messages
+    older than the TTL are dropped, and their files removed, whenever a user
+    is touched; expire_in_batches() drops those older than its minutes.
+    """
+
+    def __init__(self, ttl_minutes: int = TTL_MINUTES, max_users: int = MEMORY_MAX_USERS):
+        self.ttl = timedelta(minutes=ttl_minutes)
+        self.max_users = max_users
+        self._users = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _copy(self, message: ChatMessage) -> ChatMessage:
+        copy = ChatMessage(**{field: getattr(message, field) for field in MESSAGE_FIELDS})
+        copy.created_at = message.created_at
+        return copy
+
+    def _prune(self, messages: list, cutoff: datetime) -> list:
+        """Drop messages created before cutoff in place and return them."""
+        expired = [msg for msg in messages if msg.created_at < cutoff]
+        if expired:
+            messages[:] = [msg for msg in messages if msg.created_at >= cutoff]
+        return expired
+
+    def _remove_files(self, messages: list, remaining: list = ()) -> int:
+        """Remove the files of deleted messages unless a remaining message of the same user shares them."""
+        still_used = {msg.storage_path for msg in remaining}
+        paths = {msg.storage_path for msg in messages if msg.storage_path and msg.storage_path not in still_used}
+        return remove_files(ChatStorage.bucket_name(), list(paths))
+
+    def add_turn(self, user_message, assistant_message):
+        now = timezone.now()
+        evicted = []
+        with self._lock:
+            messages = self._users.setdefault(user_message.user_id, [])
+            self._users.move_to_end(user_message.user_id)
+            expired = self._prune(messages, now - self.ttl)
+            for message in (user_message, assistant_message):
+                message.id = next(self._ids)
+                message.created_at = now
+                messages.append(self._copy(message))
+            remaining = list(messages)
+            while len(self._users) > self.max_users:
+                _, dropped = self._users.popitem(last=False)
+                evicted.extend(dropped)
+        self._remove_files(expired, remaining)
+        self._remove_files(evicted)
+
+    def get_messages(self, user_id, minutes=30):
+        now = timezone.now()
+        cutoff = now - timedelta(minutes=minutes)
+        with self._lock:
+            messages = self._users.get(user_id)
+            if messages is None:
+                return []
+            self._users.move_to_end(user_id)
+            expired = self._prune(messages, now - self.ttl)
+            if not messages:
+                del self._users[user_id]
+            remaining = list(messages)
+            current = [self._copy(msg) for msg in messages if msg.created_at >= cutoff]
+        self._remove_files(expired, remaining)
+        return current
+
+    def clear(self, user_id):
+        with self._lock:
+            messages = self._users.pop(user_id, [])
+        self._remove_files(messages)
+        return len(messages)
+
+    def expire_in_batches(self, minutes=30, batch_size=500, dry_run=False, max_seconds=None):
+        started = time.monotonic()
+        cutoff = timezone.now() - timedelta(minutes=minutes)
+        expired = []
+        # (expired, remaining) per user, files are only shared within a user
+        by_user = []
+        with self._lock:
+            for user_id in list(self._users):
+                messages = self._users[user_id]
+                if dry_run:
+                    expired.extend(msg for msg in messages if msg.created_at < cutoff)
+                    continue
+                user_expired = self._prune(messages, cutoff)
+                if user_expired:
+                    expired.extend(user_expired)
+                    by_user.append((user_expired, list(messages)))
+                if not messages:
+                    del self._users[user_id]
+        if not expired:
+            return
+        paths = [msg.storage_path for msg in expired if msg.storage_path]
+        files_removed = sum(self._remove_files(user_expired, remaining) for user_expired, remaining in by_user)
+        created = [msg.created_at for msg in expired]
+        yield _expiry_stats(paths, min(created), max(created), len(expired), files_removed, started)
+
+
+class RedisChatStore(ChatStore):
+    """
+    Messages kept in a Redis-compatible server.
+    Each user has a sorted set of JSON messages scored by creation time, with
+    a key TTL refreshed on every turn so idle conversations disappear on their
+    own. Attached files are tracked in a separate sorted set scored by their
+    expiry time so cleanup_old_chats can remove them after the messages expire.
+    """
+    KEY_PREFIX = 'chat'
+
+    def __init__(self, url: str, ttl_minutes: int = TTL_MINUTES):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError('CHAT_STORE_BACKEND=redis requires the redis package (pip install redis)') from e
+
+        self.ttl_seconds = ttl_minutes * 60
+        self._client = redis.Redis.from_url(url)
+
+    def _messages_key(self, user_id: str) -> str:
+        return f"{self.KEY_PREFIX}:messages:{user_id}"
+
+    @property
+    def _ids_key(self) -> str:
+        return f"{self.KEY_PREFIX}:ids"
+
+    @property
+    def _files_key(self) -> str:
+        return f"{self.KEY_PREFIX}:files"
+
+    def _encode(self, message: ChatMessage) -> str:
+        data = {field: getattr(message, field) for field in MESSAGE_FIELDS}
+        data['created_at'] = message.created_at.timestamp()
+        return json.dumps(data)
+
+    def _decode(self, raw) -> ChatMessage:
+        data = json.loads(raw)
+        created_at = datetime.fromtimestamp(data.pop('created_at'), tz=dt_timezone.utc)
+        message = ChatMessage(**data)
+        message.created_at = created_at
+        return message
+
+    def add_turn(self, user_message, assistant_message):
+        now = timezone.now()
+        score = now.timestamp()
+        key = self._messages_key(user_message.user_id)
+        first_id = self._client.incrby(self._ids_key, 2) - 1
+
+        members = {}
+        files = {}
+        for offset, message in enumerate((user_message, assistant_message)):
+            message.id = first_id + offset
+            message.created_at = now
+            members[self._encode(message)] = score
+            if message.storage_path:
+                files[message.storage_path] = score + self.ttl_seconds
+
+        pipe = self._client.pipeline()
+        pipe.zremrangebyscore(key, '-inf', f"({score - self.ttl_seconds}")
+        pipe.zadd(key, members)
+        pipe.expire(key, self.ttl_seconds)
+        if files:
+            # Re-adding a reused path pushes its expiry out, so a deduplicated
+            # file lives as long as the newest message that references it
+            pipe.zadd(self._files_key, files)
+        pipe.execute()
+
+    def get_messages(self, user_id, minutes=30):
+        cutoff = timezone.now().timestamp() - minutes * 60
+        raw_messages = self._client.zrangebyscore(self._messages_key(user_id), cutoff, '+inf')
+        return sorted((self._decode(raw) for raw in raw_messages), key=lambda msg: (msg.created_at, msg.id))
+
+    def clear(self, user_id):
+        key = self._messages_key(user_id)
+        messages = [self._decode(raw) for raw in self._client.zrange(key, 0, -1)]
+        paths = [msg.storage_path for msg in messages if msg.storage_path]
+
+        pipe = self._client.pipeline()
+        pipe.delete(key)
+        if paths:
+            pipe.zrem(self._files_key, *paths)
+        pipe.execute()
+
+        remove_files(ChatStorage.bucket_name(), paths)
+        return len(messages)
+
+    def expire_in_batches(self, minutes=30, batch_size=500, dry_run=False, max_seconds=None):
+        """
+        Messages expire natively; this removes the files of expired messages.
+        Batches are counted in files rather than messages.
+        """
+        started = time.monotonic()
+        now = time.time()
+        offset = 0
+        while True:
+            if max_seconds is not None and time.monotonic() - started >= max_seconds:
+                return
+
+            entries = self._client.zrangebyscore(
+                self._files_key, '-inf', now, start=offset if dry_run else 0, num=batch_size, withscores=True
+            )
+            if not entries:
+                return
+
+            paths = [path.decode() if isinstance(path, bytes) else path for path, _ in entries]
+            files_removed = 0
+            if dry_run:
+                offset += len(entries)
+            else:
+                self._client.zrem(self._files_key, *paths)
+                files_removed = remove_files(ChatStorage.bucket_name(), paths)
+
+            # Files expire together with their message, so the score is the message expiry
+            expired_at = [datetime.fromtimestamp(score - self.ttl_seconds, tz=dt_timezone.utc) for _, score in entries]
+            yield _expiry_stats(paths, expired_at[0], expired_at[-1], 0, files_removed, started)
+
+
+_store: Optional[ChatStore] = None
+_store_lock = threading.Lock()
+
+
+def get_chat_store() -> ChatStore:
+    """Return the process-wide chat store selected by CHAT_STORE_BACKEND."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                backend = os.getenv('CHAT_STORE_BACKEND', 'django').lower()
+
+                if backend == 'django':
+                    _store = DjangoChatStore()
+                elif backend == 'memory':
+                    _store = MemoryChatStore()
+                elif backend == 'redis':
+                    url = os.getenv('CHAT_STORE_REDIS_URL', 'redis://localhost:6379/0')
+                    _store = RedisChatStore(url)
+                else:
+                    raise RuntimeError(f"Unknown CHAT_STORE_BACKEND '{backend}'. Use django, memory or redis.")
+    return _store
@@ -0,0 +1,27 @@
+import time
+import logging
+from tasks.queue import task
+from .store import get_chat_store
+
+logger = logging.getLogger(__name__)
+
+# Each run stops starting batches after this long and queues the rest,
+# well inside the task's visibility timeout
+EXPIRY_MAX_SECONDS = 60
+
+
+@task(max_attempts=3)
+def expire_chat_messages(minutes: int = 30, batch_size: int = 500):
+    """Delete expired chat messages in batches, continuing in a new task if time runs out."""
+    started = time.monotonic()
+    deleted = 0
+    for batch in get_chat_store().expire_in_batches(
+        minutes=minutes,
+        batch_size=batch_size,
+        max_seconds=EXPIRY_MAX_SECONDS,
+    ):
+        deleted += batch['deleted']
+
+    logger.info("Expired %d chat messages older than %d minutes", deleted, minutes)
+    if time.monotonic() - started >= EXPIRY_MAX_SECONDS:
+        expire_chat_messages.enqueue(minutes=minutes, batch_size=batch_size)
@@ -0,0 +1,425 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import Future
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+import fitz
+from asgiref.sync import async_to_sync
+from PIL import Image
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from .image_processing import normalize_image
+from .models import ChatMessage, ChatStorage
+from .pdf_processing import _ParserPool, extract_content_in_process, extract_pdf_content
+from .services import TURN_QUERY_BUDGET, chat_service
+from .store import ChatStore, MemoryChatStore
+from .views import FILE_ERROR_MESSAGE, MESSAGE_ERROR_MESSAGE, AsyncSendFileMessageView, AsyncSendMessageView
+
+
+def completion(text: str):
+    """Minimal stand-in for an OpenAI chat completion."""
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+class SendMessageQueryBudgetTests(TestCase):
+    """
+    A text turn reads the profile and the conversation in one query and
+    writes both messages with one INSERT.
+
+    The combined read joins public.users, which only exists on Supabase, so
+    the tests attach a SQLite database named public holding a users table and
+    run the turn down the PostgreSQL path.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # ATTACH is not allowed inside the transaction TestCase opens
+        with connection.cursor() as cursor:
+            cursor.execute("ATTACH DATABASE ':memory:' AS public")
+            cursor.execute("""
+                CREATE TABLE public.users (
+                    id TEXT PRIMARY KEY, first_name TEXT, last_name TEXT, biological_sex TEXT,
+                    date_of_birth TEXT, height_cm REAL, weight_kg REAL, email TEXT
+                )
+            """)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.cursor() as cursor:
+            cursor.execute("DETACH DATABASE public")
+
+    def setUp(self):
+        self.user_id = str(uuid.uuid4())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO public.users (id, first_name, biological_sex, email) VALUES (%s, %s, %s, %s)",
+                [self.user_id, 'Ada', 'female', 'ada@example.com'],
+            )
+        self.client = APIClient()
+
+        create = mock.patch.object(chat_service.client.chat.completions, 'create', return_value=completion('Hello Ada'))
+        self.create = create.start()
+        self.addCleanup(create.stop)
+
+        vendor = mock.patch.object(connection, 'vendor', 'postgresql')
+        vendor.start()
+        self.addCleanup(vendor.stop)
+
+    def send(self, message: str):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/chat/send/', {'user_id': self.user_id, 'message': message}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response, queries
+
+    def test_first_turn(self):
+        response, queries = self.send('Hi there')
+        self.assertEqual(response.json()['response'], 'Hello Ada')
+        self.assertLessEqual(len(queries), TURN_QUERY_BUDGET, [q['sql'] for q in queries])
+
+        messages = self.create.call_args.kwargs['messages']
+        self.assertIn('Ada', messages[0]['content'])
+        self.assertEqual(messages[1:], [{'role': 'user', 'content': 'Hi there'}])
+        self.assertEqual(ChatMessage.objects.filter(user_id=self.user_id).count(), 2)
+
+    def test_turn_with_history(self):
+        self.send('Hi there')
+        response, queries = self.send('What is ferritin?')
+        self.assertLessEqual(len(queries), TURN_QUERY_BUDGET, [q['sql'] for q in queries])
+
+        messages = self.create.call_args.kwargs['messages']
+        self.assertEqual(
+            [(m['role'], m['content']) for m in messages[1:]],
+            [('user', 'Hi there'), ('assistant', 'Hello Ada'), ('user', 'What is ferritin?')],
+        )
+        self.assertEqual(ChatMessage.objects.filter(user_id=self.user_id).count(), 4)
+
+    def test_failed_reply_writes_nothing(self):
+        self.create.side_effect = RuntimeError('model unavailable')
+        with CaptureQueriesContext(connection) as queries, self.assertLogs('chat.views', 'ERROR'):
+            response = self.client.post('/api/chat/send/', {'user_id': self.user_id, 'message': 'Hi'}, format='json')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json(), {'success': False, 'error': MESSAGE_ERROR_MESSAGE})
+        self.assertEqual(len(queries), 1)
+        self.assertFalse(ChatMessage.objects.filter(user_id=self.user_id).exists())
+
+
+class ChatHistoryQueryBudgetTests(TestCase):
+    """An unchanged history costs one indexed lookup and a 304."""
+
+    NOT_MODIFIED_QUERY_BUDGET = 1
+    HISTORY_QUERY_BUDGET = 2
+
+    def setUp(self):
+        self.user_id = str(uuid.uuid4())
+        ChatMessage.objects.bulk_create([
+            ChatMessage(user_id=self.user_id, role='user' if n % 2 == 0 else 'assistant', content=f'message {n}')
+            for n in range(6)
+        ])
+        self.client = APIClient()
+
+    def get(self, params=None, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/chat/history/', {'user_id': self.user_id, **(params or {})}, **headers)
+        return response, queries
+
+    def test_full_history(self):
+        response, queries = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['messages']), 6)
+        self.assertIn('ETag', response.headers)
+        self.assertLessEqual(len(queries), self.HISTORY_QUERY_BUDGET, [q['sql'] for q in queries])
+
+    def test_unchanged_history(self):
+        etag = self.get()[0].headers['ETag']
+        response, queries = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertLessEqual(len(queries), self.NOT_MODIFIED_QUERY_BUDGET, [q['sql'] for q in queries])
+
+    def test_new_message_changes_etag(self):
+        etag = self.get()[0].headers['ETag']
+        ChatMessage.objects.create(user_id=self.user_id, role='user', content='one more')
+        response, queries = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(len(response.json()['messages']), 7)
+
+    def test_delta_fetch(self):
+        body = self.get({'limit': 4})[0].json()
+        self.assertTrue(body['has_more'])
+        ChatMessage.objects.create(user_id=self.user_id, role='user', content='one more')
+        response, queries = self.get({'since': body['newest_cursor']})
+        self.assertEqual([m['content'] for m in response.json()['messages']], ['one more'])
+        self.assertLessEqual(len(queries), self.HISTORY_QUERY_BUDGET, [q['sql'] for q in queries])
+
+    def test_memory_store_restart_changes_etag(self):
+        # A restarted process numbers messages from 1 again
+        def history_etag(content):
+            store = MemoryChatStore()
+            store.add_turn(
+                ChatMessage(user_id=self.user_id, role='user', content=content),
+                ChatMessage(user_id=self.user_id, role='assistant', content='reply'),
+            )
+            with mock.patch('chat.views.get_chat_store', return_value=store):
+                return self.get()[0].headers['ETag']
+
+        before = history_etag('before the restart')
+        after = history_etag('after the restart')
+        self.assertTrue(before.startswith('W/"2-'))
+        self.assertTrue(after.startswith('W/"2-'))
+        self.assertNotEqual(before, after)
+
+
+class MemoryChatStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        remove_files = mock.patch('chat.store.remove_files', side_effect=lambda bucket, paths: len(paths))
+        self.remove_files = remove_files.start()
+        self.addCleanup(remove_files.stop)
+        self.store = MemoryChatStore(ttl_minutes=30)
+
+    def add_turn(self, content, age_minutes=0, storage_path=None):
+        self.store.add_turn(
+            ChatMessage(user_id='user-1', role='user', content=content, storage_path=storage_path),
+            ChatMessage(user_id='user-1', role='assistant', content='reply'),
+        )
+        for message in self.store._users['user-1'][-2:]:
+            message.created_at -= timedelta(minutes=age_minutes)
+
+    def test_interface_is_abstract(self):
+        with self.assertRaises(TypeError):
+            ChatStore()
+
+    def test_expire_honours_minutes(self):
+        self.add_turn('old', age_minutes=10, storage_path='chat/old.png')
+        self.add_turn('new')
+        batches = list(self.store.expire_in_batches(minutes=5))
+        self.assertEqual([batch['deleted'] for batch in batches], [2])
+        self.assertEqual(batches[0]['files_removed'], 1)
+        self.assertEqual([m.content for m in self.store.get_messages('user-1')], ['new', 'reply'])
+
+    def test_dry_run_keeps_messages(self):
+        self.add_turn('old', age_minutes=10)
+        batches = list(self.store.expire_in_batches(minutes=5, dry_run=True))
+        self.assertEqual([batch['deleted'] for batch in batches], [2])
+        self.assertEqual(len(self.store.get_messages('user-1')), 2)
+
+
+class SendFileErrorTests(TestCase):
+    """Failures are logged with their traceback; the client only gets a generic message."""
+
+    def upload(self):
+        return {
+            'user_id': str(uuid.uuid4()),
+            'file': SimpleUploadedFile('report.png', b'not really a png', content_type='image/png'),
+        }
+
+    def test_sync_view(self):
+        with mock.patch.object(chat_service, 'get_response_with_image', side_effect=RuntimeError('secret detail')), \
+                self.assertLogs('chat.views', 'ERROR') as logs:
+            response = APIClient().post('/api/chat/send-file/', self.upload(), format='multipart')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json(), {'success': False, 'error': FILE_ERROR_MESSAGE})
+        self.assertIn('secret detail', '\n'.join(logs.output))
+
+    def test_async_view(self):
+        request = RequestFactory().post('/api/chat/send-file/', self.upload())
+        with mock.patch.object(chat_service, 'aget_response_with_image', side_effect=RuntimeError('secret detail')), \
+                self.assertLogs('chat.views', 'ERROR') as logs:
+            response = async_to_sync(AsyncSendFileMessageView.as_view())(request)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(json.loads(response.content), {'success': False, 'error': FILE_ERROR_MESSAGE})
+        self.assertIn('Traceback', '\n'.join(logs.output))
+
+
+class ParserPoolTests(SimpleTestCase):
+    """A job's timeout covers only its own run, and a runaway job only takes down its own process."""
+
+    def setUp(self):
+        self.pool = _ParserPool(2)
+        self.addCleanup(self.shutdown)
+
+    def shutdown(self):
+        for worker in self.pool._idle:
+            worker.kill()
+
+    def run_in_thread(self, *args, timeout):
+        outcome = {}
+
+        def target():
+            try:
+                outcome['result'] = self.pool.run(*args, timeout=timeout)
+            except Exception as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        return thread, outcome
+
+    def test_queue_time_is_not_counted(self):
+        self.pool = _ParserPool(1)
+        first, first_outcome = self.run_in_thread(time.sleep, 1.5, timeout=10)
+        time.sleep(0.2)
+        # Waits behind the first job for longer than its own timeout
+        second, second_outcome = self.run_in_thread(abs, -3, timeout=1)
+        first.join()
+        second.join()
+        self.assertEqual(first_outcome, {'result': None})
+        self.assertEqual(second_outcome, {'result': 3})
+
+    def test_runaway_job_only_kills_its_process(self):
+        self.pool.run(abs, -1, timeout=10)
+        steady, steady_outcome = self.run_in_thread(time.sleep, 1.5, timeout=10)
+        with self.assertRaises(TimeoutError):
+            self.pool.run(time.sleep, 30, timeout=0.5)
+        steady.join()
+        self.assertEqual(steady_outcome, {'result': None})
+        self.assertEqual(len(self.pool._idle), 1)
+        self.assertEqual(self.pool.run(abs, -2, timeout=10), 2)
+
+    def test_errors_are_raised(self):
+        with self.assertRaises(ValueError):
+            self.pool.run(int, 'not a number', timeout=10)
+
+
+class SendMessageErrorTests(SimpleTestCase):
+
+    def test_async_view(self):
+        body = json.dumps({'user_id': str(uuid.uuid4()), 'message': 'Hi'})
+        request = RequestFactory().post('/api/chat/send/', body, content_type='application/json')
+        with mock.patch.object(chat_service, 'aget_response', side_effect=RuntimeError('secret detail')), \
+                self.assertLogs('chat.views', 'ERROR') as logs:
+            response = async_to_sync(AsyncSendMessageView.as_view())(request)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(json.loads(response.content), {'success': False, 'error': MESSAGE_ERROR_MESSAGE})
+        self.assertIn('secret detail', '\n'.join(logs.output))
+
+
+class UploadTimeoutTests(SimpleTestCase):
+    """An upload that outlives the reply is removed from storage once it finishes."""
+
+    def setUp(self):
+        remove_files = mock.patch('chat.services.remove_files')
+        self.remove_files = remove_files.start()
+        self.addCleanup(remove_files.stop)
+        timeout = mock.patch('chat.services.UPLOAD_TIMEOUT', 0.01)
+        timeout.start()
+        self.addCleanup(timeout.stop)
+
+    def running_upload(self):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        return future
+
+    def assert_removed_when_finished(self, future):
+        self.remove_files.assert_not_called()
+        future.set_result('chat/late.png')
+        self.remove_files.assert_called_once_with(ChatStorage.bucket_name(), ['chat/late.png'])
+
+    def test_sync_wait(self):
+        future = self.running_upload()
+        with self.assertLogs('chat.services', 'WARNING'):
+            self.assertIsNone(chat_service.wait_for_upload('late.png', future))
+        self.assert_removed_when_finished(future)
+
+    def test_async_wait(self):
+        future = self.running_upload()
+        with self.assertLogs('chat.services', 'WARNING'):
+            self.assertIsNone(async_to_sync(chat_service.await_upload)('late.png', future))
+        self.assert_removed_when_finished(future)
+
+    def test_failed_upload_removes_nothing(self):
+        future = self.running_upload()
+        future.set_exception(ConnectionError('storage unavailable'))
+        with self.assertLogs('chat.services', 'WARNING'):
+            self.assertIsNone(chat_service.wait_for_upload('late.png', future))
+        self.remove_files.assert_not_called()
+
+
+def traced_peak(fn, *args):
+    """Run fn and return (result, peak bytes of Python allocations made while it ran, on any thread)."""
+    tracemalloc.start()
+    try:
+        result = fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def noise_image(width: int, height: int) -> Image.Image:
+    # Noise barely compresses, so the files are as large as real photos and scans
+    return Image.merge('RGB', [Image.effect_noise((width, height), 80) for _ in range(3)])
+
+
+class UploadMemoryTests(SimpleTestCase):
+    """
+    Uploads spooled to disk are read by Pillow and MuPDF from the file, so a
+    request's peak Python memory depends on what is sent to the model, not
+    on the upload size.
+    """
+
+    # Peak allowed per byte of output: the JPEG, its buffer and the base64 copy
+    IMAGE_PEAK_FACTOR = 3
+    # The page JPEGs, plus their pickled copy when they come back from the parser pool
+    PDF_PEAK_FACTOR = 3
+    PDF_PEAK_OVERHEAD = 256 * 1024
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmpdir = tempfile.mkdtemp()
+
+        cls.image_path = os.path.join(cls.tmpdir, 'photo.jpg')
+        noise_image(4000, 3000).save(cls.image_path, quality=95)
+
+        # A scanned report: image-only pages, each a different scan
+        cls.pdf_path = os.path.join(cls.tmpdir, 'scan.pdf')
+        with fitz.open() as doc:
+            for page_num in range(8):
+                page_path = os.path.join(cls.tmpdir, f'page{page_num}.jpg')
+                noise_image(1200, 1600).save(page_path, quality=90)
+                page = doc.new_page()
+                page.insert_image(page.rect, filename=page_path)
+            doc.save(cls.pdf_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_large_image(self):
+        upload_size = os.path.getsize(self.image_path)
+        encoded, peak = traced_peak(normalize_image, self.image_path, 'memory-test-image')
+        self.assertLess(peak, self.IMAGE_PEAK_FACTOR * len(encoded))
+        # The upload itself is never read into memory
+        self.assertLess(peak, upload_size / 2)
+
+    def test_scanned_pdf_in_process(self):
+        upload_size = os.path.getsize(self.pdf_path)
+        content, peak = traced_peak(extract_content_in_process, self.pdf_path)
+        self.assertEqual(content.page_count, 8)
+        self.assertTrue(content.images)
+        payload = sum(len(image.jpeg_bytes) for image in content.images) + len(content.text)
+        self.assertLess(peak, self.PDF_PEAK_FACTOR * payload + self.PDF_PEAK_OVERHEAD)
+        self.assertLess(peak, upload_size / 3)
+
+    def test_scanned_pdf_through_parser_pool(self):
+        upload_size = os.path.getsize(self.pdf_path)
+        content, peak = traced_peak(extract_pdf_content, self.pdf_path)
+        self.assertTrue(content.images)
+        payload = sum(len(image.jpeg_bytes) for image in content.images) + len(content.text)
+        self.assertLess(peak, self.PDF_PEAK_FACTOR * payload + self.PDF_PEAK_OVERHEAD)
+        self.assertLess(peak, upload_size / 3)
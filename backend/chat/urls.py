@@ -1,12 +1,23 @@
+from django.conf import settings
 from django.urls import path
-from .views import SendMessageView, SendFileMessageView, ChatHistoryView, ClearHistoryView
+from .views import (
+    SendMessageView,
+    SendFileMessageView,
+    AsyncSendMessageView,
+    AsyncSendFileMessageView,
+    ChatHistoryView,
+    ClearHistoryView,
+)
+
+# Under ASGI the model-calling endpoints are served by the async views
+if settings.ASYNC_VIEWS:
+    send_view, send_file_view = AsyncSendMessageView, AsyncSendFileMessageView
+else:
+    send_view, send_file_view = SendMessageView, SendFileMessageView
 
 urlpatterns = [
-    path('send/', SendMessageView.as_view(), name='chat-send'),
-    path('send-file/', SendFileMessageView.as_view(), name='chat-send-file'),
+    path('send/', send_view.as_view(), name='chat-send'),
+    path('send-file/', send_file_view.as_view(), name='chat-send-file'),
     path('history/', ChatHistoryView.as_view(), name='chat-history'),
     path('clear/', ClearHistoryView.as_view(), name='chat-clear'),
 ]
-
-
-
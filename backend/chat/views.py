@@ -1,4 +1,11 @@
+import json
 import uuid
+import hashlib
+import logging
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
@@ -10,7 +17,16 @@ from .serializers import (
     ClearHistorySerializer
 )
 from .services import chat_service
-from .models import ChatMessage
+from .store import get_chat_store
+from .image_processing import ImageTooLargeError
+from idempotency.decorators import idempotent
+from backend.cursors import encode_cursor
+
+logger = logging.getLogger(__name__)
+
+# Returned instead of exception details, which are only logged
+MESSAGE_ERROR_MESSAGE = 'Failed to get a response. Please try again.'
+FILE_ERROR_MESSAGE = 'Failed to process the file. Please try again.'
 
 
 class SendMessageView(APIView):
@@ -18,6 +34,7 @@ class SendMessageView(APIView):
     Send a text message to the chat AI and get a response.
     """
     
+    @idempotent('chat-send')
     def post(self, request):
         serializer = SendMessageSerializer(data=request.data)
         
@@ -35,10 +52,11 @@ class SendMessageView(APIView):
                 'response': response
             }, status=status.HTTP_200_OK)
             
-        except Exception as e:
+        except Exception:
+            logger.exception("Chat message failed for user %s", user_id)
             return Response({
                 'success': False,
-                'error': str(e)
+                'error': MESSAGE_ERROR_MESSAGE
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -54,55 +72,35 @@ class SendFileMessageView(APIView):
     ALLOWED_PDF_TYPES = ['application/pdf']
     MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
     
+    @idempotent('chat-send-file')
     def post(self, request):
         user_id = request.data.get('user_id')
         message = request.data.get('message', '')
         file = request.FILES.get('file')
         
-        # Validate required fields
-        if not user_id:
+        error = self.validate_upload(user_id, file)
+        if error:
             return Response({
                 'success': False,
-                'error': 'user_id is required'
+                'error': error
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        if not file:
-            return Response({
-                'success': False,
-                'error': 'file is required'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Validate file size
-        if file.size > self.MAX_FILE_SIZE:
-            return Response({
-                'success': False,
-                'error': f'File size exceeds maximum allowed ({self.MAX_FILE_SIZE // (1024*1024)}MB)'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Determine file type
         content_type = file.content_type
         is_image = content_type in self.ALLOWED_IMAGE_TYPES
-        is_pdf = content_type in self.ALLOWED_PDF_TYPES
-        
-        if not is_image and not is_pdf:
-            return Response({
-                'success': False,
-                'error': f'Unsupported file type: {content_type}. Allowed: images (JPEG, PNG, GIF, WebP) and PDF.'
-            }, status=status.HTTP_400_BAD_REQUEST)
         
         try:
             # Generate unique filename
             ext = file.name.split('.')[-1] if '.' in file.name else ('jpg' if is_image else 'pdf')
             unique_filename = f"{uuid.uuid4()}.{ext}"
 
-            # Read file bytes
-            file_bytes = file.read()
+            # Large uploads are read from Django's temporary file instead of memory
+            file_source = self.file_source(file)
 
             # Process based on file type
             if is_image:
                 response = chat_service.get_response_with_image(
                     user_id=user_id,
-                    image_bytes=file_bytes,
+                    image_source=file_source,
                     file_name=unique_filename,
                     file_size=file.size,
                     user_message=message if message else None,
@@ -111,7 +109,7 @@ class SendFileMessageView(APIView):
             else:  # PDF
                 response = chat_service.get_response_with_pdf(
                     user_id=user_id,
-                    pdf_bytes=file_bytes,
+                    pdf_source=file_source,
                     file_name=unique_filename,
                     file_size=file.size,
                     user_message=message if message else None,
@@ -125,24 +123,163 @@ class SendFileMessageView(APIView):
                 'file_name': file.name
             }, status=status.HTTP_200_OK)
             
-        except Exception as e:
-            import traceback
-            error_trace = traceback.format_exc()
-            print(f"Error in SendFileMessageView: {error_trace}")  # Print to console for debugging
+        except ImageTooLargeError as e:
+            return Response({
+                'success': False,
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except Exception:
+            logger.exception("Chat file message failed for user %s", user_id)
             return Response({
                 'success': False,
-                'error': str(e),
-                'traceback': error_trace
+                'error': FILE_ERROR_MESSAGE
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+    @classmethod
+    def validate_upload(cls, user_id, file):
+        """Return an error message for an invalid upload, or None if it is valid."""
+        # Validate required fields
+        if not user_id:
+            return 'user_id is required'
+        
+        if not file:
+            return 'file is required'
+        
+        # Validate file size
+        if file.size > cls.MAX_FILE_SIZE:
+            return f'File size exceeds maximum allowed ({cls.MAX_FILE_SIZE // (1024*1024)}MB)'
+        
+        # Determine file type
+        content_type = file.content_type
+        if content_type not in cls.ALLOWED_IMAGE_TYPES and content_type not in cls.ALLOWED_PDF_TYPES:
+            return f'Unsupported file type: {content_type}. Allowed: images (JPEG, PNG, GIF, WebP) and PDF.'
+        
+        return None
+
+    @staticmethod
+    def file_source(file):
+        """
+        Return the path of an upload Django spooled to disk, or the bytes of
+        a small in-memory upload. The chat service accepts either.
+        """
+        if hasattr(file, 'temporary_file_path'):
+            return file.temporary_file_path()
+        return file.read()
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncSendMessageView(View):
+    """
+    Async version of SendMessageView for ASGI deployments.
+    The OpenAI call is awaited, so a worker can hold many in-flight requests.
+    """
+    
+    @idempotent('chat-send')
+    async def post(self, request):
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'success': False, 'error': 'Invalid JSON body'}, status=400)
+        
+        serializer = SendMessageSerializer(data=data)
+        
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+        
+        user_id = serializer.validated_data['user_id']
+        message = serializer.validated_data['message']
+        
+        try:
+            response = await chat_service.aget_response(user_id, message)
+            
+            return JsonResponse({
+                'success': True,
+                'response': response
+            })
+            
+        except Exception:
+            logger.exception("Chat message failed for user %s", user_id)
+            return JsonResponse({
+                'success': False,
+                'error': MESSAGE_ERROR_MESSAGE
+            }, status=500)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncSendFileMessageView(View):
+    """
+    Async version of SendFileMessageView for ASGI deployments.
+    Accepts multipart form data with 'file', 'user_id', and optional 'message'.
+    """
+    
+    @idempotent('chat-send-file')
+    async def post(self, request):
+        user_id = request.POST.get('user_id')
+        message = request.POST.get('message', '')
+        file = request.FILES.get('file')
+        
+        error = SendFileMessageView.validate_upload(user_id, file)
+        if error:
+            return JsonResponse({'success': False, 'error': error}, status=400)
+        
+        content_type = file.content_type
+        is_image = content_type in SendFileMessageView.ALLOWED_IMAGE_TYPES
+        
+        try:
+            ext = file.name.split('.')[-1] if '.' in file.name else ('jpg' if is_image else 'pdf')
+            unique_filename = f"{uuid.uuid4()}.{ext}"
+            file_source = SendFileMessageView.file_source(file)
+            
+            if is_image:
+                response = await chat_service.aget_response_with_image(
+                    user_id=user_id,
+                    image_source=file_source,
+                    file_name=unique_filename,
+                    file_size=file.size,
+                    user_message=message if message else None,
+                    content_type=content_type
+                )
+            else:  # PDF
+                response = await chat_service.aget_response_with_pdf(
+                    user_id=user_id,
+                    pdf_source=file_source,
+                    file_name=unique_filename,
+                    file_size=file.size,
+                    user_message=message if message else None,
+                    content_type=content_type
+                )
+            
+            return JsonResponse({
+                'success': True,
+                'response': response,
+                'file_type': 'image' if is_image else 'pdf',
+                'file_name': file.name
+            })
+            
+        except ImageTooLargeError as e:
+            return JsonResponse({'success': False, 'error': str(e)}, status=400)
+        except Exception:
+            logger.exception("Chat file message failed for user %s", user_id)
+            return JsonResponse({'success': False, 'error': FILE_ERROR_MESSAGE}, status=500)
+
+
 class ChatHistoryView(APIView):
     """
     Get chat history for a user.
+    Returns the newest page of messages, or the page after `since` / before
+    `before` cursors from an earlier response. GET requests with a matching
+    If-None-Match get a 304 after a single indexed lookup.
     """
     
+    def get(self, request):
+        return self.get_history(request, request.query_params, conditional=True)
+    
     def post(self, request):
-        serializer = GetHistorySerializer(data=request.data)
+        return self.get_history(request, request.data, conditional=False)
+    
+    def get_history(self, request, data, conditional):
+        serializer = GetHistorySerializer(data=data)
         
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -151,19 +288,52 @@ class ChatHistoryView(APIView):
         minutes = serializer.validated_data.get('minutes', 30)
         
         try:
-            messages = ChatMessage.get_user_messages(user_id, minutes)
+            chat_store = get_chat_store()
+            
+            # The newest message changes on every new turn and on clear
+            etag = self.build_etag(chat_store.latest_position(user_id, minutes), serializer.validated_data)
+            if conditional and etag in self.parse_if_none_match(request):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+            
+            messages, has_more = chat_store.get_page(
+                user_id,
+                minutes,
+                since=serializer.validated_data.get('since'),
+                before=serializer.validated_data.get('before'),
+                limit=serializer.validated_data['limit'],
+            )
             message_serializer = ChatMessageSerializer(messages, many=True)
             
             return Response({
                 'success': True,
-                'messages': message_serializer.data
-            }, status=status.HTTP_200_OK)
+                'messages': message_serializer.data,
+                'has_more': has_more,
+                'oldest_cursor': encode_cursor(messages[0].created_at, messages[0].id) if messages else None,
+                'newest_cursor': encode_cursor(messages[-1].created_at, messages[-1].id) if messages else None,
+            }, status=status.HTTP_200_OK, headers={'ETag': etag})
             
         except Exception as e:
             return Response({
                 'success': False,
                 'error': str(e)
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    @staticmethod
+    def build_etag(latest_position, params: dict) -> str:
+        """
+        Weak ETag for a history response: the newest message's created_at and
+        id plus the request parameters.
+        """
+        created_at, latest_id = latest_position or (None, 0)
+        key = '|'.join(str(params.get(name)) for name in ('user_id', 'minutes', 'limit', 'since', 'before'))
+        key += f"|{created_at.isoformat() if created_at else ''}"
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        return f'W/"{latest_id}-{digest}"'
+    
+    @staticmethod
+    def parse_if_none_match(request) -> list:
+        header = request.headers.get('If-None-Match', '')
+        return [tag.strip() for tag in header.split(',') if tag.strip()]
 
 
 class ClearHistoryView(APIView):
@@ -0,0 +1,213 @@
+"""
+Vision request policy for image chat turns.
+
+Picks low or high detail from the image content and the user's question,
+sizes the image to exactly what the model looks at, and estimates the
+vision tokens each request costs.
+"""
+import logging
+import math
+import re
+from dataclasses import dataclass
+from PIL import Image, ImageFilter
+from .image_processing import open_image, encode_image, submit, content_hash, cache_get, cache_set
+
+logger = logging.getLogger(__name__)
+
+# OpenAI sizing rules for detail="high": fit in 2048x2048, then shortest side to 768
+HIGH_DETAIL_MAX_SIDE = 2048
+HIGH_DETAIL_SHORT_SIDE = 768
+TILE_SIZE = 512
+
+# detail="low" always sees a single 512x512 image
+LOW_DETAIL_SIZE = 512
+
+BASE_TOKENS = 85
+TOKENS_PER_TILE = 170
+
+# Shrink by up to this fraction when it saves a row or column of tiles
+TILE_SNAP_MAX_SHRINK = 0.10
+
+# Text density heuristic, computed on a small grayscale copy
+ANALYSIS_SIZE = 256
+EDGE_THRESHOLD = 64
+TEXT_EDGE_DENSITY = 0.04
+
+# Images are sent at high detail unless they are clearly not a document:
+# smooth photos score well below this, photographed reports (even on gray
+# paper) well above it
+PHOTO_MAX_DENSITY = 0.25
+
+# Bytes charged to the image cache for a cached profile
+PROFILE_CACHE_SIZE = 64
+
+# Questions that need the model to read fine print
+DETAIL_KEYWORDS = re.compile(
+    r"\b(read|text|values?|numbers?|results?|levels?|ranges?|dose|dosage|"
+    r"ingredients?|transcribe|extract|table|what does (it|this) say)\b",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class VisionPlan:
+    """How an image will be sent to the vision model."""
+    detail: str
+    width: int
+    height: int
+    tiles: int
+    tokens: int
+    text_density: float
+
+
+@dataclass
+class VisionImage:
+    """A prepared image ready for the messages array."""
+    base64_image: str
+    plan: VisionPlan
+
+
+def high_detail_size(width: int, height: int) -> tuple:
+    """Return the size the model downscales a high-detail image to."""
+    scale = min(1.0, HIGH_DETAIL_MAX_SIDE / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, HIGH_DETAIL_SHORT_SIDE / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def count_tiles(width: int, height: int) -> int:
+    return math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+
+def snap_to_tiles(width: int, height: int) -> tuple:
+    """
+    Shrink slightly when a side just spills into an extra tile.
+    Only applies when the shrink is within TILE_SNAP_MAX_SHRINK.
+    """
+    best_scale = 1.0
+    for side in (width, height):
+        tiles = math.ceil(side / TILE_SIZE)
+        if tiles > 1 and side % TILE_SIZE:
+            scale = (tiles - 1) * TILE_SIZE / side
+            if scale >= 1.0 - TILE_SNAP_MAX_SHRINK:
+                best_scale = min(best_scale, scale)
+    if best_scale == 1.0:
+        return width, height
+    return max(1, math.floor(width * best_scale)), max(1, math.floor(height * best_scale))
+
+
+def estimate_tokens(width: int, height: int, detail: str) -> int:
+    """Vision input tokens for an image already sized by the plan."""
+    if detail == 'low':
+        return BASE_TOKENS
+    return BASE_TOKENS + TOKENS_PER_TILE * count_tiles(width, height)
+
+
+def text_density(image: Image.Image) -> float:
+    """
+    Rough measure of how text-like an image is, between 0 and 1.
+    Documents and labels have many sharp edges; photos have softer ones.
+    Contrast is not used, so reports photographed on gray paper or in dim
+    light still score as documents.
+    """
+    if image.format == 'JPEG':
+        image.draft('L', (ANALYSIS_SIZE, ANALYSIS_SIZE))
+    gray = image.convert('L')
+    gray.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+
+    edges = gray.filter(ImageFilter.FIND_EDGES).histogram()
+    edge_density = sum(edges[EDGE_THRESHOLD:]) / (sum(edges) or 1)
+
+    # TEXT_EDGE_DENSITY maps to 0.5
+    return min(1.0, edge_density / (2 * TEXT_EDGE_DENSITY))
+
+
+def wants_detail(question: str) -> bool:
+    """True if the question asks the model to read specific values or text."""
+    return bool(question and DETAIL_KEYWORDS.search(question))
+
+
+def image_profile(source, key: str = None) -> tuple:
+    """
+    (width, height, text density) of an image. Cached by content hash next to
+    the normalized image, so a repeated image is not decoded again.
+    """
+    cache_key = f"{key or content_hash(source)}:profile"
+    profile = cache_get(cache_key)
+    if profile is None:
+        with open_image(source) as image:
+            profile = (*image.size, text_density(image))
+        cache_set(cache_key, profile, PROFILE_CACHE_SIZE)
+    return profile
+
+
+def plan_vision_image(source, question: str = None, key: str = None) -> VisionPlan:
+    """
+    Decide detail level and target size for an image turn. source is bytes or a file path.
+    High detail is the default; low detail is only used for small images and
+    for images that are clearly not documents when the question does not ask
+    for fine detail.
+    """
+    width, height, density = image_profile(source, key)
+
+    # Small images look the same to the model at low detail
+    fits_low = max(width, height) <= LOW_DETAIL_SIZE
+
+    if not fits_low and (wants_detail(question) or density >= PHOTO_MAX_DENSITY):
+        target_width, target_height = snap_to_tiles(*high_detail_size(width, height))
+        detail = 'high'
+    else:
+        scale = min(1.0, LOW_DETAIL_SIZE / max(width, height))
+        target_width, target_height = max(1, round(width * scale)), max(1, round(height * scale))
+        detail = 'low'
+
+    return VisionPlan(
+        detail=detail,
+        width=target_width,
+        height=target_height,
+        tiles=count_tiles(target_width, target_height) if detail == 'high' else 1,
+        tokens=estimate_tokens(target_width, target_height, detail),
+        text_density=round(density, 3),
+    )
+
+
+def plan_rendered_image(width: int, height: int) -> VisionPlan:
+    """Plan for an image rendered at high-detail size, such as a rasterized PDF page."""
+    return VisionPlan(
+        detail='high',
+        width=width,
+        height=height,
+        tiles=count_tiles(width, height),
+        tokens=estimate_tokens(width, height, 'high'),
+        text_density=1.0,
+    )
+
+
+def prepare_vision_image(source, question: str = None, key: str = None) -> VisionImage:
+    """Plan and encode an image on the calling thread."""
+    key = key or content_hash(source)
+    plan = plan_vision_image(source, question, key)
+    base64_image = encode_image(source, key, max_dimension=max(plan.width, plan.height))
+    return VisionImage(base64_image=base64_image, plan=plan)
+
+
+def prepare_vision_image_async(source, question: str = None, key: str = None):
+    """Plan and encode an image on the image pool. Returns a Future for a VisionImage."""
+    return submit(prepare_vision_image, source, question, key)
+
+
+def log_vision_usage(plans, response) -> None:
+    """Log the estimated vision tokens alongside what the API reported. Accepts one plan or a list."""
+    if isinstance(plans, VisionPlan):
+        plans = [plans]
+    usage = getattr(response, 'usage', None)
+    logger.info(
+        "Vision request: images=%d detail=%s size=%s tiles=%d est_vision_tokens=%d text_density=%s prompt_tokens=%s",
+        len(plans),
+        ','.join(plan.detail for plan in plans),
+        ','.join(f"{plan.width}x{plan.height}" for plan in plans),
+        sum(plan.tiles for plan in plans),
+        sum(plan.tokens for plan in plans),
+        ','.join(f"{plan.text_density:.3f}" for plan in plans),
+        getattr(usage, 'prompt_tokens', None),
+    )
@@ -0,0 +1,11 @@
+from django.contrib import admin
+from .models import IdempotencyRecord
+
+
+@admin.register(IdempotencyRecord)
+class IdempotencyRecordAdmin(admin.ModelAdmin):
+    list_display = ['id', 'endpoint', 'key', 'status', 'response_status', 'created_at', 'updated_at']
+    list_filter = ['endpoint', 'status', 'created_at']
+    search_fields = ['key']
+    ordering = ['-created_at']
+    readonly_fields = ['created_at', 'updated_at']
@@ -0,0 +1,249 @@
+"""
+Idempotency-Key support for POST endpoints.
+
+The first request with a given key claims a pending record and runs the view.
+A duplicate that arrives while the original is still running waits for its
+result; one that arrives afterwards gets the stored response replayed.
+Only successful responses are stored, so a failed request can be retried
+with the same key.
+
+Keys are scoped to the authenticated user, or to a hash of the
+Authorization header for endpoints that do not authenticate, so one client
+can never replay another's response. Each record keeps a fingerprint of the
+request body; reusing a key with a different payload gets a 422.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import time
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.utils import timezone
+from .models import IdempotencyRecord
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# Seconds between checks while waiting for an in-flight original
+POLL_INTERVAL = 0.5
+
+
+def _get_scope(request) -> str:
+    """
+    Who a key belongs to: the authenticated user, else a hash of the
+    Authorization header, else the user_id sent with the request.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f"user:{getattr(user, 'user_id', None) or user.pk}"
+
+    authorization = request.headers.get('Authorization')
+    if authorization:
+        return f"token:{hashlib.sha256(authorization.encode()).hexdigest()}"
+
+    data = getattr(request, 'data', None)
+    if data is None:
+        if request.content_type == 'application/json':
+            try:
+                data = json.loads(request.body or b'{}')
+            except ValueError:
+                data = {}
+        else:
+            data = request.POST
+    user_id = data.get('user_id') if hasattr(data, 'get') else None
+    return f"anon:{user_id or ''}"
+
+
+def _get_fingerprint(request) -> str:
+    """
+    SHA-256 of the request payload. Uploads are hashed from the parsed form
+    fields and file contents, so large files are never read into memory.
+    """
+    digest = hashlib.sha256()
+    if (request.content_type or '').startswith('multipart/'):
+        fields = {name: request.POST.getlist(name) for name in request.POST}
+        digest.update(json.dumps(fields, sort_keys=True).encode())
+        for name in sorted(request.FILES):
+            for upload in request.FILES.getlist(name):
+                digest.update(f"\n{name}:{upload.name}:{upload.size}\n".encode())
+                for chunk in upload.chunks():
+                    digest.update(chunk)
+                upload.seek(0)
+    else:
+        digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _identify(request) -> tuple:
+    """(scope, fingerprint) for a request. The body is hashed before anything parses it."""
+    fingerprint = _get_fingerprint(request)
+    return _get_scope(request), fingerprint
+
+
+def _claim(endpoint: str, scope: str, key: str, fingerprint: str):
+    """
+    Try to become the request that runs the view.
+    Returns (record, True) when claimed, or (existing_record, False).
+    """
+    try:
+        with transaction.atomic():
+            return IdempotencyRecord.objects.create(endpoint=endpoint, scope=scope, key=key, fingerprint=fingerprint), True
+    except IntegrityError:
+        pass
+
+    record = IdempotencyRecord.objects.filter(endpoint=endpoint, scope=scope, key=key).first()
+    if record is None:
+        # Expired and purged between the insert and the lookup
+        return _claim(endpoint, scope, key, fingerprint)
+    if record.fingerprint != fingerprint:
+        return record, False
+
+    # Take over a pending record whose owner has died
+    stale_before = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_STALE_SECONDS)
+    taken = IdempotencyRecord.objects.filter(
+        pk=record.pk, status='pending', updated_at__lt=stale_before,
+    ).update(updated_at=timezone.now())
+    return record, bool(taken)
+
+
+def _load(record_id: int):
+    return IdempotencyRecord.objects.filter(pk=record_id).first()
+
+
+def _response_body(response):
+    if hasattr(response, 'data'):
+        return response.data
+    try:
+        return json.loads(response.content)
+    except ValueError:
+        return None
+
+
+def _finish(record: IdempotencyRecord, response):
+    """Store a successful response, or release the key so the client can retry."""
+    if 200 <= response.status_code < 300:
+        body = _response_body(response)
+        if body is not None:
+            IdempotencyRecord.objects.filter(pk=record.pk).update(
+                status='completed',
+                response_status=response.status_code,
+                response_body=body,
+                updated_at=timezone.now(),
+            )
+            return
+    IdempotencyRecord.objects.filter(pk=record.pk).delete()
+
+
+def _release(record: IdempotencyRecord):
+    IdempotencyRecord.objects.filter(pk=record.pk).delete()
+
+
+def _replay(record: IdempotencyRecord):
+    response = JsonResponse(record.response_body, status=record.response_status, safe=False)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _in_progress():
+    return JsonResponse({
+        'success': False,
+        'error': 'A request with this Idempotency-Key is still in progress'
+    }, status=409)
+
+
+def _key_reused():
+    return JsonResponse({
+        'success': False,
+        'error': f'This {HEADER} was already used with a different request'
+    }, status=422)
+
+
+def _invalid_key():
+    return JsonResponse({
+        'success': False,
+        'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'
+    }, status=400)
+
+
+def idempotent(endpoint: str):
+    """
+    Decorate a view's post() method to honour the Idempotency-Key header.
+    Works on both sync (APIView) and async (View) handlers.
+    """
+    def decorator(view_method):
+        if asyncio.iscoroutinefunction(view_method):
+            @functools.wraps(view_method)
+            async def async_wrapper(self, request, *args, **kwargs):
+                key = request.headers.get(HEADER)
+                if not key:
+                    return await view_method(self, request, *args, **kwargs)
+                if len(key) > MAX_KEY_LENGTH:
+                    return _invalid_key()
+
+                scope, fingerprint = await sync_to_async(_identify)(request)
+                deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+                while True:
+                    record, claimed = await sync_to_async(_claim)(endpoint, scope, key, fingerprint)
+                    if claimed:
+                        break
+                    if record.fingerprint != fingerprint:
+                        return _key_reused()
+                    while record is not None and record.status == 'pending':
+                        if time.monotonic() >= deadline:
+                            return _in_progress()
+                        await asyncio.sleep(POLL_INTERVAL)
+                        record = await sync_to_async(_load)(record.pk)
+                    if record is not None:
+                        return _replay(record)
+                    # The original failed and released the key; try to run it ourselves
+
+                try:
+                    response = await view_method(self, request, *args, **kwargs)
+                except BaseException:
+                    await sync_to_async(_release)(record)
+                    raise
+                await sync_to_async(_finish)(record, response)
+                return response
+            return async_wrapper
+
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return view_method(self, request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return _invalid_key()
+
+            scope, fingerprint = _identify(request)
+            deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+            while True:
+                record, claimed = _claim(endpoint, scope, key, fingerprint)
+                if claimed:
+                    break
+                if record.fingerprint != fingerprint:
+                    return _key_reused()
+                while record is not None and record.status == 'pending':
+                    if time.monotonic() >= deadline:
+                        return _in_progress()
+                    time.sleep(POLL_INTERVAL)
+                    record = _load(record.pk)
+                if record is not None:
+                    return _replay(record)
+                # The original failed and released the key; try to run it ourselves
+
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except BaseException:
+                _release(record)
+                raise
+            _finish(record, response)
+            return response
+        return wrapper
+    return decorator
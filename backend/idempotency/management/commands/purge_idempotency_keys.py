@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from idempotency.models import IdempotencyRecord
+
+
+class Command(BaseCommand):
+    help = 'Delete idempotency records older than specified hours (default: 24)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=int,
+            default=24,
+            help='Delete records older than this many hours (default: 24)'
+        )
+
+    def handle(self, *args, **options):
+        hours = options['hours']
+        deleted_count = IdempotencyRecord.purge_expired(hours=hours)
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully deleted {deleted_count} idempotency records older than {hours} hours'
+            )
+        )
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.27 on 2026-10-19 09:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('idempotency', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='idempotencyrecord',
+            name='idempotency_endpoint_user_key_unique',
+        ),
+        migrations.RenameField(
+            model_name='idempotencyrecord',
+            old_name='user_id',
+            new_name='scope',
+        ),
+        migrations.AddField(
+            model_name='idempotencyrecord',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='idempotencyrecord',
+            constraint=models.UniqueConstraint(fields=('endpoint', 'scope', 'key'), name='idempotency_endpoint_scope_key_unique'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+from datetime import timedelta
+from django.db import models
+from django.utils import timezone
+
+
+class IdempotencyRecord(models.Model):
+    """
+    Tracks requests sent with an Idempotency-Key header.
+    A pending record means the original request is still running; a completed
+    record holds the response that is replayed to retries of the same key.
+    scope is the user or credential the key belongs to, and fingerprint the
+    SHA-256 of the request that claimed it.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('completed', 'Completed'),
+    ]
+    
+    endpoint = models.CharField(max_length=100)
+    scope = models.CharField(max_length=255, blank=True, default='')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, blank=True, default='')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    response_status = models.IntegerField(blank=True, null=True)
+    response_body = models.JSONField(blank=True, null=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['endpoint', 'scope', 'key'], name='idempotency_endpoint_scope_key_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.endpoint} {self.key} ({self.status})"
+    
+    @classmethod
+    def purge_expired(cls, hours: int = 24) -> int:
+        """Delete records older than the given number of hours."""
+        cutoff_time = timezone.now() - timedelta(hours=hours)
+        deleted_count, _ = cls.objects.filter(created_at__lt=cutoff_time).delete()
+        return deleted_count
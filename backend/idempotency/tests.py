@@ -0,0 +1,147 @@
+import json
+import os
+import time
+import uuid
+from unittest import mock
+import jwt
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+from analyses.authentication import SupabaseAuthentication
+from .decorators import HEADER, idempotent
+from .models import IdempotencyRecord
+
+
+def auth_header(user_id: str) -> str:
+    token = jwt.encode(
+        {'sub': user_id, 'aud': 'authenticated', 'exp': int(time.time()) + 3600},
+        os.environ['SUPABASE_JWT_SECRET'],
+        algorithm='HS256',
+    )
+    return f'Bearer {token}'
+
+
+class EchoView(APIView):
+    """Counts its runs and answers with the run number and the caller."""
+    authentication_classes = [SupabaseAuthentication]
+    runs = 0
+    status_code = 200
+
+    @idempotent('test-echo')
+    def post(self, request):
+        EchoView.runs += 1
+        body = {'run': EchoView.runs, 'user': str(request.user), 'message': request.data.get('message')}
+        return Response(body, status=self.status_code)
+
+
+class OpenEchoView(EchoView):
+    """The same view on an endpoint that does not authenticate."""
+    authentication_classes = []
+    permission_classes = []
+
+
+class IdempotentDecoratorTests(TestCase):
+
+    def setUp(self):
+        EchoView.runs = 0
+        self.factory = APIRequestFactory()
+        self.alice = str(uuid.uuid4())
+        self.bob = str(uuid.uuid4())
+
+    def post(self, view, key, data, authorization=None, format='json'):
+        headers = {f'HTTP_{HEADER.upper().replace("-", "_")}': key}
+        if authorization:
+            headers['HTTP_AUTHORIZATION'] = authorization
+        request = self.factory.post('/echo/', data, format=format, **headers)
+        response = view.as_view()(request)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def test_replay(self):
+        first = self.post(EchoView, 'key-1', {'message': 'hi'}, auth_header(self.alice))
+        second = self.post(EchoView, 'key-1', {'message': 'hi'}, auth_header(self.alice))
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(json.loads(second.content), json.loads(first.content))
+        self.assertEqual(EchoView.runs, 1)
+
+    def test_different_payload_is_rejected(self):
+        self.post(EchoView, 'key-1', {'message': 'hi'}, auth_header(self.alice))
+        response = self.post(EchoView, 'key-1', {'message': 'something else'}, auth_header(self.alice))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(EchoView.runs, 1)
+
+    def test_upload_fingerprint_covers_file_contents(self):
+        def upload(content):
+            return {'message': 'hi', 'file': SimpleUploadedFile('report.pdf', content, content_type='application/pdf')}
+
+        self.post(EchoView, 'key-1', upload(b'%PDF-1 first'), auth_header(self.alice), format='multipart')
+        replay = self.post(EchoView, 'key-1', upload(b'%PDF-1 first'), auth_header(self.alice), format='multipart')
+        other = self.post(EchoView, 'key-1', upload(b'%PDF-1 second'), auth_header(self.alice), format='multipart')
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(other.status_code, 422)
+        self.assertEqual(EchoView.runs, 1)
+
+    def test_keys_are_isolated_per_user(self):
+        alice = self.post(EchoView, 'shared-key', {'message': 'hi'}, auth_header(self.alice))
+        bob = self.post(EchoView, 'shared-key', {'message': 'hi'}, auth_header(self.bob))
+        self.assertEqual(EchoView.runs, 2)
+        self.assertNotIn('Idempotent-Replayed', bob)
+        self.assertIn(self.alice, alice.content.decode())
+        self.assertIn(self.bob, bob.content.decode())
+        self.assertEqual(
+            set(IdempotencyRecord.objects.values_list('scope', flat=True)),
+            {f'user:{self.alice}', f'user:{self.bob}'},
+        )
+
+    def test_body_user_id_does_not_share_keys(self):
+        # Without authentication the Authorization header scopes the key,
+        # not the user_id a client claims in the body
+        data = {'message': 'hi', 'user_id': self.alice}
+        self.post(OpenEchoView, 'shared-key', data, 'Bearer token-one')
+        response = self.post(OpenEchoView, 'shared-key', data, 'Bearer token-two')
+        self.assertEqual(EchoView.runs, 2)
+        self.assertNotIn('Idempotent-Replayed', response)
+        scopes = list(IdempotencyRecord.objects.values_list('scope', flat=True))
+        self.assertTrue(all(scope.startswith('token:') for scope in scopes))
+        self.assertNotIn('token-one', ''.join(scopes))
+
+    def test_duplicate_waits_for_in_flight_original(self):
+        scope = f'user:{self.alice}'
+        first = self.post(EchoView, 'key-1', {'message': 'hi'}, auth_header(self.alice))
+        # Put the record back in flight, as if the original were still running
+        record = IdempotencyRecord.objects.get(scope=scope, key='key-1')
+        IdempotencyRecord.objects.filter(pk=record.pk).update(status='pending')
+
+        def original_finishes(seconds):
+            IdempotencyRecord.objects.filter(pk=record.pk).update(status='completed')
+
+        with mock.patch('idempotency.decorators.time.sleep', side_effect=original_finishes) as sleep:
+            second = self.post(EchoView, 'key-1', {'message': 'hi'}, auth_header(self.alice))
+        self.assertEqual(sleep.call_count, 1)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(json.loads(second.content), json.loads(first.content))
+        self.assertEqual(EchoView.runs, 1)
+
+    @override_settings(IDEMPOTENCY_WAIT_SECONDS=0)
+    def test_duplicate_of_in_flight_original_times_out(self):
+        self.post(EchoView, 'key-1', {'message': 'hi'}, auth_header(self.alice))
+        IdempotencyRecord.objects.update(status='pending')
+        response = self.post(EchoView, 'key-1', {'message': 'hi'}, auth_header(self.alice))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(EchoView.runs, 1)
+
+    def test_failed_request_releases_key(self):
+        with mock.patch.object(EchoView, 'status_code', 500):
+            failed = self.post(EchoView, 'key-1', {'message': 'hi'}, auth_header(self.alice))
+        self.assertEqual(failed.status_code, 500)
+        self.assertFalse(IdempotencyRecord.objects.exists())
+
+        response = self.post(EchoView, 'key-1', {'message': 'hi'}, auth_header(self.alice))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(EchoView.runs, 2)
@@ -1,3 +1,11 @@
 from django.contrib import admin
+from .models import StripeEvent
 
-# Register your models here.
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ['event_id', 'event_type', 'subscription_id', 'status', 'attempts', 'next_attempt_at', 'locked_until', 'created_at', 'processed_at']
+    list_filter = ['event_type', 'status', 'created_at']
+    search_fields = ['event_id', 'subscription_id']
+    ordering = ['-created_at']
+    readonly_fields = ['created_at', 'processed_at']
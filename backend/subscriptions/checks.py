@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, register
+
+
+@register()
+def check_entitlement_cache(app_configs, **kwargs):
+    """
+    Stripe webhooks are applied by the task worker, so the entitlement cache
+    it updates has to be the one the web processes read.
+    """
+    if isinstance(caches[settings.ENTITLEMENT_CACHE_ALIAS], LocMemCache):
+        return [Error(
+            f'The entitlement cache {settings.ENTITLEMENT_CACHE_ALIAS!r} is process-local, '
+            'so webhook updates applied by the task worker never reach the web processes.',
+            hint='Set CACHE_REDIS_URL, or use the database cache (python manage.py createcachetable).',
+            id='subscriptions.E001',
+        )]
+    return []
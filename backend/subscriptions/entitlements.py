@@ -0,0 +1,98 @@
+"""
+Subscription entitlements, cached per user.
+
+Whether a user has an active or trialing subscription is read from the
+Supabase subscriptions table once and kept in the Django cache for
+ENTITLEMENT_CACHE_SECONDS. Stripe webhooks, applied by the task worker,
+update or drop the cached value as soon as a subscription changes, so the
+TTL only bounds staleness for changes made outside the webhook.
+
+The cache must be shared by the web and worker processes for those updates
+to be seen. A process-local cache (LocMemCache) is refused: entitlements
+are then read from Supabase on every check rather than served stale.
+"""
+import logging
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from backend.supabase_clients import get_supabase_client
+
+logger = logging.getLogger(__name__)
+
+# Subscription statuses that grant access; trial users have access too
+ENTITLED_STATUSES = ['active', 'trialing']
+
+
+def _shared_cache():
+    """The entitlement cache, or None if it only lives in this process."""
+    backend = caches[settings.ENTITLEMENT_CACHE_ALIAS]
+    if isinstance(backend, LocMemCache):
+        logger.warning(
+            "Cache %r is process-local; entitlements are not cached",
+            settings.ENTITLEMENT_CACHE_ALIAS,
+        )
+        return None
+    return backend
+
+
+def _cache_key(user_id) -> str:
+    return f'entitlement:{user_id}'
+
+
+def _fetch_entitlement(user_id) -> bool:
+    response = (
+        get_supabase_client().table('subscriptions')
+        .select('id')
+        .eq('user_id', user_id)
+        .in_('status', ENTITLED_STATUSES)
+        .limit(1)
+        .execute()
+    )
+    return bool(response.data)
+
+
+def get_entitlement(user_id) -> bool:
+    """
+    True if the user has an active or trialing subscription.
+    Served from the cache when possible; errors from Supabase are raised.
+    """
+    cache = _shared_cache()
+    if cache is None:
+        return _fetch_entitlement(user_id)
+    key = _cache_key(user_id)
+    entitled = cache.get(key)
+    if entitled is None:
+        entitled = _fetch_entitlement(user_id)
+        cache.set(key, entitled, settings.ENTITLEMENT_CACHE_SECONDS)
+    return entitled
+
+
+def has_entitlement(user) -> bool:
+    """
+    Check a user object (or user_id) for an active subscription.
+    Fails closed: an unknown user or a failed lookup returns False.
+    """
+    user_id = getattr(user, 'user_id', user)
+    if not user_id:
+        return False
+    try:
+        return get_entitlement(str(user_id))
+    except Exception as e:
+        logger.warning("Entitlement lookup failed for %s: %s", user_id, e)
+        return False
+
+
+def set_entitlement(user_id, entitled: bool) -> None:
+    """Record a known entitlement, e.g. from a webhook, without a lookup."""
+    cache = _shared_cache()
+    if user_id and cache is not None:
+        cache.set(_cache_key(user_id), bool(entitled), settings.ENTITLEMENT_CACHE_SECONDS)
+
+
+def invalidate_entitlement(*user_ids) -> None:
+    """Drop cached entitlements so the next check reads Supabase."""
+    cache = _shared_cache()
+    keys = [_cache_key(user_id) for user_id in user_ids if user_id]
+    if keys and cache is not None:
+        cache.delete_many(keys)
+
@@ -0,0 +1,403 @@
+"""
+Stripe webhook events, applied in the background.
+
+The webhook only verifies the signature and stores the event, keyed by the
+Stripe event id, so it can acknowledge Stripe straight away and
+redeliveries are dropped. It then queues the process_stripe_events task,
+and a run_task_worker applies stored events (as does the
+process_stripe_events command). Events for one subscription are applied in
+the order Stripe created them. Failed events are retried with exponential
+backoff.
+
+An event is claimed in one short transaction that leases it to the worker,
+applied with no transaction or row lock held during the Supabase and Stripe
+calls, and its outcome recorded in a second short transaction. A worker
+that dies mid-event loses the lease and the event is claimed again.
+"""
+import os
+import json
+import logging
+from datetime import timedelta
+from typing import Optional
+import stripe
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from backend.supabase_clients import get_supabase_client
+from .models import StripeEvent
+from .entitlements import ENTITLED_STATUSES, set_entitlement, invalidate_entitlement
+
+logger = logging.getLogger(__name__)
+
+# Events are applied by task workers, outside the web process
+if os.environ.get('STRIPE_SECRET_KEY'):
+    stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
+
+# Retries per event before it is marked failed; the delay doubles each time
+MAX_ATTEMPTS = int(os.getenv('STRIPE_EVENT_MAX_ATTEMPTS', 8))
+RETRY_DELAY = 10
+
+# Seconds a claimed event is leased to its worker before another may take it
+LEASE_SECONDS = int(os.getenv('STRIPE_EVENT_LEASE_SECONDS', 120))
+
+# Seconds process_stripe_events --loop sleeps between polls
+POLL_SECONDS = 30
+
+# Events that only move a subscription's status; a stale one is skipped
+# once a newer event for the same subscription has been applied
+STATUS_EVENTS = [
+    'customer.subscription.updated',
+    'invoice.payment_failed',
+    'invoice.payment_succeeded',
+]
+
+# A completed checkout replaces the user's subscriptions in these states
+REPLACED_STATUSES = ['cancelled', 'past_due', 'unpaid', 'active', 'trialing']
+
+
+def get_subscription_user_ids(supabase, subscription_id, metadata=None) -> list:
+    """
+    Users a Stripe subscription belongs to, for cache invalidation.
+    Uses the user_id stored in the subscription's metadata at checkout and
+    falls back to the subscriptions table for older subscriptions.
+    """
+    user_id = (metadata or {}).get('user_id')
+    if user_id:
+        return [user_id]
+    if not subscription_id:
+        return []
+    response = supabase.table('subscriptions').select('user_id').eq('stripe_subscription_id', subscription_id).execute()
+    return [row['user_id'] for row in response.data or [] if row.get('user_id')]
+
+
+def event_subscription_id(event_type: str, obj: dict) -> Optional[str]:
+    """The subscription an event belongs to, used to order events."""
+    if event_type.startswith('customer.subscription.'):
+        return obj.get('id')
+    subscription = obj.get('subscription')
+    if isinstance(subscription, dict):
+        return subscription.get('id')
+    return subscription
+
+
+def record_event(payload: bytes) -> bool:
+    """
+    Store a verified webhook payload.
+    Returns False if the event was already stored by an earlier delivery.
+    """
+    event = json.loads(payload)
+    obj = event['data']['object']
+    _, created = StripeEvent.objects.get_or_create(
+        event_id=event['id'],
+        defaults={
+            'event_type': event['type'],
+            'subscription_id': event_subscription_id(event['type'], obj),
+            'stripe_created': event.get('created') or 0,
+            'payload': event,
+        },
+    )
+    return created
+
+
+def subscription_status_at_checkout(session) -> str:
+    """
+    Stripe status of the subscription a checkout session created, without
+    calling the Stripe API. Prefers an expanded subscription, then the newest
+    stored customer.subscription.* event for it. Otherwise a session with
+    nothing due today started a trial.
+    """
+    subscription = session.get('subscription')
+    if isinstance(subscription, dict):
+        return subscription.get('status')
+
+    latest = (
+        StripeEvent.objects
+        .filter(subscription_id=subscription, event_type__startswith='customer.subscription.')
+        .order_by('-stripe_created', '-id')
+        .values_list('payload', flat=True)
+        .first()
+    )
+    if latest is not None:
+        return latest['data']['object'].get('status')
+
+    return 'trialing' if session.get('amount_total') == 0 else 'active'
+
+
+def cancel_replaced_subscription(stripe_subscription_id) -> bool:
+    """Cancel a subscription in Stripe. True once it is cancelled or no longer exists."""
+    try:
+        stripe.Subscription.delete(stripe_subscription_id)
+    except stripe.error.InvalidRequestError as e:
+        if e.code != 'resource_missing':
+            logger.exception("Failed to cancel replaced subscription %s", stripe_subscription_id)
+            return False
+    except Exception:
+        logger.exception("Failed to cancel replaced subscription %s", stripe_subscription_id)
+        return False
+    return True
+
+
+def handle_checkout_completed(supabase, session):
+    user_id = session.get('client_reference_id')
+    customer_id = session.get('customer')
+    payment_status = session.get('payment_status')
+    subscription_id = session.get('subscription')
+    if isinstance(subscription_id, dict):
+        subscription_id = subscription_id.get('id')
+
+    # Only activate subscription if payment was successful
+    # If payment failed, we don't create/update subscription; the user will need to retry checkout
+    if payment_status != 'paid' or not subscription_id:
+        return
+
+    # Cancel the user's other subscriptions in Stripe before their records go,
+    # so a failed cancellation leaves a record of a subscription still billing
+    replaced_subs = (
+        supabase.table('subscriptions')
+        .select('stripe_subscription_id, status')
+        .eq('user_id', user_id)
+        .neq('stripe_subscription_id', subscription_id)
+        .in_('status', REPLACED_STATUSES)
+        .execute()
+    )
+    replaced_ids, failed_ids = [], []
+    for replaced_sub in replaced_subs.data or []:
+        replaced_subscription_id = replaced_sub.get('stripe_subscription_id')
+        if replaced_sub.get('status') in ENTITLED_STATUSES and not cancel_replaced_subscription(replaced_subscription_id):
+            failed_ids.append(replaced_subscription_id)
+        else:
+            replaced_ids.append(replaced_subscription_id)
+    if replaced_ids:
+        supabase.table('subscriptions').delete().in_('stripe_subscription_id', replaced_ids).execute()
+
+    # Derived from the event data instead of retrieving the subscription (trial vs active)
+    subscription_status_from_stripe = subscription_status_at_checkout(session)
+
+    # Map Stripe subscription status to our status
+    # Note: 'canceled' status should not happen here (new subscription), but if it does, skip creating it
+    if subscription_status_from_stripe == 'canceled':
+        # Don't create a cancelled subscription
+        invalidate_entitlement(user_id)
+        return
+
+    status_map = {
+        'active': 'active',
+        'trialing': 'trialing',
+        'past_due': 'past_due',
+        'unpaid': 'unpaid',
+    }
+    mapped_status = status_map.get(subscription_status_from_stripe, 'active')
+
+    # Now create/update the new subscription
+    # Use stripe_subscription_id for conflict resolution since it's unique
+    supabase.table('subscriptions').upsert({
+        'user_id': user_id,
+        'stripe_customer_id': customer_id,
+        'stripe_subscription_id': subscription_id,
+        'status': mapped_status,  # Will be 'trialing' if in trial, 'active' otherwise
+        'plan': (session.get('metadata') or {}).get('plan', 'yearly'),
+    }, on_conflict='stripe_subscription_id').execute()
+
+    set_entitlement(user_id, mapped_status in ENTITLED_STATUSES)
+
+    # The event is retried, which cancels and removes what is left
+    if failed_ids:
+        raise RuntimeError(f"Could not cancel replaced subscriptions: {', '.join(failed_ids)}")
+
+
+def handle_subscription_updated(supabase, subscription):
+    subscription_id = subscription.get('id')
+    subscription_status = subscription.get('status')
+    user_ids = get_subscription_user_ids(supabase, subscription_id, subscription.get('metadata'))
+
+    # If subscription is canceled, delete the record
+    if subscription_status == 'canceled':
+        supabase.table('subscriptions').delete().eq('stripe_subscription_id', subscription_id).execute()
+    else:
+        # Map Stripe subscription status to our status
+        status_map = {
+            'active': 'active',
+            'past_due': 'past_due',
+            'unpaid': 'unpaid',
+            'trialing': 'trialing',
+        }
+
+        mapped_status = status_map.get(subscription_status, 'active')
+
+        # Update subscription status in Supabase
+        supabase.table('subscriptions').update({
+            'status': mapped_status,
+        }).eq('stripe_subscription_id', subscription_id).execute()
+
+    if subscription_status in ENTITLED_STATUSES:
+        for user_id in user_ids:
+            set_entitlement(user_id, True)
+    else:
+        # The user may still have another subscription, so re-check
+        invalidate_entitlement(*user_ids)
+
+
+def handle_subscription_deleted(supabase, subscription):
+    subscription_id = subscription.get('id')
+    user_ids = get_subscription_user_ids(supabase, subscription_id, subscription.get('metadata'))
+
+    # Delete subscription record from Supabase
+    supabase.table('subscriptions').delete().eq('stripe_subscription_id', subscription_id).execute()
+    invalidate_entitlement(*user_ids)
+
+
+def handle_payment_failed(supabase, invoice):
+    subscription_id = invoice.get('subscription')
+
+    # Update subscription status to past_due or unpaid
+    if subscription_id:
+        supabase.table('subscriptions').update({
+            'status': 'past_due',
+        }).eq('stripe_subscription_id', subscription_id).execute()
+        invalidate_entitlement(*get_subscription_user_ids(
+            supabase, subscription_id, (invoice.get('subscription_details') or {}).get('metadata')
+        ))
+
+
+def handle_payment_succeeded(supabase, invoice):
+    subscription_id = invoice.get('subscription')
+
+    # Reactivate subscription if it was past_due or unpaid
+    if subscription_id:
+        supabase.table('subscriptions').update({
+            'status': 'active',
+        }).eq('stripe_subscription_id', subscription_id).execute()
+        for user_id in get_subscription_user_ids(
+            supabase, subscription_id, (invoice.get('subscription_details') or {}).get('metadata')
+        ):
+            set_entitlement(user_id, True)
+
+
+EVENT_HANDLERS = {
+    'checkout.session.completed': handle_checkout_completed,
+    'customer.subscription.updated': handle_subscription_updated,
+    'customer.subscription.deleted': handle_subscription_deleted,
+    'invoice.payment_failed': handle_payment_failed,
+    'invoice.payment_succeeded': handle_payment_succeeded,
+}
+
+
+def apply_event(event_type: str, obj: dict):
+    """Apply one event to Supabase and the entitlement cache. Unknown types are ignored."""
+    handler = EVENT_HANDLERS.get(event_type)
+    if handler is not None:
+        handler(get_supabase_client(), obj)
+
+
+def _is_stale(event: StripeEvent) -> bool:
+    if event.event_type not in STATUS_EVENTS or not event.subscription_id:
+        return False
+    return StripeEvent.objects.filter(
+        subscription_id=event.subscription_id,
+        status='processed',
+        stripe_created__gt=event.stripe_created,
+    ).exists()
+
+
+def _due_events(now):
+    """
+    Events that are due, pending or with an expired lease, that have no
+    earlier unfinished event for their subscription.
+    """
+    earlier = StripeEvent.objects.filter(
+        subscription_id=OuterRef('subscription_id'),
+        status__in=['pending', 'processing'],
+    ).filter(
+        Q(stripe_created__lt=OuterRef('stripe_created'))
+        | Q(stripe_created=OuterRef('stripe_created'), id__lt=OuterRef('id'))
+    )
+    return (
+        StripeEvent.objects
+        .filter(Q(status='pending', next_attempt_at__lte=now) | Q(status='processing', locked_until__lt=now))
+        .exclude(Exists(earlier))
+        .order_by('stripe_created', 'id')
+    )
+
+
+def claim_next_event() -> Optional[StripeEvent]:
+    """
+    Lease the next due event to this worker, or return None if there is none.
+    While it is processing, the later events of its subscription wait.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        event = _due_events(now).select_for_update(skip_locked=True).first()
+        if event is None:
+            return None
+        event.status = 'processing'
+        event.attempts += 1
+        event.locked_until = now + timedelta(seconds=LEASE_SECONDS)
+        event.save(update_fields=['status', 'attempts', 'locked_until'])
+    return event
+
+
+def process_next_event() -> Optional[StripeEvent]:
+    """
+    Claim and apply the next due event, or return None if there is none.
+    The outcome is only recorded while this worker still holds the lease,
+    so an event that outlived its lease is not overwritten.
+    """
+    event = claim_next_event()
+    if event is None:
+        return None
+
+    try:
+        if event.attempts > MAX_ATTEMPTS:
+            raise TimeoutError('Lease expired on the last attempt')
+        if _is_stale(event):
+            logger.info("Skipping superseded Stripe event %s", event.event_id)
+        else:
+            apply_event(event.event_type, event.payload['data']['object'])
+    except Exception as e:
+        event.last_error = str(e)
+        if event.attempts >= MAX_ATTEMPTS:
+            event.status = 'failed'
+            logger.error("Giving up on Stripe event %s after %d attempts: %s", event.event_id, event.attempts, e)
+        else:
+            event.status = 'pending'
+            event.next_attempt_at = timezone.now() + timedelta(seconds=RETRY_DELAY * 2 ** (event.attempts - 1))
+            logger.warning("Stripe event %s failed, retrying: %s", event.event_id, e)
+    else:
+        event.status = 'processed'
+        event.processed_at = timezone.now()
+        event.last_error = ''
+
+    event.locked_until = None
+    StripeEvent.objects.filter(pk=event.pk, status='processing', attempts=event.attempts).update(
+        status=event.status,
+        next_attempt_at=event.next_attempt_at,
+        locked_until=None,
+        last_error=event.last_error,
+        processed_at=event.processed_at,
+    )
+    return event
+
+
+def process_events(limit: Optional[int] = None) -> dict:
+    """Apply due events until none are left (or limit is reached). Returns counts by outcome."""
+    counts = {'processed': 0, 'retrying': 0, 'failed': 0}
+    while limit is None or sum(counts.values()) < limit:
+        event = process_next_event()
+        if event is None:
+            break
+        if event.status == 'pending':
+            counts['retrying'] += 1
+        else:
+            counts[event.status] += 1
+    return counts
+
+
+def next_retry_at():
+    """When the earliest event waiting for a retry is due, or None."""
+    return (
+        StripeEvent.objects
+        .filter(status='pending')
+        .order_by('next_attempt_at')
+        .values_list('next_attempt_at', flat=True)
+        .first()
+    )
@@ -0,0 +1,40 @@
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from subscriptions.models import StripeEvent
+from subscriptions.events import POLL_SECONDS, process_events
+
+
+class Command(BaseCommand):
+    help = 'Apply stored Stripe webhook events that are due, in order per subscription'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help=f'Keep running and poll for due events every {POLL_SECONDS} seconds'
+        )
+        parser.add_argument(
+            '--retry-failed',
+            action='store_true',
+            help='Queue events that ran out of attempts again before processing'
+        )
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            requeued = StripeEvent.objects.filter(status='failed').update(
+                status='pending', attempts=0, next_attempt_at=timezone.now()
+            )
+            self.stdout.write(f'Requeued {requeued} failed events')
+
+        while True:
+            counts = process_events()
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Processed {counts['processed']} Stripe events "
+                    f"({counts['retrying']} retrying, {counts['failed']} failed)"
+                )
+            )
+            if not options['loop']:
+                break
+            time.sleep(POLL_SECONDS)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from subscriptions.models import StripeEvent
+
+
+class Command(BaseCommand):
+    help = 'Delete processed Stripe events older than specified days (default: 30)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=30,
+            help='Delete processed events older than this many days (default: 30)'
+        )
+
+    def handle(self, *args, **options):
+        days = options['days']
+        deleted_count = StripeEvent.purge_processed(days=days)
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully deleted {deleted_count} processed Stripe events older than {days} days'
+            )
+        )
@@ -1,3 +1,51 @@
+from datetime import timedelta
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class StripeEvent(models.Model):
+    """
+    A verified Stripe webhook event waiting to be applied.
+    The Stripe event id is unique, so redeliveries of the same event are
+    stored once and applied once. Events for the same subscription are
+    applied in the order Stripe created them. A processing event is leased
+    to one worker until locked_until; after that another worker may take it.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+    
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    # Events sharing a subscription are applied one after another
+    subscription_id = models.CharField(max_length=255, blank=True, null=True)
+    stripe_created = models.BigIntegerField()
+    payload = models.JSONField()
+    
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='stripe_event_due_idx'),
+            models.Index(fields=['subscription_id', 'stripe_created', 'id'], name='stripe_event_sub_order_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.event_type} {self.event_id} ({self.status})"
+    
+    @classmethod
+    def purge_processed(cls, days: int = 30) -> int:
+        """Delete processed events older than the given number of days."""
+        cutoff_time = timezone.now() - timedelta(days=days)
+        deleted_count, _ = cls.objects.filter(status='processed', created_at__lt=cutoff_time).delete()
+        return deleted_count
@@ -0,0 +1,31 @@
+import os
+import stripe
+from django.utils import timezone
+from tasks.queue import task
+from backend.supabase_clients import get_supabase_client
+from .events import next_retry_at, process_events
+
+if os.environ.get('STRIPE_SECRET_KEY'):
+    stripe.api_key = os.environ.get('STRIPE_SECRET_KEY')
+
+
+@task()
+def cancel_subscription(stripe_subscription_id: str):
+    """Cancel a subscription in Stripe and mark its record cancelled."""
+    stripe.Subscription.delete(stripe_subscription_id)
+    get_supabase_client().table('subscriptions').update({
+        'status': 'cancelled',
+    }).eq('stripe_subscription_id', stripe_subscription_id).execute()
+
+
+@task()
+def process_stripe_events():
+    """
+    Apply every due Stripe event. Queued by the webhook for each new event;
+    when some events failed, queues itself again for when the first retry is due.
+    """
+    counts = process_events()
+    if counts['retrying']:
+        retry_at = next_retry_at()
+        if retry_at is not None:
+            process_stripe_events.enqueue(delay=max((retry_at - timezone.now()).total_seconds(), 0))
@@ -1,3 +1,271 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import os
+import time
+from datetime import timedelta
+from unittest import mock
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from tasks.models import Task
+from .checks import check_entitlement_cache
+from .entitlements import get_entitlement, invalidate_entitlement, set_entitlement
+from .events import (
+    LEASE_SECONDS, MAX_ATTEMPTS, claim_next_event, handle_checkout_completed, process_events, process_next_event,
+    record_event,
+)
+from .models import StripeEvent
+from .tasks import process_stripe_events
 
-# Create your tests here.
+
+def stripe_event(event_id: str, created: int, subscription_id: str = 'sub_1', status: str = 'active') -> dict:
+    return {
+        'id': event_id,
+        'type': 'customer.subscription.updated',
+        'created': created,
+        'data': {'object': {'id': subscription_id, 'status': status, 'metadata': {}}},
+    }
+
+
+def store(event: dict) -> bool:
+    return record_event(json.dumps(event).encode())
+
+
+class EventLeaseTests(TestCase):
+
+    def setUp(self):
+        apply = mock.patch('subscriptions.events.apply_event')
+        self.apply = apply.start()
+        self.addCleanup(apply.stop)
+
+    def test_claim_leases_event(self):
+        store(stripe_event('evt_1', 100))
+        event = claim_next_event()
+        self.assertEqual(event.status, 'processing')
+        self.assertEqual(event.attempts, 1)
+        self.assertGreater(event.locked_until, timezone.now() + timedelta(seconds=LEASE_SECONDS - 5))
+        # Leased events are not handed out twice
+        self.assertIsNone(claim_next_event())
+
+    def test_later_events_wait_for_processing_event(self):
+        store(stripe_event('evt_1', 100))
+        store(stripe_event('evt_2', 200))
+        store(stripe_event('evt_3', 150, subscription_id='sub_2'))
+        self.assertEqual(claim_next_event().event_id, 'evt_1')
+        self.assertEqual(claim_next_event().event_id, 'evt_3')
+        self.assertIsNone(claim_next_event())
+
+    def test_expired_lease_is_claimed_again(self):
+        store(stripe_event('evt_1', 100))
+        stale = claim_next_event()
+        StripeEvent.objects.filter(pk=stale.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        event = process_next_event()
+        self.assertEqual(event.attempts, 2)
+        self.assertEqual(StripeEvent.objects.get(pk=stale.pk).status, 'processed')
+
+    def test_expired_worker_does_not_overwrite_outcome(self):
+        store(stripe_event('evt_1', 100))
+        stale = claim_next_event()
+        # Another worker took the event over after the lease expired
+        StripeEvent.objects.filter(pk=stale.pk).update(attempts=stale.attempts + 1)
+
+        self.apply.side_effect = RuntimeError('late failure')
+        with mock.patch('subscriptions.events.claim_next_event', return_value=stale):
+            process_next_event()
+        stored = StripeEvent.objects.get(pk=stale.pk)
+        self.assertEqual((stored.status, stored.last_error), ('processing', ''))
+
+    def test_failure_is_retried_then_given_up(self):
+        store(stripe_event('evt_1', 100))
+        self.apply.side_effect = RuntimeError('supabase down')
+
+        event = process_next_event()
+        stored = StripeEvent.objects.get(pk=event.pk)
+        self.assertEqual(stored.status, 'pending')
+        self.assertIsNone(stored.locked_until)
+        self.assertGreater(stored.next_attempt_at, timezone.now())
+        self.assertEqual(stored.last_error, 'supabase down')
+
+        StripeEvent.objects.filter(pk=event.pk).update(attempts=MAX_ATTEMPTS - 1, next_attempt_at=timezone.now())
+        process_next_event()
+        self.assertEqual(StripeEvent.objects.get(pk=event.pk).status, 'failed')
+
+    def test_task_requeues_itself_for_retries(self):
+        store(stripe_event('evt_1', 100))
+        self.apply.side_effect = RuntimeError('supabase down')
+        process_stripe_events()
+        task = Task.objects.get(name=process_stripe_events.name)
+        self.assertGreater(task.run_at, timezone.now())
+
+        Task.objects.all().delete()
+        self.apply.side_effect = None
+        StripeEvent.objects.update(next_attempt_at=timezone.now())
+        process_stripe_events()
+        self.assertFalse(Task.objects.exists())
+        self.assertEqual(StripeEvent.objects.get().status, 'processed')
+
+    def test_purge_keeps_recent_and_unprocessed_events(self):
+        store(stripe_event('evt_1', 100))
+        store(stripe_event('evt_2', 200))
+        process_events()
+        store(stripe_event('evt_3', 300))
+        StripeEvent.objects.filter(event_id__in=['evt_1', 'evt_3']).update(created_at=timezone.now() - timedelta(days=31))
+        self.assertEqual(StripeEvent.purge_processed(days=30), 1)
+        self.assertEqual(set(StripeEvent.objects.values_list('event_id', flat=True)), {'evt_2', 'evt_3'})
+
+
+class EventTransactionTests(TransactionTestCase):
+    """Remote calls run with no transaction open, so no row lock is held during them."""
+
+    def test_apply_runs_outside_transaction(self):
+        store(stripe_event('evt_1', 100))
+        seen = {}
+
+        def apply(event_type, obj):
+            seen['in_transaction'] = connection.in_atomic_block
+            seen['status'] = StripeEvent.objects.get(event_id='evt_1').status
+
+        with mock.patch('subscriptions.events.apply_event', side_effect=apply):
+            process_next_event()
+        self.assertEqual(seen, {'in_transaction': False, 'status': 'processing'})
+        self.assertEqual(StripeEvent.objects.get(event_id='evt_1').status, 'processed')
+
+
+class WebhookTests(TestCase):
+
+    def post(self, event: dict):
+        payload = json.dumps(event)
+        timestamp = int(time.time())
+        secret = os.environ['STRIPE_WEBHOOK_SECRET']
+        signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        return self.client.post(
+            '/api/subscriptions/webhook/',
+            payload,
+            content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}',
+        )
+
+    def test_new_event_queues_processing_task(self):
+        response = self.post(stripe_event('evt_1', 100))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(StripeEvent.objects.get().status, 'pending')
+        self.assertEqual(Task.objects.filter(name=process_stripe_events.name).count(), 1)
+
+    def test_redelivery_is_not_queued_again(self):
+        self.post(stripe_event('evt_1', 100))
+        self.post(stripe_event('evt_1', 100))
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertEqual(Task.objects.count(), 1)
+
+
+class EntitlementCacheTests(TestCase):
+
+    def setUp(self):
+        fetch = mock.patch('subscriptions.entitlements._fetch_entitlement', return_value=True)
+        self.fetch = fetch.start()
+        self.addCleanup(fetch.stop)
+        self.addCleanup(caches['default'].clear)
+
+    def test_lookup_is_cached(self):
+        self.assertTrue(get_entitlement('user-1'))
+        self.assertTrue(get_entitlement('user-1'))
+        self.assertEqual(self.fetch.call_count, 1)
+
+    def test_invalidation_from_another_process_is_seen(self):
+        self.assertTrue(get_entitlement('user-1'))
+        self.fetch.return_value = False
+        # The worker applying the webhook has its own cache connection
+        with override_settings(ENTITLEMENT_CACHE_ALIAS='other_process'):
+            invalidate_entitlement('user-1')
+        self.assertFalse(get_entitlement('user-1'))
+        self.assertEqual(self.fetch.call_count, 2)
+
+    def test_update_from_another_process_is_seen(self):
+        self.assertTrue(get_entitlement('user-1'))
+        with override_settings(ENTITLEMENT_CACHE_ALIAS='other_process'):
+            set_entitlement('user-1', False)
+        self.assertFalse(get_entitlement('user-1'))
+        self.assertEqual(self.fetch.call_count, 1)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_process_local_cache_is_not_used(self):
+        with self.assertLogs('subscriptions.entitlements', 'WARNING'):
+            get_entitlement('user-1')
+            get_entitlement('user-1')
+        self.assertEqual(self.fetch.call_count, 2)
+
+
+class WorkerEntitlementTests(TestCase):
+    """Events applied by the task worker update what the web process serves."""
+
+    def setUp(self):
+        fetch = mock.patch('subscriptions.entitlements._fetch_entitlement', return_value=True)
+        self.fetch = fetch.start()
+        self.addCleanup(fetch.stop)
+        supabase = mock.patch('subscriptions.events.get_supabase_client')
+        supabase.start()
+        self.addCleanup(supabase.stop)
+        self.addCleanup(caches['default'].clear)
+
+    def test_cancellation_reaches_web_process(self):
+        self.assertTrue(get_entitlement('user-1'))
+        event = stripe_event('evt_1', 100, status='canceled')
+        event['data']['object']['metadata'] = {'user_id': 'user-1'}
+        store(event)
+
+        self.fetch.return_value = False
+        with override_settings(ENTITLEMENT_CACHE_ALIAS='other_process'):
+            process_stripe_events()
+        self.assertEqual(StripeEvent.objects.get().status, 'processed')
+        self.assertFalse(get_entitlement('user-1'))
+
+    def test_process_local_cache_fails_startup_check(self):
+        self.assertEqual(check_entitlement_cache(None), [])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            errors = check_entitlement_cache(None)
+        self.assertEqual([error.id for error in errors], ['subscriptions.E001'])
+
+
+class CheckoutReplacementTests(TestCase):
+    """A completed checkout cancels the user's other subscriptions before removing their records."""
+
+    session = {
+        'client_reference_id': 'user-1',
+        'customer': 'cus_1',
+        'payment_status': 'paid',
+        'subscription': 'sub_new',
+        'amount_total': 9900,
+    }
+
+    def setUp(self):
+        self.supabase = mock.MagicMock()
+        self.supabase.table().select().eq().neq().in_().execute().data = [
+            {'stripe_subscription_id': 'sub_old', 'status': 'active'},
+            {'stripe_subscription_id': 'sub_unpaid', 'status': 'unpaid'},
+            {'stripe_subscription_id': 'sub_stuck', 'status': 'trialing'},
+        ]
+        self.deleted = self.supabase.table().delete().in_
+        self.upserted = self.supabase.table().upsert
+
+    def test_only_cancelled_records_are_removed(self):
+        def cancel(subscription_id):
+            if subscription_id == 'sub_stuck':
+                raise ConnectionError('stripe unavailable')
+
+        with mock.patch('subscriptions.events.stripe.Subscription.delete', side_effect=cancel) as delete, \
+                self.assertLogs('subscriptions.events', 'ERROR'):
+            with self.assertRaises(RuntimeError):
+                handle_checkout_completed(self.supabase, self.session)
+        self.assertEqual([c.args[0] for c in delete.call_args_list], ['sub_old', 'sub_stuck'])
+        # sub_stuck keeps its record, and the event is retried to cancel it
+        self.deleted.assert_called_once_with('stripe_subscription_id', ['sub_old', 'sub_unpaid'])
+        self.assertEqual(self.upserted.call_args.args[0]['stripe_subscription_id'], 'sub_new')
+
+    def test_all_cancelled(self):
+        with mock.patch('subscriptions.events.stripe.Subscription.delete') as delete:
+            handle_checkout_completed(self.supabase, self.session)
+        self.assertEqual(delete.call_count, 2)
+        self.deleted.assert_called_once_with('stripe_subscription_id', ['sub_old', 'sub_unpaid', 'sub_stuck'])
@@ -10,18 +10,10 @@ from rest_framework import status
 from rest_framework.views import APIView
 from django.utils.decorators import method_decorator
 from analyses.authentication import SupabaseAuthentication
-from supabase import create_client, Client
-
-
-def get_supabase_client() -> Client:
-    """Get Supabase client instance."""
-    url = os.environ.get("SUPABASE_URL") or os.environ.get("SUPABASE_PROJECT_URL")
-    key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY") or os.environ.get("SUPABASE_ANON_KEY")
-    
-    if not url or not key:
-        raise RuntimeError('Supabase credentials are missing.')
-    
-    return create_client(url, key)
+from backend.supabase_clients import get_supabase_client
+from .entitlements import get_entitlement
+from .events import record_event
+from .tasks import process_stripe_events
 
 
 # Initialize Stripe
@@ -80,6 +72,8 @@ class CreateCheckoutSessionView(APIView):
                 mode='subscription',
                 subscription_data={
                     'trial_period_days': 3,  # 3-day free trial
+                    # Lets subscription and invoice webhooks find the user without a lookup
+                    'metadata': {'user_id': user_id},
                 },
                 success_url=success_url + '?session_id={CHECKOUT_SESSION_ID}',
                 cancel_url=cancel_url,
@@ -119,15 +113,8 @@ class GetSubscriptionStatusView(APIView):
         try:
             user_id = request.user.user_id
             
-            # Query Supabase to get subscription status
-            supabase = get_supabase_client()
-            
-            # Check if user has active subscription in your database
-            # Count subscriptions with status = 'active' or 'trialing' (trial users should have access)
-            response = supabase.table('subscriptions').select('id').eq('user_id', user_id).in_('status', ['active', 'trialing']).execute()
-            
-            # Explicitly check for active/trialing subscriptions - only return true if we find at least one
-            has_active_subscription = bool(response.data and len(response.data) > 0)
+            # Active or trialing subscription, cached and kept fresh by the Stripe webhook
+            has_active_subscription = get_entitlement(user_id)
             
             return Response({
                 'has_active_subscription': has_active_subscription,
@@ -147,6 +134,8 @@ class StripeWebhookView(APIView):
     POST /api/subscriptions/webhook/
     
     This endpoint should be called by Stripe when subscription events occur.
+    Verified events are stored and acknowledged right away, then applied by
+    the process_stripe_events task (see subscriptions.events).
     """
     permission_classes = [AllowAny]
     authentication_classes = []
@@ -177,132 +166,10 @@ class StripeWebhookView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Handle the event
-        supabase = get_supabase_client()
-        
-        if event['type'] == 'checkout.session.completed':
-            session = event['data']['object']
-            user_id = session.get('client_reference_id')
-            customer_id = session.get('customer')
-            payment_status = session.get('payment_status')
-            subscription_id = session.get('subscription')
-            
-            # Only activate subscription if payment was successful
-            if payment_status == 'paid' and subscription_id:
-                # Delete any existing cancelled subscriptions for this user (cleanup old records)
-                # Also cancel any existing active or trialing subscriptions
-                existing_subs = supabase.table('subscriptions').select('stripe_subscription_id, status').eq('user_id', user_id).execute()
-                
-                if existing_subs.data:
-                    for existing_sub in existing_subs.data:
-                        existing_subscription_id = existing_sub.get('stripe_subscription_id')
-                        existing_status = existing_sub.get('status')
-                        
-                        if existing_subscription_id and existing_subscription_id != subscription_id:
-                            # If it's already cancelled/past_due/unpaid, just delete the record
-                            if existing_status in ['cancelled', 'past_due', 'unpaid']:
-                                try:
-                                    supabase.table('subscriptions').delete().eq('stripe_subscription_id', existing_subscription_id).execute()
-                                except Exception as delete_error:
-                                    print(f'Warning: Failed to delete old subscription {existing_subscription_id}: {str(delete_error)}')
-                            # If it's active or trialing, cancel it in Stripe first, then delete
-                            elif existing_status in ['active', 'trialing']:
-                                try:
-                                    # Cancel the existing subscription in Stripe
-                                    stripe.Subscription.delete(existing_subscription_id)
-                                    # Delete the record from database
-                                    supabase.table('subscriptions').delete().eq('stripe_subscription_id', existing_subscription_id).execute()
-                                except Exception as cancel_error:
-                                    print(f'Warning: Failed to cancel/delete existing subscription {existing_subscription_id}: {str(cancel_error)}')
-                                    # Try to just delete the record anyway
-                                    try:
-                                        supabase.table('subscriptions').delete().eq('stripe_subscription_id', existing_subscription_id).execute()
-                                    except:
-                                        pass
-                
-                # Get the subscription object to check its status (trial vs active)
-                subscription_obj = stripe.Subscription.retrieve(subscription_id)
-                subscription_status_from_stripe = subscription_obj.status
-                
-                # Map Stripe subscription status to our status
-                # Note: 'canceled' status should not happen here (new subscription), but if it does, skip creating it
-                if subscription_status_from_stripe == 'canceled':
-                    # Don't create a cancelled subscription
-                    return Response({'status': 'success'}, status=status.HTTP_200_OK)
-                
-                status_map = {
-                    'active': 'active',
-                    'trialing': 'trialing',
-                    'past_due': 'past_due',
-                    'unpaid': 'unpaid',
-                }
-                mapped_status = status_map.get(subscription_status_from_stripe, 'active')
-                
-                # Now create/update the new subscription
-                # Use stripe_subscription_id for conflict resolution since it's unique
-                supabase.table('subscriptions').upsert({
-                    'user_id': user_id,
-                    'stripe_customer_id': customer_id,
-                    'stripe_subscription_id': subscription_id,
-                    'status': mapped_status,  # Will be 'trialing' if in trial, 'active' otherwise
-                    'plan': session.get('metadata', {}).get('plan', 'yearly'),
-                }, on_conflict='stripe_subscription_id').execute()
-            # If payment failed, we don't create/update subscription
-            # The user will need to retry checkout
-            
-        elif event['type'] == 'customer.subscription.updated':
-            subscription = event['data']['object']
-            subscription_id = subscription.get('id')
-            subscription_status = subscription.get('status')
-            customer_id = subscription.get('customer')
-            
-            # If subscription is canceled, delete the record
-            if subscription_status == 'canceled':
-                supabase.table('subscriptions').delete().eq('stripe_subscription_id', subscription_id).execute()
-            else:
-                # Map Stripe subscription status to our status
-                status_map = {
-                    'active': 'active',
-                    'past_due': 'past_due',
-                    'unpaid': 'unpaid',
-                    'trialing': 'trialing',
-                }
-                
-                mapped_status = status_map.get(subscription_status, 'active')
-                
-                # Update subscription status in Supabase
-                supabase.table('subscriptions').update({
-                    'status': mapped_status,
-                }).eq('stripe_subscription_id', subscription_id).execute()
-            
-        elif event['type'] == 'customer.subscription.deleted':
-            subscription = event['data']['object']
-            subscription_id = subscription.get('id')
-            customer_id = subscription.get('customer')
-            
-            # Delete subscription record from Supabase
-            supabase.table('subscriptions').delete().eq('stripe_subscription_id', subscription_id).execute()
-            
-        elif event['type'] == 'invoice.payment_failed':
-            invoice = event['data']['object']
-            subscription_id = invoice.get('subscription')
-            customer_id = invoice.get('customer')
-            
-            # Update subscription status to past_due or unpaid
-            if subscription_id:
-                supabase.table('subscriptions').update({
-                    'status': 'past_due',
-                }).eq('stripe_subscription_id', subscription_id).execute()
-            
-        elif event['type'] == 'invoice.payment_succeeded':
-            invoice = event['data']['object']
-            subscription_id = invoice.get('subscription')
-            
-            # Reactivate subscription if it was past_due or unpaid
-            if subscription_id:
-                supabase.table('subscriptions').update({
-                    'status': 'active',
-                }).eq('stripe_subscription_id', subscription_id).execute()
+        # Store the event and acknowledge it; a task worker applies it in the background.
+        # A redelivered event is already stored and is not applied again.
+        if record_event(payload):
+            process_stripe_events.enqueue()
         
         return Response({'status': 'success'}, status=status.HTTP_200_OK)
 
@@ -0,0 +1,17 @@
+from django.contrib import admin
+from django.utils import timezone
+from .models import Task
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'status', 'attempts', 'max_attempts', 'run_at', 'locked_by', 'created_at']
+    list_filter = ['name', 'status', 'created_at']
+    search_fields = ['name', 'last_error']
+    ordering = ['-created_at']
+    readonly_fields = ['created_at', 'updated_at']
+    actions = ['retry_tasks']
+
+    @admin.action(description='Retry selected tasks now')
+    def retry_tasks(self, request, queryset):
+        queryset.update(status='queued', attempts=0, run_at=timezone.now(), locked_until=None, locked_by='')
@@ -0,0 +1,81 @@
+import os
+import signal
+import socket
+import threading
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from tasks.queue import claim_tasks, run_task
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks. Start as many workers as needed; they share the queue safely.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Number of tasks run at the same time by this worker (default: 4)'
+        )
+        parser.add_argument(
+            '--poll-seconds',
+            type=float,
+            default=1.0,
+            help='Seconds to wait before checking an empty queue again (default: 1)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run every task that is due and exit'
+        )
+
+    def handle(self, *args, **options):
+        self.stop = threading.Event()
+        self.counts = {'done': 0, 'retrying': 0, 'failed': 0}
+        self.counts_lock = threading.Lock()
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+
+        if not options['once']:
+            # Finish the running tasks, then exit
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(sig, lambda *_: self.stop.set())
+            self.stdout.write(f"Worker {worker_id} started with {options['concurrency']} threads")
+
+        threads = [
+            threading.Thread(
+                target=self.work,
+                args=(f'{worker_id}:{n}', options['poll_seconds'], options['once']),
+                name=f'task-worker-{n}',
+            )
+            for n in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Ran {sum(self.counts.values())} tasks: {self.counts['done']} done, "
+                f"{self.counts['retrying']} retrying, {self.counts['failed']} failed"
+            )
+        )
+
+    def work(self, worker_id: str, poll_seconds: float, once: bool):
+        while not self.stop.is_set():
+            try:
+                claimed = claim_tasks(worker_id)
+                for claimed_task in claimed:
+                    outcome = run_task(claimed_task, worker_id)
+                    with self.counts_lock:
+                        self.counts[outcome] += 1
+            except Exception as e:
+                self.stderr.write(f'Task worker error: {e}')
+                claimed = []
+            finally:
+                close_old_connections()
+
+            if not claimed:
+                if once:
+                    return
+                self.stop.wait(poll_seconds)
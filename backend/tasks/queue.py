@@ -0,0 +1,145 @@
+"""
+Background task queue backed by the Django database.
+
+Slow side effects (storage removals, Stripe cancellations, S3 cleanup,
+bulk expiry) are stored as Task rows and run by run_task_worker processes,
+so request threads only pay for one INSERT. Workers claim rows with
+SELECT ... FOR UPDATE SKIP LOCKED and need no broker besides Postgres.
+A claimed task is locked for its visibility timeout, and picked up again
+if its worker dies. Failed tasks are retried with exponential backoff
+until max_attempts.
+
+Tasks are plain functions registered with @task, named after their module
+and function so a worker can import them on demand. Arguments must be
+JSON serializable:
+
+    @task(max_attempts=3)
+    def cancel_subscription(stripe_subscription_id): ...
+
+    cancel_subscription.enqueue(stripe_subscription_id='sub_123')
+"""
+import os
+import logging
+from datetime import timedelta
+from importlib import import_module
+from typing import Optional
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+# Defaults for tasks that do not set their own
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 10  # seconds; doubled after every failed attempt
+
+# Seconds a claimed task stays invisible to other workers
+VISIBILITY_TIMEOUT = int(os.getenv('TASK_VISIBILITY_TIMEOUT', 300))
+
+_registry = {}
+
+
+class TaskFunction:
+    """A registered task. Calling it runs the function inline; enqueue() queues it."""
+
+    def __init__(self, func, name: str, max_attempts: int, retry_delay: int, timeout: int):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.__doc__ = func.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def enqueue(self, delay: float = 0, **kwargs) -> Task:
+        """Queue a run with keyword arguments, optionally delayed by some seconds."""
+        return Task.objects.create(
+            name=self.name,
+            payload=kwargs,
+            max_attempts=self.max_attempts,
+            run_at=timezone.now() + timedelta(seconds=delay),
+        )
+
+
+def task(name: str = None, max_attempts: int = MAX_ATTEMPTS, retry_delay: int = RETRY_DELAY, timeout: int = VISIBILITY_TIMEOUT):
+    """Register a function as a task. The name defaults to module.function."""
+    def decorator(func):
+        task_name = name or f"{func.__module__}.{func.__name__}"
+        task_function = TaskFunction(func, task_name, max_attempts, retry_delay, timeout)
+        _registry[task_name] = task_function
+        return task_function
+    return decorator
+
+
+def get_task(name: str) -> Optional[TaskFunction]:
+    """Look up a task, importing its module on first use in this process."""
+    if name not in _registry:
+        try:
+            import_module(name.rpartition('.')[0])
+        except ImportError:
+            return None
+    return _registry.get(name)
+
+
+def claim_tasks(worker_id: str, limit: int = 1) -> list:
+    """
+    Lock up to limit due tasks for this worker, oldest first.
+    Includes running tasks whose visibility timeout has passed.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        claimed = list(
+            Task.objects
+            .filter(Q(status='queued', run_at__lte=now) | Q(status='running', locked_until__lt=now))
+            .order_by('run_at', 'id')
+            .select_for_update(skip_locked=True)[:limit]
+        )
+        for claimed_task in claimed:
+            task_function = get_task(claimed_task.name)
+            timeout = task_function.timeout if task_function else VISIBILITY_TIMEOUT
+            claimed_task.status = 'running'
+            claimed_task.attempts += 1
+            claimed_task.locked_by = worker_id
+            claimed_task.locked_until = now + timedelta(seconds=timeout)
+            claimed_task.save(update_fields=['status', 'attempts', 'locked_by', 'locked_until', 'updated_at'])
+    return claimed
+
+
+def run_task(claimed_task: Task, worker_id: str) -> str:
+    """
+    Run a claimed task and record the outcome: 'done', 'retrying' or 'failed'.
+    Updates only apply while this worker still holds the task, so a task
+    that outlived its visibility timeout is not overwritten.
+    """
+    held = Task.objects.filter(id=claimed_task.id, locked_by=worker_id)
+    task_function = get_task(claimed_task.name)
+
+    try:
+        if task_function is None:
+            raise LookupError(f'Unknown task {claimed_task.name}')
+        if claimed_task.attempts > claimed_task.max_attempts:
+            raise TimeoutError('Visibility timeout expired on the last attempt')
+        task_function.func(**claimed_task.payload)
+    except Exception as e:
+        if task_function is None or claimed_task.attempts >= claimed_task.max_attempts:
+            held.update(status='failed', last_error=str(e), locked_until=None, updated_at=timezone.now())
+            logger.error("Task %s #%s failed after %d attempts: %s", claimed_task.name, claimed_task.id, claimed_task.attempts, e)
+            return 'failed'
+
+        delay = task_function.retry_delay * 2 ** (claimed_task.attempts - 1)
+        held.update(
+            status='queued',
+            run_at=timezone.now() + timedelta(seconds=delay),
+            last_error=str(e),
+            locked_until=None,
+            locked_by='',
+            updated_at=timezone.now(),
+        )
+        logger.warning("Task %s #%s failed, retrying in %ds: %s", claimed_task.name, claimed_task.id, delay, e)
+        return 'retrying'
+
+    held.delete()
+    return 'done'